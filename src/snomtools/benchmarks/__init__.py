@@ -0,0 +1,6 @@
+"""
+This module provides benchmarks for the time-critical entry points of snomtools, running on synthetic data of
+configurable size. See :mod:`snomtools.benchmarks.suite` for running them and comparing results against a baseline.
+
+"""
+__author__ = 'Michael Hartelt'
@@ -0,0 +1,483 @@
+"""
+This file holds the benchmark suite. Each benchmark times one of the real entry points of snomtools on synthetic
+data generated with :mod:`snomtools.benchmarks.synthetic`. Results are stored as JSON, so a run can be compared
+against a saved baseline, e.g. before and after a change::
+
+	python -m snomtools.benchmarks.suite --size small --output baseline.json
+	(apply change)
+	python -m snomtools.benchmarks.suite --size small --output new.json --baseline baseline.json
+
+The same can be done from python with :func:`run`, :func:`save`, :func:`load` and :func:`compare`.
+New benchmarks are added with the :func:`benchmark` decorator on a function that prepares everything that shall not
+be timed and returns a callable for the timed part.
+
+Each timed run is watched by a :class:`snomtools.data.resources.ResourceMonitor`, so the results also contain the
+peak RSS increase, the temp file usage and the number of full-array materializations. Benchmarks can declare budgets
+for these, which makes the suite fail if an out-of-core operation suddenly loads all data into memory. The
+threshold for recording materializations scales with the data size (see :attr:`Workspace.materialization_threshold`),
+so they are detected for all sizes. The RSS budgets contain a fixed allowance for buffers and caches, so they only
+detect loading all data into memory for sizes large compared to that, like :code:`"large"`.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+import os
+import json
+import shutil
+import tempfile
+import platform
+import datetime
+import argparse
+import collections
+import timeit
+import numpy
+import h5py
+import snomtools
+import snomtools.data.datasets
+import snomtools.data.resources
+import snomtools.data.imports.tiff
+import snomtools.evaluation.driftcorrection
+from snomtools.benchmarks import synthetic
+
+__author__ = 'Michael Hartelt'
+
+if '-v' in sys.argv:
+	verbose = True
+else:
+	verbose = False
+
+# The registered benchmarks, by name:
+benchmarks = collections.OrderedDict()
+
+
+# The declared resource budgets of the benchmarks, by name:
+budgets = {}
+
+
+def benchmark(name, **resource_budgets):
+	"""
+	A decorator registering a benchmark. The decorated function gets a :class:`Workspace` and returns a callable
+	without arguments that runs the timed operation.
+
+	:param str name: The name of the benchmark.
+
+	:param resource_budgets: Budgets for the timed operation, as for
+		:class:`snomtools.data.resources.ResourceMonitor`: :code:`rss`, :code:`temp_bytes` and
+		:code:`materializations`. Each can be a number or a function that gets the :class:`Workspace` and returns a
+		number, e.g. to scale with the size of the data.
+	"""
+
+	def decorator(setup):
+		assert name not in benchmarks, "Benchmark {0} already registered.".format(name)
+		benchmarks[name] = setup
+		budgets[name] = resource_budgets
+		return setup
+
+	return decorator
+
+
+def _out_of_core_rss(ws):
+	"""
+	The RSS budget for out-of-core operations: A fixed allowance for buffers and caches plus a quarter of the data, so
+	loading all data into memory is detected for any data size large compared to the allowance.
+	"""
+	return 64 * 1024 ** 2 + ws.nbytes // 4
+
+
+def _result_temp_bytes(ws):
+	"""
+	The temp file budget for operations creating a result of the size of the data: Twice the data size, so one result
+	and one intermediate are allowed.
+	"""
+	return 2 * ws.nbytes + 1024 ** 2
+
+
+class Workspace(object):
+	"""
+	The working directory and the synthetic data for a benchmark run. The data is generated lazily when a benchmark
+	needs it and shared by all benchmarks of a run.
+	"""
+
+	def __init__(self, size="small", workdir=None):
+		"""
+		:param size: The size of the synthetic data, see :func:`snomtools.benchmarks.synthetic.get_shape`.
+
+		:param str workdir: A directory to work in. If not given, a temporary directory is used, which is removed with
+			:func:`cleanup`.
+		"""
+		self.size = size
+		self.shape = synthetic.get_shape(size)
+		if workdir is None:
+			self.workdir = tempfile.mkdtemp(prefix="snomtools_benchmarks-")
+			self.own_workdir = True
+		else:
+			self.workdir = os.path.abspath(workdir)
+			if not os.path.exists(self.workdir):
+				os.makedirs(self.workdir)
+			self.own_workdir = False
+		self._dataset = None
+		self._template = None
+		self._folders = {}
+		self._counter = 0
+
+	@property
+	def nbytes(self):
+		"""
+		The size of the data of the synthetic DataSet in bytes.
+		"""
+		return int(numpy.prod(self.shape)) * numpy.dtype(numpy.float32).itemsize
+
+	@property
+	def materialization_threshold(self):
+		"""
+		The size in bytes from which on full-array materializations are recorded: The default of
+		:class:`snomtools.data.resources.ResourceMonitor` (1 MB), but at most half the data size, so materializations
+		of the data are also detected (and the budgets meaningful) for small sizes like :code:`"tiny"`.
+		"""
+		return min(1024 ** 2, self.nbytes // 2)
+
+	def budgets(self, name):
+		"""
+		Evaluates the declared budgets of a benchmark for this workspace.
+
+		:param str name: The name of the benchmark.
+
+		:rtype: dict
+		"""
+		return {key: budget(self) if callable(budget) else budget for key, budget in budgets.get(name, {}).items()}
+
+	def path(self, name):
+		"""
+		A new, unique path for a file in the working directory.
+
+		:param str name: The base name of the file.
+
+		:rtype: str
+		"""
+		self._counter += 1
+		base, ext = os.path.splitext(name)
+		return os.path.join(self.workdir, "{0}_{1:d}{2}".format(base, self._counter, ext))
+
+	@property
+	def dataset(self):
+		"""
+		The synthetic DataSet, in a HDF5 file in the working directory.
+		"""
+		if self._dataset is None:
+			path = os.path.join(self.workdir, "synthetic.hdf5")
+			self._dataset = synthetic.synthetic_dataset(self.size, h5target=path)
+		return self._dataset
+
+	@property
+	def template(self):
+		"""
+		A template for drift correction of the synthetic DataSet.
+		"""
+		if self._template is None:
+			self._template = synthetic.template_dataset(self.dataset)
+		return self._template
+
+	def terra_folder(self, detector="dld"):
+		"""
+		A synthetic Terra scan folder in the working directory.
+
+		:param str detector: :code:`"dld"` or :code:`"camera"`.
+
+		:return: The path of the folder.
+		:rtype: str
+		"""
+		if detector not in self._folders:
+			self._folders[detector] = synthetic.terra_scan_folder(os.path.join(self.workdir, "terra_" + detector),
+																  self.size, detector)
+		return self._folders[detector]
+
+	def cleanup(self):
+		"""
+		Closes the synthetic data and removes the working directory, if it is temporary.
+		"""
+		if self._dataset is not None:
+			self._dataset.h5target.close()
+			self._dataset = None
+		if self.own_workdir:
+			shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+@benchmark("import_terra_dld", materializations=0, rss=_out_of_core_rss)
+def bench_import_terra_dld(ws):
+	folder = ws.terra_folder("dld")
+	return lambda: snomtools.data.imports.tiff.measurement_folder_peem_terra(folder, "dld", h5target=True)
+
+
+@benchmark("import_terra_camera", materializations=0, rss=_out_of_core_rss)
+def bench_import_terra_camera(ws):
+	folder = ws.terra_folder("camera")
+	return lambda: snomtools.data.imports.tiff.measurement_folder_peem_terra(folder, "camera", h5target=True)
+
+
+@benchmark("project_nd", materializations=0, rss=_out_of_core_rss)
+def bench_project_nd(ws):
+	data = ws.dataset
+	return lambda: data.project_nd('delay')
+
+
+@benchmark("project_nd_image", materializations=0, rss=_out_of_core_rss)
+def bench_project_nd_image(ws):
+	data = ws.dataset
+	return lambda: data.project_nd('y', 'x')
+
+
+@benchmark("h5_sum", materializations=0, rss=_out_of_core_rss)
+def bench_h5_sum(ws):
+	dh = ws.dataset.get_datafield(0).data
+	return lambda: dh.sum()
+
+
+@benchmark("h5_sum_axis", materializations=0, rss=_out_of_core_rss)
+def bench_h5_sum_axis(ws):
+	dh = ws.dataset.get_datafield(0).data
+	return lambda: dh.sum(axis=1)
+
+
+@benchmark("h5_add", materializations=0, rss=_out_of_core_rss,
+		   temp_bytes=_result_temp_bytes)
+def bench_h5_add(ws):
+	dh = ws.dataset.get_datafield(0).data
+	return lambda: dh + dh
+
+
+@benchmark("h5_multiply_scalar", materializations=0, rss=_out_of_core_rss,
+		   temp_bytes=_result_temp_bytes)
+def bench_h5_multiply_scalar(ws):
+	dh = ws.dataset.get_datafield(0).data
+	return lambda: dh * 2.
+
+
+@benchmark("h5_shift_slice", materializations=0, rss=_out_of_core_rss)
+def bench_h5_shift_slice(ws):
+	dh = ws.dataset.get_datafield(0).data
+	return lambda: dh.shift_slice(numpy.s_[0], (0, 0, 1.5, -2.5), order=1)
+
+
+@benchmark("drift_calculation")
+def bench_drift_calculation(ws):
+	data, template = ws.dataset, ws.template
+	return lambda: snomtools.evaluation.driftcorrection.Drift(data, template=template, stackAxisID='delay')
+
+
+@benchmark("drift_corrected_data", materializations=0, rss=_out_of_core_rss)
+def bench_drift_corrected_data(ws):
+	vectors = [tuple(v) for v in synthetic.drift_vectors(ws.shape[0])]
+	drift = snomtools.evaluation.driftcorrection.Drift(ws.dataset, precalculated_drift=vectors, template=ws.template,
+														stackAxisID='delay', template_origin=(0, 0))
+	return lambda: drift.corrected_data(h5target=True)
+
+
+@benchmark("terra_maxmap_corrected_data", materializations=0, rss=_out_of_core_rss)
+def bench_terra_maxmap_corrected_data(ws):
+	maxmap = synthetic.maxima_map(ws.shape[2:], ws.shape[1])
+	maxmapcorrection = snomtools.evaluation.driftcorrection.Terra_maxmap(ws.dataset, precalculated_map=maxmap,
+																		 energyAxisID='channel', subpixel=False)
+	return lambda: maxmapcorrection.corrected_data(h5target=True)
+
+
+@benchmark("saveh5", materializations=0, rss=_out_of_core_rss)
+def bench_saveh5(ws):
+	data = ws.dataset
+	return lambda: data.saveh5(ws.path("saved.hdf5"))
+
+
+@benchmark("from_h5", materializations=0, rss=_out_of_core_rss)
+def bench_from_h5(ws):
+	path = ws.path("saved.hdf5")
+	ws.dataset.saveh5(path)
+	return lambda: snomtools.data.datasets.DataSet.from_h5file(path)
+
+
+def metadata(size):
+	"""
+	Information about the environment of a benchmark run, stored with the results.
+
+	:rtype: dict
+	"""
+	return {"snomtools": snomtools.__version__.strip(), "python": platform.python_version(),
+			"numpy": numpy.__version__, "h5py": h5py.version.version, "hdf5": h5py.version.hdf5_version,
+			"platform": platform.platform(), "cpus": os.cpu_count() if hasattr(os, 'cpu_count') else None,
+			"date": datetime.datetime.now().isoformat(), "size": size, "shape": list(synthetic.get_shape(size))}
+
+
+def run(names=None, size="small", repeat=3, workdir=None):
+	"""
+	Runs benchmarks.
+
+	:param names: The names of the benchmarks to run. Default: All registered benchmarks.
+	:type names: sequence of str
+
+	:param size: The size of the synthetic data, see :func:`snomtools.benchmarks.synthetic.get_shape`.
+
+	:param int repeat: The number of times each benchmark is timed.
+
+	:param str workdir: A directory to work in. Default: A temporary directory.
+
+	:return: The results, with the environment information under :code:`"meta"` and the times in seconds of each
+		benchmark under :code:`"benchmarks"`. Benchmarks that failed have an :code:`"error"` entry instead.
+		The maximum resource usage over the runs is stored under :code:`"resources"`, and exceeded budgets are listed
+		under :code:`"violations"`.
+	:rtype: dict
+	"""
+	if names is None:
+		names = list(benchmarks.keys())
+	for name in names:
+		assert name in benchmarks, "Unknown benchmark {0}".format(name)
+	results = {"meta": metadata(size), "benchmarks": collections.OrderedDict()}
+	ws = Workspace(size, workdir)
+	try:
+		for name in names:
+			if verbose:
+				print("Running benchmark {0}...".format(name))
+			try:
+				func = benchmarks[name](ws)
+				times, usage, violations = [], {}, []
+				for i in range(repeat):
+					with snomtools.data.resources.ResourceMonitor(
+							raise_on_violation=False, materialization_threshold=ws.materialization_threshold,
+							**ws.budgets(name)) as monitor:
+						start_time = timeit.default_timer()
+						result = func()
+						times.append(timeit.default_timer() - start_time)
+						del result
+					for key, value in monitor.usage().items():
+						usage[key] = max(usage.get(key, 0), value)
+					violations.extend(v for v in monitor.violations if v not in violations)
+			except Exception as e:
+				results["benchmarks"][name] = {"error": repr(e)}
+				if verbose:
+					print("... failed: {0!r}".format(e))
+				continue
+			results["benchmarks"][name] = {"times": times, "min": min(times), "median": float(numpy.median(times)),
+										   "resources": usage, "violations": violations}
+			if verbose:
+				print("... {0:.3f} s".format(min(times)))
+				for violation in violations:
+					print("... budget exceeded: {0}".format(violation))
+	finally:
+		ws.cleanup()
+	return results
+
+
+def save(results, path):
+	"""
+	Saves benchmark results as JSON.
+
+	:param dict results: The results as returned by :func:`run`.
+
+	:param str path: The path of the file to write.
+	"""
+	with open(path, 'w') as f:
+		json.dump(results, f, indent=2)
+
+
+def load(path):
+	"""
+	Loads benchmark results from JSON.
+
+	:param str path: The path of the file to read.
+
+	:rtype: dict
+	"""
+	with open(path) as f:
+		return json.load(f, object_pairs_hook=collections.OrderedDict)
+
+
+def compare(results, baseline, tolerance=0.1):
+	"""
+	Compares benchmark results against a baseline by the minimum times.
+
+	:param dict results: The results to compare.
+
+	:param dict baseline: The baseline results.
+
+	:param float tolerance: The relative change in time regarded as noise. Larger changes are marked as
+		:code:`"slower"` or :code:`"faster"`.
+
+	:return: For each benchmark in both results: The name, the baseline time, the new time, the ratio of new to
+		baseline time and the status (:code:`"slower"`, :code:`"faster"`, :code:`"same"` or :code:`"error"`).
+	:rtype: list(tuple)
+	"""
+	if results["meta"].get("shape") != baseline["meta"].get("shape"):
+		print("WARNING: Comparing benchmarks of different data shapes.")
+	comparison = []
+	for name, entry in results["benchmarks"].items():
+		if name not in baseline["benchmarks"]:
+			continue
+		base_entry = baseline["benchmarks"][name]
+		if "error" in entry or "error" in base_entry:
+			comparison.append((name, base_entry.get("min"), entry.get("min"), None, "error"))
+			continue
+		ratio = entry["min"] / base_entry["min"]
+		if ratio > 1 + tolerance:
+			status = "slower"
+		elif ratio < 1 - tolerance:
+			status = "faster"
+		else:
+			status = "same"
+		comparison.append((name, base_entry["min"], entry["min"], ratio, status))
+	return comparison
+
+
+def format_comparison(comparison):
+	"""
+	Formats the output of :func:`compare` as a table.
+
+	:rtype: str
+	"""
+	lines = ["{0:<32} {1:>12} {2:>12} {3:>8}  {4}".format("Benchmark", "Baseline / s", "New / s", "Ratio", "Status")]
+	for name, base, new, ratio, status in comparison:
+		lines.append("{0:<32} {1:>12} {2:>12} {3:>8}  {4}".format(
+			name, "-" if base is None else "{0:.4f}".format(base), "-" if new is None else "{0:.4f}".format(new),
+			"-" if ratio is None else "{0:.2f}".format(ratio), status))
+	return "\n".join(lines)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Run the snomtools benchmark suite on synthetic data.")
+	parser.add_argument("--size", default="small",
+						help="Size of the synthetic data: One of {0} or a shape like 10,16,64,64".format(
+							", ".join(synthetic.sizes)))
+	parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per benchmark.")
+	parser.add_argument("--only", nargs="+", help="Names of the benchmarks to run.")
+	parser.add_argument("--output", help="JSON file to save the results to.")
+	parser.add_argument("--baseline", help="JSON file with results to compare against.")
+	parser.add_argument("--tolerance", type=float, default=0.1, help="Relative time change regarded as noise.")
+	parser.add_argument("--workdir", help="Directory to work in. Default: A temporary directory.")
+	parser.add_argument("--list", action="store_true", help="List the available benchmarks and exit.")
+	parser.add_argument("-v", action="store_true", help="Verbose output.")
+	args = parser.parse_args(argv)
+	if args.list:
+		print("\n".join(benchmarks))
+		return 0
+	size = args.size if args.size in synthetic.sizes else tuple(int(n) for n in args.size.split(","))
+	results = run(args.only, size, args.repeat, args.workdir)
+	if args.output:
+		save(results, args.output)
+	violations = [(name, violation) for name, entry in results["benchmarks"].items()
+				  for violation in entry.get("violations", [])]
+	if args.baseline:
+		comparison = compare(results, load(args.baseline), args.tolerance)
+		print(format_comparison(comparison))
+		failed = any(status in ("slower", "error") for name, base, new, ratio, status in comparison)
+	else:
+		for name, entry in results["benchmarks"].items():
+			if "error" in entry:
+				print("{0:<32} ERROR: {1}".format(name, entry["error"]))
+			else:
+				print("{0:<32} {1:.4f} s".format(name, entry["min"]))
+		failed = any("error" in entry for entry in results["benchmarks"].values())
+	for name, violation in violations:
+		print("{0:<32} BUDGET EXCEEDED: {1}".format(name, violation))
+	return 1 if failed or violations else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
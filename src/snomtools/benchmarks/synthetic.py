@@ -0,0 +1,246 @@
+"""
+This file generates synthetic measurement data for benchmarks: Terra scan folders with DLD and camera tiff files as
+read by :mod:`snomtools.data.imports.tiff`, and DataSets of configurable size in HDF5 files.
+The data shows a few gaussian spots on a noisy background, which drift across the image along the scan (with known
+drift vectors) and have an energy spectrum whose maximum varies over the image (with a known maxima map), so drift
+correction and maxima map correction have something realistic to work on.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import numpy
+import tifffile
+from six import string_types
+import snomtools.data.datasets
+import snomtools.data.imports.tiff
+
+__author__ = 'Michael Hartelt'
+
+# Named sizes of the synthetic data: (scan steps, time channels, y pixels, x pixels)
+sizes = {
+	"tiny": (4, 8, 32, 32),
+	"small": (10, 16, 64, 64),
+	"medium": (20, 32, 128, 128),
+	"large": (40, 64, 256, 256),
+}
+
+
+def get_shape(size):
+	"""
+	Translates a size specification to a data shape.
+
+	:param size: A name of a size in :code:`sizes` or a shape tuple (scan steps, time channels, y pixels, x pixels).
+	:type size: str *or* tuple(int)
+
+	:rtype: tuple(int)
+	"""
+	if isinstance(size, string_types):
+		return sizes[size]
+	shape = tuple(int(n) for n in size)
+	assert len(shape) == 4, "Synthetic data shape must have 4 dimensions."
+	return shape
+
+
+def drift_vectors(steps, amplitude=3., seed=0):
+	"""
+	Generates the drift vectors of the synthetic data, as a random walk starting at (0, 0).
+
+	:param int steps: The number of scan steps.
+
+	:param float amplitude: The typical drift over the scan in pixels.
+
+	:param int seed: The seed for the random generator.
+
+	:return: The drift vectors (y, x) for each scan step.
+	:rtype: numpy.ndarray
+	"""
+	rng = numpy.random.RandomState(seed)
+	walk = numpy.cumsum(rng.normal(scale=amplitude / numpy.sqrt(max(steps, 1)), size=(steps, 2)), axis=0)
+	return walk - walk[0]
+
+
+def maxima_map(imageshape, channels):
+	"""
+	Generates the map of the channel index of the spectral maximum for each pixel of the synthetic data.
+
+	:param tuple imageshape: The shape of the image (y, x).
+
+	:param int channels: The number of time channels.
+
+	:rtype: numpy.ndarray
+	"""
+	y, x = numpy.meshgrid(numpy.linspace(-1, 1, imageshape[0]), numpy.linspace(-1, 1, imageshape[1]), indexing='ij')
+	return channels / 2. + channels / 8. * (x + 0.5 * y ** 2)
+
+
+def synthetic_images(shape, seed=0, spots=5):
+	"""
+	Generates the synthetic count data, one scan step at a time.
+
+	:param tuple shape: The shape of the data (scan steps, time channels, y pixels, x pixels).
+
+	:param int seed: The seed for the random generator.
+
+	:param int spots: The number of gaussian spots in the image.
+
+	:return: The data for each scan step, of shape (time channels, y pixels, x pixels).
+	:rtype: generator of numpy.ndarray
+	"""
+	steps, channels, ny, nx = shape
+	rng = numpy.random.RandomState(seed)
+	centers = rng.uniform(0.2, 0.8, size=(spots, 2)) * (ny, nx)
+	widths = rng.uniform(0.03, 0.08, size=spots) * min(ny, nx)
+	heights = rng.uniform(20, 100, size=spots)
+	maxmap = maxima_map((ny, nx), channels)
+	channel_index = numpy.arange(channels)[:, None, None]
+	spectrum = numpy.exp(-(channel_index - maxmap) ** 2 / (2 * (channels / 8.) ** 2))
+	y, x = numpy.mgrid[0:ny, 0:nx]
+	for drift in drift_vectors(steps, seed=seed):
+		image = numpy.full((ny, nx), 2.)
+		for (cy, cx), width, height in zip(centers + drift, widths, heights):
+			image += height * numpy.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2 * width ** 2))
+		yield rng.poisson(image * spectrum).astype(numpy.uint16)
+
+
+def terra_tags(scanvalue, roi_and_bin=None):
+	"""
+	Generates tiff tags like Terra writes them, in the format for :code:`tifffile`'s :code:`extratags`.
+
+	:param scanvalue: The value of the scan device for the image.
+
+	:param roi_and_bin: The values for the ROI and binning tag, of which indices 2, 5 and 8 are the first time
+		channel, the number of time channels and the time binning for DLD data.
+	:type roi_and_bin: list(int)
+
+	:rtype: list(tuple)
+	"""
+	tag_ids = snomtools.data.imports.tiff.terra_tag_ids
+	tags = [(int(tag_ids["usercomment"]), 's', 0, "snomtools synthetic benchmark data", True),
+			(int(tag_ids["date"]), 's', 0, "01.01.2020", True),
+			(int(tag_ids["time"]), 's', 0, "12:00:00", True),
+			(int(tag_ids["author"]), 's', 0, "snomtools", True),
+			(int(tag_ids["probe"]), 's', 0, "synthetic", True),
+			(int(tag_ids["delay_ist"]), 's', 0, str(scanvalue), True),
+			(int(tag_ids["delay_soll"]), 's', 0, str(scanvalue), True)]
+	if roi_and_bin is not None:
+		tags.append((int(tag_ids["roi_and_bin"]), 'i', len(roi_and_bin), list(roi_and_bin), True))
+	return tags
+
+
+def write_terra_dld_tiff(path, data, first_channel=0, channel_binning=1, scanvalue=0):
+	"""
+	Writes a tiff file like Terra does for DLD data: The time channel images preceded by the sum and the error image,
+	with the time binning in the ROI and binning tag.
+
+	:param str path: The path of the file to write.
+
+	:param numpy.ndarray data: The counts of shape (time channels, y pixels, x pixels).
+
+	:param int first_channel: The first time channel.
+
+	:param int channel_binning: The binning of the time channels.
+
+	:param scanvalue: The value of the scan device for the image.
+	"""
+	data = numpy.asarray(data, dtype=numpy.uint16)
+	sumimage = numpy.minimum(data.sum(axis=0), numpy.iinfo(numpy.uint16).max).astype(numpy.uint16)
+	errorimage = numpy.zeros_like(sumimage)
+	stack = numpy.concatenate([sumimage[None], errorimage[None], data])
+	roi_and_bin = [0, 0, first_channel, 0, 0, data.shape[0] * channel_binning, 0, 0, channel_binning]
+	tifffile.imwrite(path, stack, extratags=terra_tags(scanvalue, roi_and_bin))
+
+
+def write_terra_camera_tiff(path, data, scanvalue=0):
+	"""
+	Writes a tiff file like Terra does for camera images.
+
+	:param str path: The path of the file to write.
+
+	:param numpy.ndarray data: The image of shape (y pixels, x pixels).
+
+	:param scanvalue: The value of the scan device for the image.
+	"""
+	tifffile.imwrite(path, numpy.asarray(data, dtype=numpy.uint16), extratags=terra_tags(scanvalue))
+
+
+def terra_scan_folder(folderpath, size="small", detector="dld", pattern="D", seed=0):
+	"""
+	Generates a Terra scan folder that can be imported with
+	:func:`snomtools.data.imports.tiff.measurement_folder_peem_terra`.
+
+	:param str folderpath: The folder to write the files to. It is created if it doesn't exist.
+
+	:param size: The size of the data, see :func:`get_shape`. For camera data, the time channels are summed up.
+
+	:param str detector: :code:`"dld"` or :code:`"camera"`.
+
+	:param str pattern: The pattern in the filenames indicating the scan device, as in Terra.
+
+	:param int seed: The seed for the random generator.
+
+	:return: The path of the folder.
+	:rtype: str
+	"""
+	assert detector in ["dld", "camera"], "Invalid detector mode."
+	shape = get_shape(size)
+	if not os.path.exists(folderpath):
+		os.makedirs(folderpath)
+	for step, data in enumerate(synthetic_images(shape, seed)):
+		scanvalue = 10 * step
+		filename = os.path.join(folderpath, "synthetic_{0}{1:d}.tif".format(pattern, scanvalue))
+		if detector == "dld":
+			write_terra_dld_tiff(filename, data, scanvalue=scanvalue)
+		else:
+			write_terra_camera_tiff(filename, data.sum(axis=0), scanvalue=scanvalue)
+	return folderpath
+
+
+def synthetic_dataset(size="small", h5target=True, seed=0, chunks=True):
+	"""
+	Generates a DataSet of synthetic data with the axes delay, channel, y and x, like an imported and energy
+	calibrated time-resolved DLD measurement. The data is written one scan step at a time, so it doesn't need to fit
+	into memory.
+
+	:param size: The size of the data, see :func:`get_shape`.
+
+	:param h5target: The HDF5 target to write the DataSet to.
+	:type h5target: str **or** h5py.Group **or** True
+
+	:param int seed: The seed for the random generator.
+
+	:param chunks: The chunks of the data, as for :class:`snomtools.data.datasets.Data_Handler_H5`.
+
+	:rtype: snomtools.data.datasets.DataSet
+	"""
+	shape = get_shape(size)
+	axes = [snomtools.data.datasets.Axis(numpy.arange(shape[0]) * 10., 'fs', label='delay', plotlabel='Delay / fs'),
+			snomtools.data.datasets.Axis(numpy.arange(shape[1]), label='channel', plotlabel='Time Channel'),
+			snomtools.data.datasets.Axis(numpy.arange(shape[2]), 'pixel', label='y', plotlabel='y'),
+			snomtools.data.datasets.Axis(numpy.arange(shape[3]), 'pixel', label='x', plotlabel='x')]
+	dh = snomtools.data.datasets.Data_Handler_H5(unit='count', shape=shape, chunks=chunks)
+	for i, data in enumerate(synthetic_images(shape, seed)):
+		dh[i] = data
+	da = snomtools.data.datasets.DataArray(dh, label='counts', plotlabel='Counts', h5target=dh.h5target)
+	return snomtools.data.datasets.DataSet("synthetic " + "x".join(str(n) for n in shape), [da], axes,
+										   h5target=h5target)
+
+
+def template_dataset(dataset, stack_index=0):
+	"""
+	Cuts a template for drift correction out of the center of an image of a synthetic DataSet.
+
+	:param dataset: The synthetic DataSet, see :func:`synthetic_dataset`.
+
+	:param int stack_index: The index along the delay axis of the image to take the template from.
+
+	:return: The template, with the axes y and x.
+	:rtype: snomtools.data.datasets.DataSet
+	"""
+	ny, nx = dataset.shape[2], dataset.shape[3]
+	sel = numpy.s_[stack_index, :, ny // 4:ny * 3 // 4, nx // 4:nx * 3 // 4]
+	image = dataset.get_datafield(0).data[sel].magnitude.sum(axis=0)
+	axes = [snomtools.data.datasets.Axis(dataset.get_axis('y').data[sel[2]], label='y'),
+			snomtools.data.datasets.Axis(dataset.get_axis('x').data[sel[3]], label='x')]
+	return snomtools.data.datasets.DataSet("template", [snomtools.data.datasets.DataArray(image, 'count')], axes)
@@ -180,16 +180,30 @@ def units(stream):
 		yield e.units
 
 
-def meshgrid(*args):
+def meshgrid(*args, **kwargs):
 	"""
 	Does the same as numpy.meshgrid, but preserves units.
 
-	:return:
+	:param args: The 1D coordinate arrays (quantities or DataArrays).
+
+	:param kwargs: Keyword arguments:
+
+		* :code:`indexing`: :code:`'xy'` (the default) or :code:`'ij'`, see numpy.meshgrid. Use :code:`'ij'` to get
+		  grids of the shape of the corresponding data.
+
+		* :code:`lazy`: If :code:`True`, no dense coordinate arrays are built. Instead, read-only broadcast views with
+		  stride 0 along all other axes are returned, which need only the memory of the 1D coordinates. They can be
+		  used in arithmetic like the dense grids, and slicing a chunk of them costs nothing. Default: :code:`False`.
+
+	:return: A tuple of coordinate arrays as quantities.
 	"""
+	indexing = kwargs.pop('indexing', 'xy')
+	lazy = kwargs.pop('lazy', False)
+	assert not kwargs, "Invalid keyword arguments for meshgrid: {0}".format(list(kwargs.keys()))
 	unitbuffer = []
 	for x in args:
 		unitbuffer.append(str(x.units))
-	gridtup = numpy.meshgrid(*args)
+	gridtup = numpy.meshgrid(*[numpy.asarray(x) for x in args], indexing=indexing, copy=not lazy)
 	outlist = []
 	for i in range(len(gridtup)):
 		outlist.append(to_ureg(gridtup[i], unitbuffer[i]))
@@ -0,0 +1,422 @@
+"""
+This file provides a catalog for archives of HDF5 files containing DataSets, as written by DataSet.saveh5().
+The catalog is a local SQLite database, which holds the metadata of each file (label, shape, axes with units and
+ranges, datafields, savedate and version) as well as small cached projections of the data onto each axis. It is built
+and incrementally updated by scanning directories, so finding a measurement with certain properties doesn't require
+opening thousands of files. See:
+https://docs.python.org/3/library/sqlite3.html
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import sqlite3
+import warnings
+import numpy
+from six import string_types
+import snomtools.calcs.units as u
+from snomtools.data import h5tools
+
+__author__ = 'Michael Hartelt'
+
+if '-v' in sys.argv:
+	verbose = True
+else:
+	verbose = False
+
+# The database layout. Each scanned file has one entry in files, the others reference it and are deleted with it.
+catalog_schema = """
+CREATE TABLE IF NOT EXISTS files (
+	id INTEGER PRIMARY KEY,
+	path TEXT UNIQUE NOT NULL,
+	mtime REAL,
+	size INTEGER,
+	label TEXT,
+	shape TEXT,
+	ndim INTEGER,
+	savedate TEXT,
+	version TEXT,
+	indexed REAL
+);
+CREATE TABLE IF NOT EXISTS axes (
+	file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+	idx INTEGER,
+	label TEXT,
+	plotlabel TEXT,
+	unit TEXT,
+	length INTEGER,
+	first REAL,
+	last REAL,
+	base_unit TEXT,
+	base_min REAL,
+	base_max REAL
+);
+CREATE TABLE IF NOT EXISTS datafields (
+	file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+	idx INTEGER,
+	label TEXT,
+	plotlabel TEXT,
+	unit TEXT,
+	dtype TEXT
+);
+CREATE TABLE IF NOT EXISTS projections (
+	file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+	datafield INTEGER,
+	axis INTEGER,
+	data BLOB
+);
+CREATE INDEX IF NOT EXISTS files_label ON files(label);
+CREATE INDEX IF NOT EXISTS axes_file ON axes(file_id);
+CREATE INDEX IF NOT EXISTS axes_label ON axes(label, length);
+CREATE INDEX IF NOT EXISTS datafields_file ON datafields(file_id);
+CREATE INDEX IF NOT EXISTS projections_file ON projections(file_id, datafield, axis);
+"""
+
+
+class Catalog(object):
+	"""
+	A catalog of HDF5 DataSet files, kept in a SQLite database. Typical usage:
+
+	.. code-block:: python
+
+		catalog = Catalog("measurements.sqlite")
+		catalog.scan("/path/to/archive")
+		# All DLD delay scans with an energy axis covering 30 eV and more than 100 delay steps:
+		paths = catalog.find(label="%Terra Scan%", datafield="counts",
+							 axes={'energy': {'covers': "30 eV"}, 'delay': {'min_length': 101}})
+	"""
+
+	def __init__(self, dbpath):
+		"""
+		The constructor. Opens the database, which is created if it doesn't exist yet.
+
+		:param str dbpath: The path of the SQLite database file.
+		"""
+		self.dbpath = os.path.abspath(dbpath)
+		self.db = sqlite3.connect(self.dbpath)
+		self.db.execute("PRAGMA foreign_keys = ON")
+		self.db.executescript(catalog_schema)
+		self.db.commit()
+
+	def scan(self, folders, recursive=True, projections=True, extensions=(".hdf5", ".h5")):
+		"""
+		Scans folders for HDF5 DataSet files and updates the catalog. Only new and changed files (detected by
+		modification time and size) are read. Entries of files which were removed from the scanned folders are
+		deleted.
+
+		:param folders: The folder(s) to scan.
+		:type folders: str *or* list(str)
+
+		:param bool recursive: Scan subfolders as well.
+
+		:param bool projections: Calculate and store the projections of the data onto each axis. This needs to read
+			all data of new files once.
+
+		:param extensions: File extensions of the files to consider.
+		:type extensions: tuple(str)
+
+		:return: The number of files that were added or updated, and the number of entries that were removed.
+		:rtype: tuple(int)
+		"""
+		if isinstance(folders, string_types):
+			folders = [folders]
+		found = set()
+		updated = 0
+		for folder in folders:
+			folder = os.path.abspath(folder)
+			if recursive:
+				walker = os.walk(folder)
+			else:
+				walker = [(folder, [], os.listdir(folder))]
+			for dirpath, dirnames, filenames in walker:
+				for filename in sorted(filenames):
+					if os.path.splitext(filename)[1] not in extensions:
+						continue
+					path = os.path.join(dirpath, filename)
+					found.add(path)
+					if not self.is_current(path):
+						if self.add_file(path, projections=projections):
+							updated += 1
+		# Remove entries of files that vanished from the scanned folders:
+		removed = 0
+		for (path,) in self.db.execute("SELECT path FROM files").fetchall():
+			for folder in folders:
+				folder = os.path.abspath(folder)
+				if path.startswith(folder + os.sep) and path not in found:
+					if recursive or os.path.dirname(path) == folder:
+						self.remove_file(path)
+						removed += 1
+						break
+		self.db.commit()
+		return updated, removed
+
+	def is_current(self, path):
+		"""
+		Checks if a file is in the catalog and unchanged since it was indexed.
+
+		:param str path: The path of the file.
+
+		:rtype: bool
+		"""
+		path = os.path.abspath(path)
+		row = self.db.execute("SELECT mtime, size FROM files WHERE path = ?", (path,)).fetchone()
+		if row is None:
+			return False
+		stat = os.stat(path)
+		return row[0] == stat.st_mtime and row[1] == stat.st_size
+
+	def add_file(self, path, projections=True):
+		"""
+		Reads the metadata of a HDF5 DataSet file and stores it in the catalog, replacing an existing entry. The
+		file is opened read-only without file locking, data is only read if projections are requested.
+
+		:param str path: The path of the file.
+
+		:param bool projections: Calculate and store the projections of the data onto each axis.
+
+		:return: True if the file was added, False if it could not be read as a DataSet.
+		:rtype: bool
+		"""
+		path = os.path.abspath(path)
+		stat = os.stat(path)
+		if verbose:
+			print("Indexing {0}".format(path))
+		try:
+			h5source = h5tools.File(path, 'r', locking=False)
+		except (IOError, OSError) as e:
+			warnings.warn("Catalog could not open {0}: {1}".format(path, e))
+			return False
+		try:
+			if not ("datafields" in h5source and "axes" in h5source):
+				warnings.warn("Catalog ignores {0}: No DataSet structure found.".format(path))
+				return False
+			self.remove_file(path)
+			cursor = self.db.execute("INSERT INTO files (path, mtime, size, label, savedate, version, indexed) "
+									 "VALUES (?, ?, ?, ?, ?, ?, ?)",
+									 (path, stat.st_mtime, stat.st_size, _read_str(h5source, "label"),
+									  _read_str(h5source, "savedate"), _read_str(h5source, "version"), time.time()))
+			file_id = cursor.lastrowid
+
+			# Axes: Store range in original unit as well as in base units, to compare quantities of any unit.
+			for axis_name in h5source["axes"]:
+				grp = h5source["axes"][axis_name]
+				if "index" not in grp:
+					continue
+				values = grp["data"][()]
+				unit = _read_str(grp, "unit")
+				first, last = float(values[0]), float(values[-1])
+				base = u.to_ureg(numpy.array([numpy.nanmin(values), numpy.nanmax(values)], dtype=float),
+								 unit).to_base_units()
+				self.db.execute("INSERT INTO axes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+								(file_id, int(grp["index"][()]), _read_str(grp, "label"), _read_str(grp, "plotlabel"),
+								 unit, len(values), first, last, str(base.units),
+								 float(base.magnitude[0]), float(base.magnitude[1])))
+
+			shape = None
+			fieldgroups = []
+			for field_name in h5source["datafields"]:
+				grp = h5source["datafields"][field_name]
+				index = int(grp["index"][()]) if "index" in grp else len(fieldgroups)
+				fieldgroups.append((index, grp))
+				shape = grp["data"].shape
+				self.db.execute("INSERT INTO datafields VALUES (?, ?, ?, ?, ?, ?)",
+								(file_id, index, _read_str(grp, "label"), _read_str(grp, "plotlabel"),
+								 _read_str(grp, "unit"), str(grp["data"].dtype)))
+			if shape is not None:
+				self.db.execute("UPDATE files SET shape = ?, ndim = ? WHERE id = ?",
+								(json.dumps(list(shape)), len(shape), file_id))
+
+			if projections:
+				for index, grp in fieldgroups:
+					for axis, projection in enumerate(project_all_axes(grp["data"])):
+						self.db.execute("INSERT INTO projections VALUES (?, ?, ?, ?)",
+										(file_id, index, axis, sqlite3.Binary(projection.tobytes())))
+		except (KeyError, ValueError) as e:  # Not a valid DataSet file.
+			warnings.warn("Catalog could not index {0}: {1}".format(path, e))
+			self.db.rollback()
+			return False
+		except Exception:  # Don't leave a partial entry in the pending transaction.
+			self.db.rollback()
+			raise
+		finally:
+			h5source.close()
+		self.db.commit()
+		return True
+
+	def remove_file(self, path):
+		"""
+		Removes the entry of a file from the catalog, if it exists.
+
+		:param str path: The path of the file.
+		"""
+		self.db.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(path),))
+
+	def find(self, label=None, datafield=None, axes=None, ndim=None):
+		"""
+		Searches the catalog for files matching all given conditions. No file is opened for this.
+
+		:param str label: A pattern the DataSet label must match, as for the SQL LIKE operator, so :code:`%` matches
+			any string. Matching is case-insensitive.
+
+		:param str datafield: A label of a datafield that must exist in the DataSet.
+
+		:param dict axes: Conditions for axes, given as a dict with axis labels as keys and dicts of conditions as
+			values. Valid conditions are:
+				* :code:`'covers'`: A value (quantity or castable, like "30 eV") or list of values that must lie
+				  within the range of the axis. Units are converted as necessary.
+				* :code:`'min_length'`, :code:`'max_length'`: Limits for the number of points on the axis.
+				* :code:`'unit'`: A unit the axis must have the dimensionality of.
+
+		:param int ndim: The number of dimensions of the data.
+
+		:return: The paths of the matching files, sorted.
+		:rtype: list(str)
+		"""
+		query = "SELECT f.path FROM files f WHERE 1"
+		params = []
+		if label is not None:
+			query += " AND f.label LIKE ?"
+			params.append(label)
+		if ndim is not None:
+			query += " AND f.ndim = ?"
+			params.append(int(ndim))
+		if datafield is not None:
+			query += " AND EXISTS (SELECT 1 FROM datafields d WHERE d.file_id = f.id AND d.label = ?)"
+			params.append(datafield)
+		if axes:
+			for axis_label, conditions in axes.items():
+				subquery = "SELECT 1 FROM axes a WHERE a.file_id = f.id AND a.label = ?"
+				params.append(axis_label)
+				for key, value in conditions.items():
+					if key == 'covers':
+						if not isinstance(value, (list, tuple)):
+							value = [value]
+						for v in value:
+							v = u.to_ureg(v).to_base_units()
+							subquery += " AND a.base_unit = ? AND a.base_min <= ? AND a.base_max >= ?"
+							params.extend([str(v.units), float(v.magnitude), float(v.magnitude)])
+					elif key == 'min_length':
+						subquery += " AND a.length >= ?"
+						params.append(int(value))
+					elif key == 'max_length':
+						subquery += " AND a.length <= ?"
+						params.append(int(value))
+					elif key == 'unit':
+						subquery += " AND a.base_unit = ?"
+						params.append(str(u.to_ureg(1, value).to_base_units().units))
+					else:
+						raise ValueError("Unrecognized axis condition '{0}' in Catalog.find".format(key))
+				query += " AND EXISTS (" + subquery + ")"
+		query += " ORDER BY f.path"
+		return [row[0] for row in self.db.execute(query, params)]
+
+	def info(self, path):
+		"""
+		Returns the cataloged metadata of a file.
+
+		:param str path: The path of the file.
+
+		:return: A dict with the keys 'path', 'label', 'shape', 'savedate', 'version', 'axes' and 'datafields'. The
+			axes and datafields are lists of dicts with the corresponding metadata, sorted by their index in the
+			DataSet.
+		:rtype: dict
+		"""
+		path = os.path.abspath(path)
+		row = self.db.execute("SELECT id, label, shape, savedate, version FROM files WHERE path = ?",
+							  (path,)).fetchone()
+		if row is None:
+			raise KeyError("File {0} not in catalog.".format(path))
+		file_id, label, shape, savedate, version = row
+		info = {'path': path, 'label': label, 'shape': tuple(json.loads(shape)) if shape else (),
+				'savedate': savedate, 'version': version}
+		info['axes'] = [{'label': r[0], 'plotlabel': r[1], 'unit': r[2], 'length': r[3], 'range': (r[4], r[5])}
+						for r in self.db.execute("SELECT label, plotlabel, unit, length, first, last FROM axes "
+												 "WHERE file_id = ? ORDER BY idx", (file_id,))]
+		info['datafields'] = [{'label': r[0], 'plotlabel': r[1], 'unit': r[2], 'dtype': r[3]}
+							  for r in self.db.execute("SELECT label, plotlabel, unit, dtype FROM datafields "
+													   "WHERE file_id = ? ORDER BY idx", (file_id,))]
+		return info
+
+	def get_projection(self, path, axis=0, datafield=0):
+		"""
+		Returns a cached projection of the data onto one axis, meaning the sum over all other axes.
+
+		:param str path: The path of the file.
+
+		:param axis: The label or index of the axis to project onto.
+		:type axis: str *or* int
+
+		:param datafield: The label or index of the datafield.
+		:type datafield: str *or* int
+
+		:return: The projected data, in the unit of the datafield.
+		:rtype: pint.Quantity
+		"""
+		info = self.info(path)
+		if not isinstance(axis, int):
+			axis = [a['label'] for a in info['axes']].index(axis)
+		if not isinstance(datafield, int):
+			datafield = [d['label'] for d in info['datafields']].index(datafield)
+		row = self.db.execute("SELECT p.data FROM projections p JOIN files f ON p.file_id = f.id "
+							  "WHERE f.path = ? AND p.datafield = ? AND p.axis = ?",
+							  (info['path'], datafield, axis)).fetchone()
+		if row is None:
+			raise KeyError("No projection cached for {0}.".format(path))
+		return u.to_ureg(numpy.frombuffer(row[0], dtype=numpy.float64).copy(), info['datafields'][datafield]['unit'])
+
+	def __len__(self):
+		return self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+	def close(self):
+		self.db.close()
+
+
+def _read_str(h5group, name):
+	"""
+	Reads a string dataset from a group if it exists.
+
+	:return: The string, or None if the dataset doesn't exist.
+	"""
+	if name in h5group:
+		return h5tools.read_as_str(h5group[name])
+	return None
+
+
+def project_all_axes(h5data):
+	"""
+	Calculates the projections of a h5 dataset onto each of its axes in a single pass over the data, reading it
+	chunk-wise. This is much faster than projecting onto each axis separately.
+
+	:param h5data: The dataset to project.
+	:type h5data: h5py.Dataset
+
+	:return: A list of 1D float64 arrays, one for each axis, containing the sum over all other axes.
+	:rtype: list(numpy.ndarray)
+	"""
+	shape = h5data.shape
+	projections = [numpy.zeros(n, dtype=numpy.float64) for n in shape]
+	if not shape:
+		return projections
+	if h5data.chunks:
+		blockshape = h5data.chunks
+	else:  # Read slabs along the first axis.
+		blockshape = (1,) + shape[1:]
+	for start in numpy.ndindex(*[int(numpy.ceil(n / float(c))) for n, c in zip(shape, blockshape)]):
+		selection = tuple(slice(i * c, min((i + 1) * c, n)) for i, c, n in zip(start, blockshape, shape))
+		block = numpy.asarray(h5data[selection], dtype=numpy.float64)
+		for axis in range(len(shape)):
+			others = tuple(a for a in range(len(shape)) if a != axis)
+			projections[axis][selection[axis]] += numpy.nansum(block, axis=others)
+	return projections
+
+
+if __name__ == "__main__":
+	catalog = Catalog("catalog_test.sqlite")
+	print(catalog.scan(os.getcwd()))
+	for p in catalog.find(axes={'energy': {'covers': "30 eV"}, 'delay': {'min_length': 101}}):
+		print(p)
+	catalog.close()
@@ -15,11 +15,26 @@ import datetime
 import warnings
 import sys
 import itertools
+import functools
+import collections
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from six.moves import builtins
 import snomtools.calcs.units as u
 from snomtools.data import h5tools
+from snomtools.data import tools
+from snomtools.data import profiling
+from snomtools.data import resources
+import snomtools.data.readahead
 from snomtools import __package__, __version__
 from snomtools.data.tools import full_slice, broadcast_shape, broadcast_indices
 
+try:
+	from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+	shared_memory = None
+
 __author__ = 'Michael Hartelt'
 
 if '-v' in sys.argv:
@@ -27,6 +42,262 @@ if '-v' in sys.argv:
 else:
 	verbose = False
 
+# The statistics stored for each chunk in the chunk statistics index of Data_Handler_H5, see build_chunkstats():
+chunkstats_fields = ('sum', 'min', 'max', 'nonzero', 'nan')
+
+
+def _cached_stat(handler, name, calc):
+	"""
+	Returns a global statistic of the data of a handler (e.g. its maximum), calculating it with calc only if it is not
+	cached yet. The cache is kept on the handler and cleared by all writes through the handler, see
+	:func:`Data_Handler_H5._invalidate_stats`. Writes bypassing the handler, like to its bare h5py dataset, are not
+	tracked. Numpy mode data is not cached, as it is written through views in many ways.
+
+	:param handler: The Data_Handler_H5.
+
+	:param str name: The name of the statistic.
+
+	:param calc: A function without arguments, calculating the statistic.
+
+	:return: The statistic.
+	"""
+	if handler._stats is None:
+		handler._stats = {}
+	if name not in handler._stats:
+		handler._stats[name] = calc()
+	return handler._stats[name]
+
+
+class _ChunkWriteBuffer(object):
+	"""
+	A write-combining buffer for a chunked HDF5 dataset, see :func:`Data_Handler_H5.buffer_writes`. Partial writes are
+	collected per chunk in memory. A chunk is written to the dataset as soon as it is completely covered, so each
+	chunk is compressed only once. Partially covered chunks are merged with the data on disk when the memory budget
+	is exceeded (oldest first) and on :func:`flush`. Not thread-safe.
+	"""
+
+	def __init__(self, dataset, max_memory):
+		"""
+		:param h5py.Dataset dataset: The chunked dataset to write to.
+
+		:param int max_memory: The memory budget for buffered chunks in bytes.
+		"""
+		assert dataset.chunks, "Write buffering requires chunked data."
+		self.dataset = dataset
+		self.max_memory = max_memory
+		self.pending = collections.OrderedDict()  # Chunk index: (buffer, mask of written elements)
+		self.nbytes = 0
+
+	def __len__(self):
+		return len(self.pending)
+
+	def _chunk_selection(self, index):
+		return tuple(slice(i * c, min((i + 1) * c, n)) for i, c, n in zip(index, self.dataset.chunks,
+																		   self.dataset.shape))
+
+	def write(self, key, value):
+		"""
+		Writes data into the buffer.
+
+		:param key: The index of the data to write. Only integers and slices with step 1 are buffered.
+
+		:param value: The data to write, broadcastable to the selected shape, as numeric data in the unit of the data.
+
+		:return: :code:`False` if the key is not supported and the data was not written, else :code:`True`.
+		"""
+		shape = self.dataset.shape
+		bounds, kept_shape, full_shape = [], [], []
+		try:
+			key = full_slice(key, len(shape))
+			if len(key) != len(shape):
+				return False
+			for k, n in zip(key, shape):
+				if isinstance(k, slice):
+					start, stop, step = k.indices(n)
+					if step != 1:
+						return False
+					stop = max(start, stop)
+					kept_shape.append(stop - start)
+				else:
+					start = int(k)
+					if start != k:
+						return False
+					if start < 0:
+						start += n
+					assert 0 <= start < n, "Index out of range."
+					stop = start + 1
+				bounds.append((start, stop))
+				full_shape.append(stop - start)
+		except TypeError:  # Fancy indexing, Ellipsis etc.
+			return False
+		value = numpy.asarray(value)
+		if value.size == numpy.prod(full_shape, dtype=numpy.int64):
+			value = value.reshape(full_shape)
+		else:
+			value = numpy.broadcast_to(value, tuple(kept_shape)).reshape(full_shape)
+		if not value.size:
+			return True
+
+		chunks = self.dataset.chunks
+		for index in itertools.product(*[range(a // c, (b - 1) // c + 1) for (a, b), c in zip(bounds, chunks)]):
+			chunk_selection = self._chunk_selection(index)
+			overlap = [(max(a, s.start), min(b, s.stop)) for (a, b), s in zip(bounds, chunk_selection)]
+			in_chunk = tuple(slice(lo - s.start, hi - s.start) for (lo, hi), s in zip(overlap, chunk_selection))
+			in_value = tuple(slice(lo - a, hi - a) for (lo, hi), (a, b) in zip(overlap, bounds))
+			entry = self.pending.get(index)
+			if entry is None:
+				if all(lo == s.start and hi == s.stop for (lo, hi), s in zip(overlap, chunk_selection)):
+					# The whole chunk is written at once, so there is nothing to combine:
+					self.dataset[chunk_selection] = value[in_value]
+					continue
+				chunkshape = tuple(s.stop - s.start for s in chunk_selection)
+				entry = (numpy.empty(chunkshape, dtype=self.dataset.dtype), numpy.zeros(chunkshape, dtype=bool))
+				self.pending[index] = entry
+				self.nbytes += entry[0].nbytes + entry[1].nbytes
+			buffer, mask = entry
+			buffer[in_chunk] = value[in_value]
+			mask[in_chunk] = True
+			if mask.all():
+				self._write_chunk(index)
+		while self.nbytes > self.max_memory and self.pending:
+			self._write_chunk(next(iter(self.pending)))
+		return True
+
+	def _write_chunk(self, index):
+		"""
+		Writes a buffered chunk to the dataset and removes it from the buffer. Elements that were not written are
+		read from the dataset first.
+		"""
+		buffer, mask = self.pending.pop(index)
+		self.nbytes -= buffer.nbytes + mask.nbytes
+		selection = self._chunk_selection(index)
+		if not mask.all():
+			buffer = numpy.where(mask, buffer, self.dataset[selection])
+		self.dataset[selection] = buffer
+
+	def flush(self):
+		"""
+		Writes all buffered chunks to the dataset.
+
+		:return: Nothing.
+		"""
+		while self.pending:
+			self._write_chunk(next(iter(self.pending)))
+
+
+def _is_index_array(k):
+	"""
+	:code:`True` if k is an integer array or boolean mask (or a list of them) as used for numpy advanced indexing.
+	"""
+	return isinstance(k, (list, numpy.ndarray)) and numpy.ndim(k) > 0
+
+
+def _read_fancy(dataset, key, chunks=None):
+	"""
+	Reads a selection with integer arrays and boolean masks (numpy advanced indexing) from a HDF5 dataset. The selected
+	points are grouped by the chunks they are in, and each group is read as one box spanning only its points, in
+	sorted order and coalesced with groups in adjacent chunks along the last indexed axis. The values are gathered and
+	arranged like numpy would, so unsorted and repeated indices are supported. The amount of data read is therefore
+	about the size of the chunks containing selected points, instead of the whole data.
+
+	:param h5py.Dataset dataset: The dataset to read from.
+
+	:param tuple key: The selection, consisting of integer arrays, boolean masks, integers, slices with positive
+		step, and at most one Ellipsis.
+
+	:param tuple chunks: The chunk shape to group by. Default: The chunks of the dataset. For contiguous data, each
+		index is its own group.
+
+	:return: The selected data, or None if the key contains no index arrays or elements that are not supported.
+	:rtype: numpy.ndarray
+	"""
+	shape = dataset.shape
+	key = key if isinstance(key, tuple) else (key,)
+	if not any(_is_index_array(k) for k in key):
+		return None
+	# Expand Ellipsis and boolean masks, which consume as many axes as they have dimensions:
+	consumed = sum(numpy.ndim(k) if _is_index_array(k) and numpy.asarray(k).dtype == bool else 1
+				   for k in key if k is not Ellipsis)
+	expanded = []
+	for k in key:
+		if k is Ellipsis:
+			expanded.extend([slice(None)] * (len(shape) - consumed))
+		elif k is None or isinstance(k, (bool, numpy.bool_)):  # New axes are not supported.
+			return None
+		elif _is_index_array(k) and numpy.asarray(k).dtype == bool:
+			mask = numpy.asarray(k)
+			axes = shape[len(expanded):len(expanded) + mask.ndim]
+			if mask.shape != axes:
+				raise IndexError("Boolean index of shape {0} does not match data shape {1}.".format(mask.shape, axes))
+			expanded.extend(numpy.nonzero(mask))
+		else:
+			expanded.append(k)
+	if len(expanded) > len(shape):
+		raise IndexError("Too many indices for data of shape {0}.".format(shape))
+	expanded.extend([slice(None)] * (len(shape) - len(expanded)))
+
+	# Sort the elements into index arrays (advanced) and basic elements:
+	adv_axes, adv_arrays, basic = [], [], []
+	for axis, (k, n) in enumerate(zip(expanded, shape)):
+		if _is_index_array(k):
+			k = numpy.asarray(k)
+			if not k.size:  # Empty lists are float arrays for numpy.asarray, but index nothing like in numpy.
+				k = k.astype(numpy.intp)
+			if k.dtype.kind not in 'iu':
+				raise IndexError("Arrays used as indices must be of integer or boolean type.")
+			k = numpy.where(k < 0, k + n, k)
+			if k.size and (k.min() < 0 or k.max() >= n):
+				raise IndexError("Index out of range for axis {0} with size {1}.".format(axis, n))
+			adv_axes.append(axis)
+			adv_arrays.append(k)
+		elif isinstance(k, slice):
+			if k.indices(n)[2] < 0:  # Not supported by h5py.
+				return None
+			basic.append(axis)
+		else:
+			basic.append(axis)
+	broadcast = numpy.broadcast_arrays(*adv_arrays)
+	points_shape = broadcast[0].shape
+	coords = numpy.stack([a.ravel() for a in broadcast], axis=1)  # (points, advanced axes)
+	basic_shape = [len(range(*expanded[axis].indices(shape[axis]))) for axis in basic
+				   if isinstance(expanded[axis], slice)]
+	out = numpy.empty((len(coords),) + tuple(basic_shape), dtype=dataset.dtype)
+
+	if coords.size:
+		if chunks is None:
+			chunks = dataset.chunks or (1,) * len(shape)
+		adv_chunks = numpy.array([chunks[axis] for axis in adv_axes])
+		chunk_ids = coords // adv_chunks
+		# Sort the points by chunk, and coalesce groups of adjacent chunks along the last advanced axis:
+		order = numpy.lexsort(chunk_ids.T[::-1])
+		sorted_ids = chunk_ids[order]
+		step = numpy.diff(sorted_ids, axis=0)
+		new_group = numpy.any(step[:, :-1] != 0, axis=1) | (step[:, -1] > 1)
+		bounds = numpy.concatenate(([0], numpy.nonzero(new_group)[0] + 1, [len(order)]))
+		# Positions of the advanced axes in the read block, where integer axes are dropped:
+		block_axes = [axis for axis in range(len(shape)) if axis in adv_axes or isinstance(expanded[axis], slice)]
+		adv_in_block = [block_axes.index(axis) for axis in adv_axes]
+		for start, stop in zip(bounds[:-1], bounds[1:]):
+			points = order[start:stop]
+			lo = coords[points].min(axis=0)
+			hi = coords[points].max(axis=0) + 1
+			selection = list(expanded)
+			for i, axis in enumerate(adv_axes):
+				selection[axis] = slice(int(lo[i]), int(hi[i]))
+			block = dataset[tuple(selection)]
+			block = numpy.moveaxis(block, adv_in_block, list(range(len(adv_axes))))
+			out[points] = block[tuple((coords[points] - lo).T)]
+
+	# Arrange the result like numpy: The point dimensions replace the indexed axes if these (including integers) are
+	# adjacent in the key, else they come first.
+	out = out.reshape(points_shape + tuple(basic_shape))
+	indexed = [axis for axis in range(len(shape)) if not isinstance(expanded[axis], slice)]
+	if indexed == list(range(indexed[0], indexed[-1] + 1)):
+		position = sum(1 for axis in range(indexed[0]) if isinstance(expanded[axis], slice))
+		out = numpy.moveaxis(out, list(range(len(points_shape))),
+							 list(range(position, position + len(points_shape))))
+	return out
+
 
 class Data_Handler_H5(u.Quantity):
 	"""
@@ -34,8 +305,29 @@ class Data_Handler_H5(u.Quantity):
 	This "H5 mode" handler keeps the data in h5py objects, but provides access to data as if it were a quantity.
 	"""
 
+	# Cache of global statistics of the data, see _cached_stat(). Defined on class level, because looking up a missing
+	# instance attribute would load the data via Quantity.__getattr__.
+	_stats = None
+	# The write-combining buffer, see buffer_writes():
+	_write_buffer = None
+	_ds_data = None
+
+	def _get_ds_data(self):
+		# All access to the dataset goes through here, so buffered writes are written before anyone reads:
+		if self._write_buffer:
+			self._write_buffer.flush()
+		return self._ds_data
+
+	def _set_ds_data(self, dataset):
+		if self._write_buffer is not None:
+			self._write_buffer.flush()
+			self._write_buffer = _ChunkWriteBuffer(dataset, self._write_buffer.max_memory) if dataset.chunks else None
+		self._ds_data = dataset
+
+	ds_data = property(_get_ds_data, _set_ds_data, None, "The h5py Dataset holding the data.")
+
 	def __new__(cls, data=None, unit=None, shape=None, h5target=None,
-				chunks=True, compression="gzip", compression_opts=4, chunk_cache_mem_size=None):
+				chunks=True, compression="gzip", compression_opts=4, chunk_cache_mem_size=None, maxshape=None, dtype=None):
 		"""
 		Initializes and returns a new instance. __new__ is used instead of __init__ because pint Quantity does so,
 		and the method is overwritten.
@@ -58,6 +350,9 @@ class Data_Handler_H5(u.Quantity):
 
 		:param chunk_cache_mem_size: Set custom chunk cache memory size for temp files. Default is set in h5tools.
 
+		:param maxshape: The maximum shape up to which the dataset can be resized, with None for unlimited axes. (See
+			h5py docs.) Requires chunks. Default: Not resizable.
+
 		:return: The initialized instance.
 		"""
 		# TODO: Handle Datatypes. Sort compression opts for initializing from existing h5 data.
@@ -93,6 +388,10 @@ class Data_Handler_H5(u.Quantity):
 				pass
 			else:
 				# We got h5 already, so copying on h5 level is faster because of compression.
+				for name in ("chunkstats", "chunkstats_stale"):
+					h5tools.clear_name(h5target, name)
+					if data.has_chunkstats:  # Statistics are still valid for the copy.
+						data.h5target.copy(name, h5target)
 				h5tools.clear_name(h5target, "data")
 				data.h5target.copy("data", h5target)
 				h5tools.clear_name(h5target, "unit")
@@ -102,6 +401,7 @@ class Data_Handler_H5(u.Quantity):
 			inst.h5target = h5target
 			inst.temp_file = temp_file
 			inst.temp_dir = temp_dir
+			inst.cow_target = None
 			return inst
 		elif data is not None:
 			inst = object.__new__(cls)
@@ -117,13 +417,16 @@ class Data_Handler_H5(u.Quantity):
 				compression_opts = None
 			h5tools.clear_name(h5target, "data")
 			h5tools.clear_name(h5target, "unit")
+			for name in ("chunkstats", "chunkstats_stale"):
+				h5tools.clear_name(h5target, name)
 			inst.ds_data = h5target.create_dataset("data", data=compiled_data.magnitude, chunks=chunks,
 												   compression=compression,
-												   compression_opts=compression_opts)
+												   compression_opts=compression_opts, maxshape=maxshape)
 			inst.ds_unit = h5target.create_dataset("unit", data=str(compiled_data.units))
 			inst.h5target = h5target
 			inst.temp_file = temp_file
 			inst.temp_dir = temp_dir
+			inst.cow_target = None
 			return inst
 		elif shape is not None:
 			inst = object.__new__(cls)
@@ -137,12 +440,15 @@ class Data_Handler_H5(u.Quantity):
 				compression_opts = None
 			h5tools.clear_name(h5target, "data")
 			h5tools.clear_name(h5target, "unit")
+			for name in ("chunkstats", "chunkstats_stale"):
+				h5tools.clear_name(h5target, name)
 			inst.ds_data = h5target.create_dataset("data", shape, chunks=chunks, compression=compression,
-												   compression_opts=compression_opts)
+												   compression_opts=compression_opts, maxshape=maxshape, dtype=dtype)
 			inst.ds_unit = h5target.create_dataset("unit", data=u.normalize_unitstr(unit))
 			inst.h5target = h5target
 			inst.temp_file = temp_file
 			inst.temp_dir = temp_dir
+			inst.cow_target = None
 			return inst
 		elif not temp_file:
 			inst = object.__new__(cls)
@@ -153,27 +459,115 @@ class Data_Handler_H5(u.Quantity):
 			inst.h5target = h5target
 			inst.temp_file = temp_file
 			inst.temp_dir = temp_dir
+			inst.cow_target = None
 			inst.compression = compression
 			inst.compression_opts = compression_opts
 			return inst
 		else:
 			raise ValueError("Initialized Data_Handler_np with wrong parameters.")
 
+	@classmethod
+	def readonly_view(cls, h5source, h5target=None, chunk_cache_mem_size=None):
+		"""
+		Opens the data of an existing HDF5 source as a read-only view, without copying anything. The source datasets
+		are wrapped directly, so the source file can be opened in read-only mode and by several processes at the same
+		time. The view has copy-on-write semantics: Before the first write access, the data is copied to
+		:code:`h5target` and the handler works on that copy from then on, the source is never modified.
+
+		:param h5source: The h5py Group containing the datasets "data" and "unit" as written by Data_Handler_H5.
+		:type h5source: h5py.Group
+
+		:param h5target: The target to copy the data to on the first write. If None or True, a temp file is used.
+		:type h5target: h5py Group/File
+
+		:param chunk_cache_mem_size: Set custom chunk cache memory size for the temp file created on the first write.
+
+		:return: The initialized instance.
+		"""
+		assert isinstance(h5source, h5py.Group), "Data_Handler_H5.readonly_view requires h5py group as source."
+		inst = object.__new__(cls)
+		inst.__used = False
+		inst.__handling = None
+		inst.ds_data = h5source["data"]
+		inst.ds_unit = h5source["unit"]
+		inst.h5target = h5source
+		inst.temp_file = None
+		inst.temp_dir = None
+		inst.compression = inst.ds_data.compression
+		inst.compression_opts = inst.ds_data.compression_opts
+		if h5target is None:
+			h5target = True
+		inst.cow_target = h5target
+		inst.chunk_cache_mem_size = chunk_cache_mem_size
+		return inst
+
+	@property
+	def readonly(self):
+		"""
+		:code:`True` if the handler is a read-only view on source data, which is copied on the first write. See
+		:func:`readonly_view`.
+		"""
+		return self.cow_target is not None
+
+	def make_writable(self):
+		"""
+		Makes sure the handler works on its own, writable data. For read-only views (see :func:`readonly_view`),
+		this copies the source data to the copy-on-write target and rebinds the handler to the copy. Virtual data (see
+		:func:`DataSet.stack_virtual`) is read through to its sources and written to a real dataset. For all other
+		handlers, this does nothing.
+
+		:return: Nothing.
+		"""
+		if self.cow_target is None:
+			return
+		h5target = self.cow_target
+		if h5target is True:
+			temp_file = h5tools.Tempfile(chunk_cache_mem_size=self.chunk_cache_mem_size)
+			self.temp_file = temp_file
+			self.temp_dir = temp_file.temp_dir
+			h5target = temp_file
+		if self.virtual:
+			# Copying on h5 level would only copy the virtual mapping, so read through it chunk-wise:
+			h5tools.clear_name(h5target, "data_materialized")
+			newdata = h5target.create_dataset("data_materialized", self.shape, dtype=self.dtype, chunks=self.chunks,
+											  compression="gzip", compression_opts=4)
+			for slice_ in self.iterchunkslices():
+				newdata[slice_] = self.ds_data[slice_]
+			h5tools.clear_name(h5target, "data")
+			h5target.move("data_materialized", "data")
+		else:
+			# Copying on h5 level is faster because of compression:
+			h5tools.clear_name(h5target, "data")
+			self.h5target.copy(self.ds_data, h5target, name="data")
+		if h5target != self.h5target:
+			h5tools.clear_name(h5target, "unit")
+			self.h5target.copy(self.ds_unit, h5target, name="unit")
+		self.ds_data = h5target["data"]
+		self.ds_unit = h5target["unit"]
+		self.h5target = h5target
+		self.cow_target = None
+
 	# TODO: overwrite __getattr__ to avoid invoking _magnitude for performance reasons (all data loaded to RAM).
 
 	def _get__magnitude(self):
 		if self.ds_data.shape:  # array-like
+			if resources.monitors:
+				resources.materialized(self.ds_data.shape, self.ds_data.size * self.ds_data.dtype.itemsize)
 			return self.ds_data[:]
 		else:  # scalar
 			return self.ds_data[()]
 
 	def _set__magnitude(self, val):
+		self.make_writable()
+		self._invalidate_stats()
 		if numpy.asarray(val).shape == self.shape:  # Same shape, so just overwrite everything in place.
 			if self.shape:  # array-like
 				self.ds_data[:] = val
 			else:  # scalar
 				self.ds_data[()] = val
+			self._invalidate_chunkstats()
 		else:  # Different shape, so generate new h5 dataset.
+			self.drop_chunkstats()
 			del self.h5target["data"]
 			if hasattr(val, '__len__'):  # Sequence... so non-scalar data.
 				chunks = self.chunks
@@ -194,6 +588,8 @@ class Data_Handler_H5(u.Quantity):
 		return u.unit_from_str(h5tools.read_as_str(self.ds_unit))._units
 
 	def _set__units(self, val):
+		self.make_writable()
+		self._invalidate_stats()
 		self.ds_unit[()] = str(u.Quantity(1., val).units)
 
 	_units = property(_get__units, _set__units, None, "The _units property for Quantity emulation.")
@@ -220,18 +616,45 @@ class Data_Handler_H5(u.Quantity):
 
 	@property
 	def shape(self):
-		return self.ds_data.shape
+		return self._ds_data.shape
 
 	@property
 	def dtype(self):
-		return self.ds_data.dtype
+		return self._ds_data.dtype
 
 	@property
 	def chunks(self):
-		return self.ds_data.chunks
+		# Metadata is read without flushing the write buffer, see ds_data.
+		chunks = self._ds_data.chunks
+		if chunks is None and "virtual_chunks" in self._ds_data.attrs:
+			# Virtual datasets have no chunks of their own. Those of the sources are stored on creation and used, so
+			# chunk-wise iteration reads whole source chunks.
+			return tuple(int(c) for c in self.ds_data.attrs["virtual_chunks"])
+		return chunks
+
+	@property
+	def virtual(self):
+		"""
+		:code:`True` if the data is a HDF5 virtual dataset mapping the data of other datasets, see
+		:func:`DataSet.stack_virtual`.
+		"""
+		return self.ds_data.is_virtual
 
 	def __getitem__(self, key):
-		return self.__class__(self.ds_data[key], self._units)
+		"""
+		Reads the addressed elements of the data. Basic indexing (integers and slices) is passed to h5py. Selections
+		with integer arrays and boolean masks are read chunk-wise with :func:`_read_fancy`, so they read only the chunks
+		containing selected elements.
+
+		:param key: Index, slice, integer array or boolean mask (numpy style as usual) of data to address.
+
+		:return: The addressed data.
+		:rtype: Data_Handler_H5
+		"""
+		data = _read_fancy(self.ds_data, key, self.chunks)
+		if data is None:
+			data = self.ds_data[key]
+		return self.__class__(data, self._units)
 
 	def __setitem__(self, key, value):
 		"""
@@ -254,16 +677,344 @@ class Data_Handler_H5(u.Quantity):
 		# without changing any functionality. But calling to_ureg twice is more efficient because unneccesary calling
 		#  of value.to(self.units), which always generates a copy is avoided if possible.
 		value = u.to_ureg(u.to_ureg(value), self.units)
-		self.ds_data[key] = value.magnitude
+		self.make_writable()
+		if self._write_buffer is None or not self._write_buffer.write(key, value.magnitude):
+			self.ds_data[key] = value.magnitude
+		self._invalidate_chunkstats(key)
+		self._invalidate_stats()
+
+	def buffer_writes(self, max_memory=2 ** 28):
+		"""
+		Enables a write-combining buffer for :func:`__setitem__`. Writes of parts of chunks (like single frames of a
+		measurement whose chunks span several frames) are collected per chunk in memory, and each chunk is written,
+		and therefore compressed, only once when it is complete, instead of decompressing and recompressing it on
+		every partial write. Incomplete chunks are merged with the data on disk when the memory budget is exceeded.
+		Buffered data is written on :func:`flush`, and before any other access to the data, so reads always see it.
+
+		:param int max_memory: The memory budget for buffered chunks in bytes. :code:`None` or :code:`0` disables the
+			buffer, writing all buffered data.
+
+		:return: Nothing.
+		"""
+		if self._write_buffer is not None:
+			self._write_buffer.flush()
+			self._write_buffer = None
+		if max_memory:
+			assert self.chunks, "Write buffering requires chunked data."
+			self.make_writable()
+			self._write_buffer = _ChunkWriteBuffer(self._ds_data, max_memory)
 
 	def flush(self):
 		"""
-		Flushes the HDF5 buffer to disk. This always concerns the whole H5 file, so the Data_Handler resides on a
-		subgroup, all other datasets on that file are also flushed.
+		Flushes the HDF5 buffer to disk, after writing the write-combining buffer if enabled (see
+		:func:`buffer_writes`). This always concerns the whole H5 file, so the Data_Handler resides on a
+		subgroup, all other datasets on that file are also flushed. Read-only views have nothing to flush.
 		:return: nothing
 		"""
+		if self.readonly:
+			return
+		if self._write_buffer is not None:
+			self._write_buffer.flush()
 		self.h5target.file.flush()
 
+	def refresh(self):
+		"""
+		Refreshes the datasets of the handler when reading a file in SWMR mode, so data written in the meantime
+		becomes visible (see :func:`snomtools.data.imports.terra_live.refresh`). The cached statistics are cleared, as
+		they are outdated then.
+
+		:return: Nothing.
+		"""
+		self._ds_data.refresh()
+		for name in ("chunkstats", "chunkstats_stale"):
+			if name in self.h5target:
+				self.h5target[name].refresh()
+		self._invalidate_stats()
+
+	def descriptor(self, selection=None):
+		"""
+		A lightweight, picklable reference to the data: The file path, dataset name and unit, and optionally a
+		selection. Worker processes can use it to read the data directly from the file instead of getting it
+		serialized. The file is flushed, so everything written so far is visible to other processes.
+
+		:param selection: A selection (e.g. a tuple of slices) of the data. Default: The whole data.
+
+		:rtype: H5Descriptor
+		"""
+		self.flush()
+		return H5Descriptor(self.ds_data.file.filename, self.ds_data.name, self.get_unit(), selection)
+
+	def __reduce__(self):
+		# Pickle as descriptor, which is opened as read-only view on unpickling, so the data is never serialized:
+		return _open_h5descriptor, (self.descriptor(),)
+
+	def resizable(self, axis=0):
+		"""
+		Checks if the data can grow along an axis, which is the case if the HDF5 dataset was created with an
+		unlimited :code:`maxshape` for it. See :func:`make_resizable`.
+
+		:param int axis: The axis.
+
+		:rtype: bool
+		"""
+		return bool(self.shape) and self.ds_data.maxshape[axis] is None
+
+	def make_resizable(self, axis=0, chunk_length=None):
+		"""
+		Makes the data resizable along an axis, so it can be extended with :func:`append`. If the data is not resizable
+		yet, it is copied chunk-wise to a new HDF5 dataset with unlimited :code:`maxshape` for the axis. This is done
+		once, all appends afterwards work in place.
+
+		:param int axis: The axis along which the data shall grow.
+
+		:param int chunk_length: The chunk size along the axis. Appends in multiples of this length write only complete
+			chunks, so for acquisitions growing by single frames, 1 avoids recompressing partially filled chunks on
+			each append. Default: Keep the current chunks.
+
+		:return: Nothing.
+		"""
+		assert self.shape, "Scalar data cannot be made resizable."
+		axis = axis % len(self.shape)
+		if self.resizable(axis) and (chunk_length is None or self.chunks[axis] == chunk_length):
+			return
+		self.make_writable()
+		if self.chunks:
+			chunks = list(self.chunks)
+		else:
+			chunks = list(h5py.filters.guess_chunk(self.shape, None, self.dtype.itemsize))
+		if chunk_length is not None:
+			chunks[axis] = chunk_length
+		chunks = tuple(chunks)
+		maxshape = list(self.ds_data.maxshape)
+		maxshape[axis] = None
+		compression = self.compression if self.compression else None
+		h5tools.clear_name(self.h5target, "data_resizable")
+		newdata = self.h5target.create_dataset("data_resizable", self.shape, dtype=self.dtype, chunks=chunks,
+											   compression=compression, compression_opts=self.compression_opts,
+											   maxshape=tuple(maxshape))
+		for start, stop in zip(*tools.chunk_grid(self.shape, chunks)):
+			selection = tuple(slice(a, b) for a, b in zip(start, stop))
+			newdata[selection] = self.ds_data[selection]
+		if chunks != self.chunks:  # The statistics index is per chunk, so it doesn't fit anymore.
+			self.drop_chunkstats()
+		del self.h5target["data"]
+		self.h5target.move("data_resizable", "data")
+		self.ds_data = self.h5target["data"]
+
+	def _transpose_into(self, dest, axes, threads=None, max_blockbytes=2 ** 26):
+		"""
+		Writes the data with permuted axes into a HDF5 dataset, out-of-core. The data is processed in blocks that
+		consist of whole chunks of the destination and, as far as the memory bound allows, whole chunks of the source,
+		so each chunk is read and written once.
+
+		:param dest: The destination dataset of the transposed shape.
+		:type dest: h5py.Dataset
+
+		:param tuple axes: The permutation of the axes, as in :func:`numpy.transpose`.
+
+		:param int threads: The number of threads processing blocks. h5py serializes all HDF5 calls, including the
+			decompression of chunks, with a global lock, so only the transposition of blocks in memory runs in
+			parallel, overlapping with the reading and writing of other blocks. Default: The number of CPUs.
+
+		:param int max_blockbytes: The maximum size of a block in bytes.
+		"""
+		ndim = len(self.shape)
+		newshape = dest.shape
+		dest_chunks = dest.chunks or newshape
+		block = list(min(n, c) for n, c in zip(newshape, dest_chunks))
+		if self.chunks:
+			# Enlarge blocks to the least common multiple of destination and source chunks:
+			src_chunks = [self.chunks[a] for a in axes]
+			block = [min(n, int(numpy.lcm(c, sc))) for n, c, sc in zip(newshape, block, src_chunks)]
+		minimal = [min(n, c) for n, c in zip(newshape, dest_chunks)]
+		while numpy.prod(block, dtype=numpy.int64) * self.dtype.itemsize > max_blockbytes:
+			# Fall back to the destination chunks along the axis with the largest enlargement:
+			i = max(range(ndim), key=lambda j: block[j] / minimal[j])
+			if block[i] == minimal[i]:
+				break
+			block[i] = minimal[i]
+		starts, stops = tools.chunk_grid(newshape, block)
+		write_lock = threading.Lock()
+
+		def process(start_stop):
+			dest_selection = tuple(slice(a, b) for a, b in zip(*start_stop))
+			source_selection = [None] * ndim
+			for i, a in enumerate(axes):
+				source_selection[a] = dest_selection[i]
+			data = numpy.transpose(self.ds_data[tuple(source_selection)], axes)
+			with write_lock:
+				dest[dest_selection] = data
+
+		pool = ThreadPool(threads)
+		try:
+			for _ in pool.imap_unordered(process, zip(starts, stops)):
+				pass
+		finally:
+			pool.close()
+			pool.join()
+
+	def _transposed_chunks(self, axes, chunks=None):
+		"""
+		The chunks for the transposed data: The chunks of the source permuted like the axes, if not given.
+		"""
+		if chunks is None and self.chunks:
+			return tuple(self.chunks[a] for a in axes)
+		elif chunks is None:
+			return h5tools.probe_chunksize(tuple(self.shape[a] for a in axes))
+		return tuple(chunks)
+
+	def transposed(self, axes=None, h5target=None, chunks=None, threads=None):
+		"""
+		Returns a new handler with permuted axes, transposing out-of-core with bounded memory. See
+		:func:`transpose_data`.
+
+		:param tuple axes: The permutation of the axes, as in :func:`numpy.transpose`. Default: Reverse the axes.
+
+		:param h5target: The h5target for the new handler. Default: A temp file.
+
+		:param tuple chunks: The chunks of the new data. Default: The chunks of the source, permuted like the axes.
+
+		:param int threads: The number of threads transposing blocks in memory. Reading and writing is serialized by
+			h5py. Default: The number of CPUs.
+
+		:rtype: Data_Handler_H5
+		"""
+		if axes is None:
+			axes = tuple(reversed(range(len(self.shape))))
+		axes = tuple(a % len(self.shape) for a in axes)
+		assert sorted(axes) == list(range(len(self.shape))), "Invalid axes permutation {0}".format(axes)
+		inst = self.__class__(unit=self.get_unit(), shape=tuple(self.shape[a] for a in axes), h5target=h5target,
+							  chunks=self._transposed_chunks(axes, chunks), compression=self.compression,
+							  compression_opts=self.compression_opts, dtype=self.dtype)
+		self._transpose_into(inst.ds_data, axes, threads)
+		return inst
+
+	def transpose_data(self, axes=None, chunks=None, threads=None):
+		"""
+		Permutes the axes of the data in place, out-of-core: The data is read block-wise, transposed in memory and
+		written to a new HDF5 dataset with chunks matching the new axis order, which then replaces the old one. This
+		runs in bounded memory and can rechunk the data in the same pass. The transposition of blocks in memory can
+		run in parallel threads, while reading and writing is serialized by h5py. For read-only views (see :func:`readonly_view`), the transposed data is written directly to the copy-on-write
+		target.
+
+		:param tuple axes: The permutation of the axes, as in :func:`numpy.transpose`. Default: Reverse the axes.
+
+		:param tuple chunks: The chunks of the new data. Default: The chunks of the source, permuted like the axes.
+
+		:param int threads: The number of threads transposing blocks in memory. Reading and writing is serialized by
+			h5py. Default: The number of CPUs.
+
+		:return: Nothing.
+		"""
+		if axes is None:
+			axes = tuple(reversed(range(len(self.shape))))
+		axes = tuple(a % len(self.shape) for a in axes)
+		assert sorted(axes) == list(range(len(self.shape))), "Invalid axes permutation {0}".format(axes)
+		if axes == tuple(range(len(self.shape))) and chunks is None:
+			return
+		h5target = self.h5target
+		if self.readonly:  # Write to the copy-on-write target right away instead of copying first.
+			h5target = self.cow_target
+			if h5target is True:
+				temp_file = h5tools.Tempfile(chunk_cache_mem_size=self.chunk_cache_mem_size)
+				self.temp_file = temp_file
+				self.temp_dir = temp_file.temp_dir
+				h5target = temp_file
+		compression = self.compression if self.compression else None
+		h5tools.clear_name(h5target, "data_transposed")
+		newdata = h5target.create_dataset("data_transposed", tuple(self.shape[a] for a in axes), dtype=self.dtype,
+										  chunks=self._transposed_chunks(axes, chunks), compression=compression,
+										  compression_opts=self.compression_opts)
+		self._transpose_into(newdata, axes, threads)
+		if self.readonly:
+			if h5target != self.h5target:
+				h5tools.clear_name(h5target, "unit")
+				self.h5target.copy(self.ds_unit, h5target, name="unit")
+			self.cow_target = None
+		else:
+			self.drop_chunkstats()  # The statistics index is per chunk, so it doesn't fit anymore.
+		h5tools.clear_name(h5target, "data")
+		h5target.move("data_transposed", "data")
+		self.ds_data = h5target["data"]
+		self.ds_unit = h5target["unit"]
+		self.h5target = h5target
+
+	def append(self, data, axis=0):
+		"""
+		Appends data along an axis, extending the HDF5 dataset in place. Existing data is not rewritten, so this is
+		the way to grow a measurement as it is acquired. The data must be resizable along the axis, see
+		:func:`make_resizable`.
+
+		:param data: The data to append. Must have the shape of the existing data for all other axes, and can either
+			have the axis (e.g. a block of several frames) or not (a single frame). Input units are converted to the
+			units of the handler, numeric data (non-Quantities) is assumed as dimensionless, like in
+			:func:`__setitem__`. Data in another Data_Handler_H5 is copied chunk-wise without loading it completely.
+
+		:param int axis: The axis to append along.
+
+		:return: Nothing.
+		"""
+		assert self.shape, "Cannot append to scalar data."
+		axis = axis % len(self.shape)
+		assert self.resizable(axis), "Data is not resizable along axis {0}. Use make_resizable first.".format(axis)
+		if not isinstance(data, Data_Handler_H5):
+			data = numpy.asarray(u.to_ureg(u.to_ureg(data), self.units).magnitude)
+		elif data.units != self.units:
+			data = data.to(self.units)
+		if isinstance(data, Data_Handler_H5) and not data.chunks:  # Unchunked data is contiguous, read it at once.
+			data = data.ds_data[()]
+		shape = data.shape
+		if len(shape) == len(self.shape) - 1:  # A single slice.
+			shape = shape[:axis] + (1,) + shape[axis:]
+			if not isinstance(data, Data_Handler_H5):
+				data = data.reshape(shape)
+		assert len(shape) == len(self.shape) and all(n == m for i, (n, m) in enumerate(zip(shape, self.shape))
+													 if i != axis), "Data to append has incompatible shape."
+		self.make_writable()
+		self._invalidate_stats()
+		had_chunkstats = self.has_chunkstats
+		oldlength = self.shape[axis]
+		self.ds_data.resize(oldlength + shape[axis], axis=axis)
+		if isinstance(data, Data_Handler_H5):
+			for slice_ in data.iterchunkslices():
+				if len(slice_) < len(self.shape):  # A single slice: Address its position along the axis.
+					target = slice_[:axis] + (oldlength,) + slice_[axis:]
+				else:
+					target = list(slice_)
+					target[axis] = slice(slice_[axis].start + oldlength, slice_[axis].stop + oldlength)
+					target = tuple(target)
+				self.ds_data[target] = data.ds_data[slice_]
+		else:
+			# Write one chunk row at a time, so each chunk along the axis is written once and completely if possible:
+			chunklength = self.chunks[axis]
+			start = oldlength
+			while start < self.shape[axis]:
+				stop = min((start // chunklength + 1) * chunklength, self.shape[axis])
+				self.ds_data[(numpy.s_[:],) * axis + (numpy.s_[start:stop],)] = \
+					data[(numpy.s_[:],) * axis + (numpy.s_[start - oldlength:stop - oldlength],)]
+				start = stop
+		if had_chunkstats:
+			self._extend_chunkstats(axis, oldlength)
+
+	def _extend_chunkstats(self, axis, oldlength):
+		"""
+		Grows the per-chunk statistics index after :func:`append`, marking the new chunks and the previously last,
+		possibly extended chunk as stale.
+		"""
+		stats = self.h5target["chunkstats"][()]
+		stale = self.h5target["chunkstats_stale"][()]
+		gridshape = self._chunkstats_gridshape()
+		newstats = numpy.full(gridshape + stats.shape[-1:], numpy.nan)
+		newstale = numpy.ones(gridshape, dtype=bool)
+		newstats[tuple(slice(0, n) for n in stale.shape)] = stats
+		newstale[tuple(slice(0, n) for n in stale.shape)] = stale
+		first_changed = oldlength // self.chunks[axis]
+		newstale[(numpy.s_[:],) * axis + (numpy.s_[first_changed:],)] = True
+		h5tools.clear_name(self.h5target, "chunkstats")
+		h5tools.clear_name(self.h5target, "chunkstats_stale")
+		self.h5target.create_dataset("chunkstats", data=newstats)
+		self.h5target.create_dataset("chunkstats_stale", data=newstale)
+
 	def get_unit(self):
 		return str(self.units)
 
@@ -370,6 +1121,8 @@ class Data_Handler_H5(u.Quantity):
 			If this is set to True, the axes which are reduced are left in the result as dimensions with size one. With this
 			option, the result will broadcast correctly against the original arr.
 
+		:param h5target: The h5 target for the result, see :func:`__new__`. Not used for scalar results.
+
 		:return: ndarray Quantity
 			An array with the same shape as a, with the specified axis removed. If a is a 0-d array, or if axis is None, a
 			scalar is returned. If an output array is specified, a reference to out is returned.
@@ -378,6 +1131,8 @@ class Data_Handler_H5(u.Quantity):
 		# TODO: Autodetect appropriate chunk size for better performance.
 		# TODO: printing progress when verbose option is set
 		inshape = self.shape
+		if axis is None and out is None and dtype is None and not keepdims and inshape:
+			return _cached_stat(self, 'sum', self._total_sum)
 		if axis is None:
 			axis = tuple(range(len(inshape)))
 		try:
@@ -397,11 +1152,27 @@ class Data_Handler_H5(u.Quantity):
 				outshape = tuple(outshape)
 			else:
 				outshape = tuple(numpy.delete(inshape, axis))
+			if not outshape and not out:  # Scalar result, returned as Quantity like the (cached) total sum.
+				return u.to_ureg(sum(data.sum(dtype=dtype) for data in self.iterfast_raw()), self.get_unit())
 			if out:
 				assert out.shape == outshape, "Wrong shape of given destination."
 				outdata = out
 			else:
-				outdata = self.__class__(shape=outshape, unit=self.get_unit(), h5target=h5target)
+				if dtype is None:  # Accumulate like numpy does, e.g. small integers in the default platform integer.
+					dtype = numpy.zeros(1, dtype=self.dtype).sum().dtype
+				outdata = self.__class__(shape=outshape, unit=self.get_unit(), h5target=h5target, dtype=dtype)
+			if self.chunks:  # Sum up chunk-wise, reading each chunk only once into a reused buffer.
+				for slice_, owndata in zip(self.iterchunkslices(), self.iterchunks_raw()):
+					outslice = list(slice_)
+					if keepdims:
+						outslice[axis] = numpy.s_[:]
+					else:
+						del outslice[axis]
+					if outdata.shape == ():  # Scalar
+						outdata.ds_data[()] += owndata.sum(axis=axis, dtype=dtype)
+					else:
+						outdata.ds_data[tuple(outslice)] += owndata.sum(axis=axis, dtype=dtype, keepdims=keepdims)
+				return outdata
 			for i in range(inshape[axis]):
 				slicebase = [numpy.s_[:] for j in range(len(inshape) - 1)]
 				slicebase.insert(axis, i)
@@ -420,11 +1191,287 @@ class Data_Handler_H5(u.Quantity):
 			# Perform summation over axisnow and recursively sum over rest:
 			return self.sum(axisnow, dtype, out, keepdims, h5target=None).sum(axisrest, dtype, out, keepdims, h5target)
 
+	def _total_sum(self):
+		"""
+		The sum of all data, from the chunk statistics index if it exists, else reading the data chunk-wise.
+		"""
+		stats = self.get_chunkstats()
+		if stats is not None:
+			return u.to_ureg(stats['sum'].sum(), self.get_unit())
+		return u.to_ureg(sum(data.sum() for data in self.iterfast_raw()), self.get_unit())
+
+	def mean(self, axis=None, dtype=None, out=None, keepdims=False):
+		"""
+		The mean of the data. The global mean (:code:`axis=None`) is calculated from the (cached) sum, so the data is
+		read at most once chunk-wise instead of loading it all into RAM.
+
+		:return: The mean.
+		:rtype: pint.Quantity
+		"""
+		if axis is not None or dtype is not None or out is not None or keepdims or not self.shape:
+			return u.to_ureg(numpy.mean(self.magnitude, axis=axis, dtype=dtype, out=out, keepdims=keepdims),
+							 self.get_unit())
+		return _cached_stat(self, 'mean', lambda: self.sum() / self.ds_data.size)
+
+	def _invalidate_stats(self):
+		"""
+		Clears the cache of global statistics like :func:`max` and :func:`mean`. Called on every write to the data.
+		"""
+		self._stats = None
+
+	@property
+	def has_chunkstats(self):
+		"""
+		:code:`True` if a per-chunk statistics index exists for the data, see :func:`build_chunkstats`.
+		"""
+		if not (self.chunks and "chunkstats" in self.h5target and "chunkstats_stale" in self.h5target):
+			return False
+		return self.h5target["chunkstats"].shape == self._chunkstats_gridshape() + (len(chunkstats_fields),)
+
+	def _chunkstats_gridshape(self):
+		return tuple(-(-n // c) for n, c in zip(self.shape, self.chunks))
+
+	@staticmethod
+	def _calc_chunkstats(data):
+		"""
+		Calculates the statistics of a block of data, in the order of :code:`chunkstats_fields`.
+		"""
+		nans = numpy.count_nonzero(numpy.isnan(data)) if data.dtype.kind in 'fc' else 0
+		if nans == data.size:
+			return data.sum(), numpy.nan, numpy.nan, numpy.count_nonzero(data), nans
+		return data.sum(), numpy.nanmin(data), numpy.nanmax(data), numpy.count_nonzero(data), nans
+
+	def build_chunkstats(self):
+		"""
+		Builds a statistics index of the data, holding sum, minimum, maximum, number of nonzero values and number of
+		NaN values for each chunk. It is stored as a sidecar dataset next to the data, so it is kept with the h5 file.
+		Writes with :func:`__setitem__` mark the concerned chunks as stale, they are recalculated on the next query.
+		With the index, global reductions like :func:`sum`, :func:`max` and :func:`min` are answered without reading
+		the data, and :func:`chunkslices_in_range` can skip chunks that contain no values in a given range.
+
+		:return: Nothing.
+		"""
+		assert self.chunks, "Chunk statistics can only be built for chunked data."
+		assert not self.readonly, "Chunk statistics cannot be built on read-only views, but existing ones are used."
+		stats = numpy.empty(self._chunkstats_gridshape() + (len(chunkstats_fields),), dtype=numpy.float64)
+		starts, stops = self.chunk_grid()
+		for start, data in zip(starts // numpy.array(self.chunks), self.iterchunks_raw()):
+			stats[tuple(start)] = self._calc_chunkstats(data)
+		h5tools.clear_name(self.h5target, "chunkstats")
+		h5tools.clear_name(self.h5target, "chunkstats_stale")
+		self.h5target.create_dataset("chunkstats", data=stats)
+		self.h5target.create_dataset("chunkstats_stale", data=numpy.zeros(stats.shape[:-1], dtype=bool))
+
+	def drop_chunkstats(self):
+		"""
+		Deletes the per-chunk statistics index, if it exists.
+
+		:return: Nothing.
+		"""
+		if not self.readonly:
+			h5tools.clear_name(self.h5target, "chunkstats")
+			h5tools.clear_name(self.h5target, "chunkstats_stale")
+
+	def get_chunkstats(self):
+		"""
+		Returns the per-chunk statistics index, recalculating stale chunks first. See :func:`build_chunkstats`.
+
+		:return: A dict with the keys of :code:`chunkstats_fields`, holding an array of the statistic with one entry
+			per chunk, or None if no index exists.
+		:rtype: dict
+		"""
+		if self.has_chunkstats:
+			stats = self.h5target["chunkstats"][()]
+			stale = self.h5target["chunkstats_stale"][()]
+			if stale.any():
+				for index in zip(*numpy.nonzero(stale)):
+					selection = tuple(slice(i * c, (i + 1) * c) for i, c in zip(index, self.chunks))
+					stats[index] = self._calc_chunkstats(self.ds_data[selection])
+				if not self.readonly:  # Read-only views recalculate stale chunks on each query.
+					self.h5target["chunkstats"][()] = stats
+					self.h5target["chunkstats_stale"][()] = False
+		else:
+			return None
+		return dict((field, stats[..., i]) for i, field in enumerate(chunkstats_fields))
+
+	def _invalidate_chunkstats(self, key=None):
+		"""
+		Marks the chunks addressed by key as stale in the per-chunk statistics index, if it exists.
+
+		:param key: The index or slice of data that was written. If None, all chunks are marked.
+		"""
+		if not self.has_chunkstats:
+			return
+		stale = self.h5target["chunkstats_stale"]
+		if key is None:
+			stale[...] = True
+			return
+		selection = []
+		try:
+			for k, n, c in zip(full_slice(key, len(self.shape)), self.shape, self.chunks):
+				if isinstance(k, slice):
+					start, stop, step = k.indices(n)
+					if step < 0:
+						start, stop = stop + 1, start + 1
+					if stop <= start:  # Nothing written.
+						return
+					selection.append(slice(start // c, (stop - 1) // c + 1))
+				else:
+					k = int(k)
+					if k < 0:
+						k += n
+					selection.append(slice(k // c, k // c + 1))
+		except (TypeError, ValueError):  # Fancy indexing. Just mark everything.
+			stale[...] = True
+			return
+		stale[tuple(selection)] = True
+
+	def chunkslices_in_range(self, vmin=None, vmax=None):
+		"""
+		Iterator, which returns the slices of the chunks that can contain values within a given range, skipping all
+		chunks that cannot according to the per-chunk statistics index. This makes thresholded selections on sparse
+		data fast. Without index, all chunk slices are returned.
+
+		:param vmin: The lower limit of the range (inclusive). Default: No lower limit.
+
+		:param vmax: The upper limit of the range (inclusive). Default: No upper limit.
+
+		:return: A tuple of slice objects for each matching chunk.
+		"""
+		stats = self.get_chunkstats()
+		if stats is None:
+			for slice_ in self.iterchunkslices():
+				yield slice_
+			return
+		match = numpy.ones(stats['sum'].shape, dtype=bool)
+		if vmin is not None:
+			match &= stats['max'] >= u.to_ureg(vmin, self.get_unit()).magnitude
+		if vmax is not None:
+			match &= stats['min'] <= u.to_ureg(vmax, self.get_unit()).magnitude
+		for index in zip(*numpy.nonzero(match)):
+			yield tuple(slice(i * c, min((i + 1) * c, n)) for i, c, n in zip(index, self.chunks, self.shape))
+
+	def count_nonzero(self):
+		"""
+		The number of nonzero values in the data, from the per-chunk statistics index if it exists.
+
+		:rtype: int
+		"""
+		stats = self.get_chunkstats()
+		if stats is not None:
+			return int(stats['nonzero'].sum())
+		return sum(numpy.count_nonzero(data) for data in self.iterfast_raw())
+
+	def max(self, axis=None, out=None, keepdims=False):
+		"""
+		The maximum of the data. For the global maximum (:code:`axis=None`), it is taken from the per-chunk
+		statistics index if it exists, else the data is read chunk-wise instead of loading all data into RAM.
+		As in numpy, the result is NaN if the data contains NaN.
+
+		:return: The maximum.
+		:rtype: pint.Quantity
+		"""
+		if axis is not None or out is not None or keepdims or not self.shape:
+			return u.to_ureg(numpy.max(self.magnitude, axis=axis, out=out, keepdims=keepdims), self.get_unit())
+		return _cached_stat(self, 'max', self._global_max)
+
+	def _global_max(self):
+		stats = self.get_chunkstats()
+		if stats is not None:
+			value = numpy.nan if stats['nan'].sum() else stats['max'].max()
+		else:
+			value = numpy.max([data.max() for data in self.iterfast_raw()])  # NaN in any chunk gives NaN, as in numpy.
+		return u.to_ureg(value, self.get_unit())
+
+	def min(self, axis=None, out=None, keepdims=False):
+		"""
+		The minimum of the data. See :func:`max`.
+
+		:return: The minimum.
+		:rtype: pint.Quantity
+		"""
+		if axis is not None or out is not None or keepdims or not self.shape:
+			return u.to_ureg(numpy.min(self.magnitude, axis=axis, out=out, keepdims=keepdims), self.get_unit())
+		return _cached_stat(self, 'min', self._global_min)
+
+	def _global_min(self):
+		stats = self.get_chunkstats()
+		if stats is not None:
+			value = numpy.nan if stats['nan'].sum() else stats['min'].min()
+		else:
+			value = numpy.min([data.min() for data in self.iterfast_raw()])
+		return u.to_ureg(value, self.get_unit())
+
+	def histogram(self, bins=100, range=None, axis=None, threads=None):
+		"""
+		Calculates a histogram of the data values, streaming the data chunk-wise, so it is never loaded completely.
+		The partial histograms of the chunks are calculated in parallel threads and added up. Values outside the range
+		and NaN are ignored.
+
+		:param bins: The number of bins (of equal width) or the bin edges, as in :func:`numpy.histogram`. Edges are
+			given in the unit of the data if they are not quantities.
+		:type bins: int *or* sequence
+
+		:param range: The lower and upper limit of the bins, in the unit of the data if not given as quantities. If not
+			given, the minimum and maximum of the data are taken (from the chunk statistics index if it exists).
+		:type range: tuple
+
+		:param int axis: If given, a histogram is calculated for each index along this axis.
+
+		:param int threads: The number of threads to use. Default: The number of CPUs.
+
+		:return: The counts, of shape :code:`(bins,)`, or :code:`(self.shape[axis], bins)` if an axis is given, and
+			the bin edges.
+		:rtype: tuple(numpy.ndarray, pint.Quantity)
+		"""
+		edges, uniform = _histogram_edges(bins, range, self.get_unit(), self._nanrange)
+		if self.chunks:
+			selections = self.iterchunkslices()
+		else:
+			starts, stops = self._slab_grid()
+			selections = (tuple(slice(a, b) for a, b in zip(start, stop))
+						  for start, stop in zip(starts.tolist(), stops.tolist()))
+		counts = _histogram_blocks(self.ds_data.__getitem__, selections, edges, uniform, axis, self.shape, threads)
+		return counts, u.to_ureg(edges, self.get_unit())
+
+	def _nanrange(self):
+		"""
+		The minimum and maximum of the data, ignoring NaN.
+		"""
+		stats = self.get_chunkstats()
+		if stats is not None:
+			return numpy.nanmin(stats['min']), numpy.nanmax(stats['max'])
+		ranges = numpy.array([(numpy.nanmin(data), numpy.nanmax(data)) for data in self.iterfast_raw() if data.size])
+		return numpy.nanmin(ranges[:, 0]), numpy.nanmax(ranges[:, 1])
+
 	def absmax(self):
-		return abs(self).max()
+		"""
+		The maximum absolute value of the data. For real data, it is derived from the (cached) maximum and minimum,
+		else the data is read chunk-wise. No absolute copy of the data is generated.
+
+		:rtype: pint.Quantity
+		"""
+		if not self.shape:
+			return abs(self.q)
+		return _cached_stat(self, 'absmax', self._global_absmax)
+
+	def _global_absmax(self):
+		if self.dtype.kind == 'c':
+			value = numpy.max([numpy.abs(data).max() for data in self.iterfast_raw()])
+		else:
+			value = numpy.maximum(abs(self.max().magnitude), abs(self.min().magnitude))
+		return u.to_ureg(value, self.get_unit())
 
 	def absmin(self):
-		return abs(self).min()
+		"""
+		The minimum absolute value of the data, reading the data chunk-wise. No absolute copy of the data is generated.
+
+		:rtype: pint.Quantity
+		"""
+		if not self.shape:
+			return abs(self.q)
+		return _cached_stat(self, 'absmin', lambda: u.to_ureg(
+			numpy.min([numpy.abs(data).min() for data in self.iterfast_raw()]), self.get_unit()))
 
 	def shift(self, shift, output=None, order=0, mode='constant', cval=numpy.nan, prefilter=None, h5target=None):
 		"""
@@ -519,9 +1566,12 @@ class Data_Handler_H5(u.Quantity):
 			shift_dimensioncorrected = tuple(shift_dimensioncorrected)
 
 		if output is False:
+			self.make_writable()
 			self.ds_data[slice_] = \
 				scipy.ndimage.interpolation.shift(self.ds_data[expanded_slice], shift_dimensioncorrected, None, order,
 												  mode, cval, prefilter)[recover_slice]
+			self._invalidate_chunkstats(slice_)
+			self._invalidate_stats()
 			return None
 		elif isinstance(output, numpy.ndarray):
 			output[:] = \
@@ -536,50 +1586,43 @@ class Data_Handler_H5(u.Quantity):
 
 	# FIXME: Iterators for scalar data seems to freeze system.
 
+	def chunk_grid(self, dims=None):
+		"""
+		The grid of chunks of the data, as arrays of start and stop indices for each chunk. The grid is computed once
+		for each combination of shape, chunks and dims, see :func:`snomtools.data.tools.chunk_grid`.
+
+		:param dims: Divide the data chunk-wise only for the dimensions in dims. The full range is taken for all
+			others.
+		:type dims: sequence of ints
+
+		:return: Two int arrays of shape (number of chunks, dimensions), holding the start and stop indices.
+		:rtype: tuple(numpy.ndarray)
+		"""
+		assert self.chunks, "Chunk grid requested for unchunked data."
+		return tools.chunk_grid(self.shape, self.chunks, dims)
+
 	def iterchunkslices(self, dim=None, dims=None):
 		"""
 		Iterator, which returns slice objects which address the data chunk-wise. This can be used wo very efficiently
 		perform operations on the data since chunk-wise is the fastest way to access the data in the HDF5 file.
 
-		:param int dim: Do this only for the first :code:`dim` dimensions. Used for recursively calling the generator.
+		:param int dim: Do this only for the first :code:`dim+1` dimensions.
 			If not given, all dimensions are used, so this defaults to :code:`dim = len(self.shape)-1`
 
 		:param dims: Iterate chunk-wise only for the dimension in dims. Full-slices [:] are given for all others.
 		:type dims: sequence of ints
 
-		:return: A tuple of slice objects of length :code:`dim`
+		:return: A tuple of slice objects of length :code:`dim+1`
 		"""
 		if dim is None:
 			dim = len(self.shape) - 1
-		if dims is None:
-			dims = list(range(len(self.shape)))
-
-		if dim == 0:  # Break condition
-			if 0 in dims:
-				csize_dim = self.chunks[dim]
-				start = 0
-				while start < self.shape[dim]:
-					stop = start + csize_dim
-					if stop >= self.shape[dim]:
-						stop = None
-					yield (slice(start, stop),)
-					start = start + csize_dim
-			else:
-				yield (numpy.s_[:],)
-		else:  # Generate slices for dim and attach them to all slices for dim-1 recursively
-			if dim in dims:
-				csize_dim = self.chunks[dim]
-				start = 0
-				while start < self.shape[dim]:
-					stop = start + csize_dim
-					if stop >= self.shape[dim]:
-						stop = None
-					for slicetuple_before in self.iterchunkslices(dim - 1, dims):
-						yield slicetuple_before + (slice(start, stop),)
-					start = start + csize_dim
-			else:
-				for slicetuple_before in self.iterchunkslices(dim - 1, dims):
-					yield slicetuple_before + (numpy.s_[:],)
+		starts, stops = self.chunk_grid(dims)
+		if dim < len(self.shape) - 1:
+			# Only the first dimensions. They iterate fastest, so the first rows of the grid contain all of their chunks:
+			n = numpy.prod([len(numpy.unique(starts[:, d])) for d in range(dim + 1)], dtype=numpy.int64)
+			starts, stops = starts[:n, :dim + 1], stops[:n, :dim + 1]
+		for start, stop in zip(starts.tolist(), stops.tolist()):
+			yield tuple(slice(a, b) for a, b in zip(start, stop))
 
 	def iterchunks(self, dims=None):
 		"""
@@ -592,8 +1635,90 @@ class Data_Handler_H5(u.Quantity):
 		:return: The data in the chunk.
 		:rtype: pint.Quantity
 		"""
-		for chunkslice in self.iterchunkslices(dims=dims):
-			yield u.to_ureg(self.ds_data[chunkslice], self._units)
+		for data in self.iterchunks_raw(dims=dims):
+			yield u.to_ureg(data.copy(), self._units)
+
+	def iterchunks_raw(self, dims=None, buffer=None, readahead=None):
+		"""
+		Iterator, which returns the data of the chunks as bare numpy arrays, in the order of :func:`iterchunkslices`.
+		The data is read with :code:`read_direct` into one buffer, which is reused for all chunks, so no new memory is
+		allocated while iterating. The unit of the data is :code:`self.units` for all chunks.
+
+		.. warning::
+			The yielded arrays are views on the buffer, so they are overwritten in the next iteration step. Copy
+			them if they are needed for longer.
+
+		:param dims: Iterate chunk-wise only for the dimension in dims. Full-slices [:] are given for all others.
+		:type dims: sequence of ints
+
+		:param buffer: A C-contiguous array to read the data into, with at least the shape of the largest chunk (as
+			given by :func:`chunk_grid`) and the dtype of the data. If not given, a buffer is allocated.
+		:type buffer: numpy.ndarray
+
+		:param int readahead: The number of chunks to read ahead in the background, see
+			:func:`snomtools.data.readahead.iterblocks`. The buffer is not used in that case. Default: The module
+			default :code:`snomtools.data.readahead.readahead_default`.
+
+		:return: The data in the chunk.
+		:rtype: numpy.ndarray
+		"""
+		if readahead is None:
+			readahead = snomtools.data.readahead.readahead_default
+		if readahead:
+			for data in snomtools.data.readahead.iterblocks(self.ds_data, self.iterchunkslices(dims=dims), readahead):
+				yield data
+			return
+		starts, stops = self.chunk_grid(dims)
+		for data in self._iterblocks_raw(starts, stops, buffer):
+			yield data
+
+	def _iterblocks_raw(self, starts, stops, buffer=None):
+		"""
+		Reads the blocks given by arrays of start and stop indices into a reused buffer and yields views on it. See
+		:func:`iterchunks_raw`.
+		"""
+		blockshape = tuple((stops - starts).max(axis=0)) if len(starts) else ()
+		if buffer is None:
+			buffer = numpy.empty(blockshape, dtype=self.dtype)
+		else:
+			assert buffer.flags.c_contiguous and buffer.dtype == self.dtype and \
+				   all(b >= s for b, s in zip(buffer.shape, blockshape)), "Invalid buffer given."
+		for start, stop in zip(starts.tolist(), stops.tolist()):
+			source_sel = tuple(slice(a, b) for a, b in zip(start, stop))
+			dest_sel = tuple(slice(0, b - a) for a, b in zip(start, stop))
+			self.ds_data.read_direct(buffer, source_sel, dest_sel)
+			yield buffer[dest_sel]
+
+	def _iterslabs_raw(self, slab_size=2 ** 22):
+		"""
+		Reads the data in slabs along the first axis, each containing one chunk row or as many lines as fit into
+		:code:`slab_size` bytes for unchunked data. This serves the element- and line-wise iterators with a few large
+		reads instead of one read per element or line.
+
+		:param int slab_size: The approximate size of the slabs for unchunked data, in bytes.
+
+		:return: The data of the slab, as a view on a reused buffer.
+		:rtype: numpy.ndarray
+		"""
+		starts, stops = self._slab_grid(slab_size)
+		return self._iterblocks_raw(starts, stops)
+
+	def _slab_grid(self, slab_size=2 ** 22):
+		"""
+		The start and stop indices of the slabs for :func:`_iterslabs_raw`, as arrays like in :func:`chunk_grid`.
+		"""
+		shape = self.shape
+		if self.chunks:
+			rows = self.chunks[0]
+		else:
+			rowsize = numpy.prod(shape[1:], dtype=numpy.int64) * self.dtype.itemsize
+			rows = max(1, int(slab_size // max(rowsize, 1)))
+		starts = numpy.zeros((int(numpy.ceil(shape[0] / rows)), len(shape)), dtype=numpy.int64)
+		starts[:, 0] = numpy.arange(0, shape[0], rows)
+		stops = numpy.empty_like(starts)
+		stops[:] = shape
+		stops[:, 0] = numpy.minimum(starts[:, 0] + rows, shape[0])
+		return starts, stops
 
 	def iterlineslices(self):
 		"""
@@ -610,13 +1735,18 @@ class Data_Handler_H5(u.Quantity):
 	def iterlines(self):
 		"""
 		Iterator, which yields the data line-wise. It returns the data as Quantities, because they are small, so it
-		will be much faster to keep them in RAM.
+		will be much faster to keep them in RAM. The data is read in slabs of several lines, see
+		:func:`_iterslabs_raw`.
 
 		:return: The data of the current line.
 		:rtype: pint.Quantity
 		"""
-		for lineslice in self.iterlineslices():
-			yield u.to_ureg(self.ds_data[lineslice], self._units)
+		if len(self.shape) < 2:  # Only one line.
+			yield u.to_ureg(self.ds_data[()], self._units)
+			return
+		for slab in self._iterslabs_raw():
+			for index in numpy.ndindex(*slab.shape[:-1]):
+				yield u.to_ureg(slab[index].copy(), self._units)
 
 	def iterflatslices(self):
 		"""
@@ -630,13 +1760,18 @@ class Data_Handler_H5(u.Quantity):
 	def iterflat(self):
 		"""
 		Iterator, which yields the single data elements, as flattened (1D) iteration. It returns the data as
-		Quantities, because they are small (scalar), so it will be much faster to keep them in RAM.
+		Quantities, because they are small (scalar), so it will be much faster to keep them in RAM. The data is read
+		in slabs, see :func:`_iterslabs_raw`.
 
 		:return: The data of the current point.
 		:rtype: pint.Quantity
 		"""
-		for indextuple in self.iterflatslices():
-			yield u.to_ureg(self.ds_data[indextuple], self._units)
+		if not self.shape:  # Scalar
+			yield u.to_ureg(self.ds_data[()], self._units)
+			return
+		for slab in self._iterslabs_raw():
+			for element in slab.flat:
+				yield u.to_ureg(element, self._units)
 
 	def iterfastslices(self):
 		"""
@@ -659,8 +1794,28 @@ class Data_Handler_H5(u.Quantity):
 		:return: The data of the current slice.
 		:rtype: pint.Quantity
 		"""
-		for slice_ in self.iterfastslices():
-			yield u.to_ureg(self.ds_data[slice_], self._units)
+		for data in self.iterfast_raw():
+			yield u.to_ureg(data.copy(), self._units)
+
+	def iterfast_raw(self, buffer=None, readahead=None):
+		"""
+		Like :func:`iterfast`, but yields bare numpy arrays, read into a reused buffer. See :func:`iterchunks_raw`
+		for details and caveats.
+
+		:param buffer: A C-contiguous array to read the data into, see :func:`iterchunks_raw`.
+		:type buffer: numpy.ndarray
+
+		:param int readahead: The number of blocks to read ahead in the background, see :func:`iterchunks_raw`.
+
+		:return: The data of the current slice.
+		:rtype: numpy.ndarray
+		"""
+		if self.chunks:
+			for data in self.iterchunks_raw(buffer=buffer, readahead=readahead):
+				yield data
+		else:
+			for data in snomtools.data.readahead.iterblocks(self.ds_data, self.iterlineslices(), readahead):
+				yield data
 
 	def __add__(self, other):
 		other = u.to_ureg(other, self.get_unit())
@@ -669,15 +1824,15 @@ class Data_Handler_H5(u.Quantity):
 			# performance and memory use.
 			assert numpy.isscalar(other.magnitude), "Input seemed scalar but isn't."
 			newdh = self.__class__(shape=self.shape, unit=self.get_unit())
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata + other
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata + other.magnitude
 			return newdh
 		elif other.shape == self.shape:
 			# If other has the same shape, the shape doesn't change and we can do everything chunk-wise with better
 			# performance and memory use.
 			newdh = self.__class__(shape=self.shape, unit=self.get_unit())
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata + other[slice_]
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata + other[slice_].magnitude
 			return newdh
 		else:
 			# Else we need the numpy broadcasting magic to an array of different shape.
@@ -704,15 +1859,15 @@ class Data_Handler_H5(u.Quantity):
 			# performance and memory use.
 			assert numpy.isscalar(other.magnitude), "Input seemed scalar but isn't."
 			newdh = self.__class__(shape=self.shape, unit=self.get_unit())
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata - other
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata - other.magnitude
 			return newdh
 		elif other.shape == self.shape:
 			# If other has the same shape, the shape doesn't change and we can do everything chunk-wise with better
 			# performance and memory use.
 			newdh = self.__class__(shape=self.shape, unit=self.get_unit())
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata - other[slice_]
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata - other[slice_].magnitude
 			return newdh
 		else:
 			# Else we need the numpy broadcasting magic to an array of different shape.
@@ -728,16 +1883,16 @@ class Data_Handler_H5(u.Quantity):
 			assert numpy.isscalar(other.magnitude), "Input seemed scalar but isn't."
 			newunit = str((other * u.to_ureg(1., self.get_unit())).units)
 			newdh = self.__class__(shape=self.shape, unit=newunit)
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata * other
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata * other.magnitude
 			return newdh
 		elif other.shape == self.shape:
 			# If other has the same shape, the shape doesn't change and we can do everything chunk-wise with better
 			# performance and memory use.
 			newunit = str((u.to_ureg(1., str(other.units)) * u.to_ureg(1., self.get_unit())).units)
 			newdh = self.__class__(shape=self.shape, unit=newunit)
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata * other[slice_]
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata * other[slice_].magnitude
 			return newdh
 		else:
 			# Else we need the numpy broadcasting magic to an array of different shape.
@@ -757,16 +1912,16 @@ class Data_Handler_H5(u.Quantity):
 			assert numpy.isscalar(other.magnitude), "Input seemed scalar but isn't."
 			newunit = str((u.to_ureg(1., self.get_unit()) / other).units)
 			newdh = self.__class__(shape=self.shape, unit=newunit)
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata / other
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata / other.magnitude
 			return newdh
 		elif other.shape == self.shape:
 			# If other has the same shape, the shape doesn't change and we can do everything chunk-wise with better
 			# performance and memory use.
-			newunit = str((u.to_ureg(1., str(other.units)) / u.to_ureg(1., self.get_unit())).units)
+			newunit = str((u.to_ureg(1., self.get_unit()) / u.to_ureg(1., str(other.units))).units)
 			newdh = self.__class__(shape=self.shape, unit=newunit)
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata / other[slice_]
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata / other[slice_].magnitude
 			return newdh
 		else:
 			# Else we need the numpy broadcasting magic to an array of different shape.
@@ -782,16 +1937,16 @@ class Data_Handler_H5(u.Quantity):
 			assert numpy.isscalar(other.magnitude), "Input seemed scalar but isn't."
 			newunit = str((u.to_ureg(1., self.get_unit()) // other).units)
 			newdh = self.__class__(shape=self.shape, unit=newunit)
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata // other
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata // other.magnitude
 			return newdh
 		elif other.shape == self.shape:
 			# If other has the same shape, the shape doesn't change and we can do everything chunk-wise with better
 			# performance and memory use.
-			newunit = str((u.to_ureg(1., str(other.units)) // u.to_ureg(1., self.get_unit())).units)
+			newunit = str((u.to_ureg(1., self.get_unit()) // u.to_ureg(1., str(other.units))).units)
 			newdh = self.__class__(shape=self.shape, unit=newunit)
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata // other[slice_]
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata // other[slice_].magnitude
 			return newdh
 		else:
 			# Else we need the numpy broadcasting magic to an array of different shape.
@@ -807,16 +1962,16 @@ class Data_Handler_H5(u.Quantity):
 			assert numpy.isscalar(other.magnitude), "Input seemed scalar but isn't."
 			newunit = str((u.to_ureg(1., self.get_unit()) ** other).units)
 			newdh = self.__class__(shape=self.shape, unit=newunit)
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata ** other
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata ** other.magnitude
 			return newdh
 		elif other.shape == self.shape:
 			# If other has the same shape, the shape doesn't change and we can do everything chunk-wise with better
 			# performance and memory use.
 			assert self.dimensionless(), "Quantity array exponents are only allowed if the base is dimensionless"
 			newdh = self.__class__(shape=self.shape, unit="dimensionless")
-			for slice_, owndata in zip(self.iterfastslices(), self.iterfast()):
-				newdh[slice_] = owndata ** other[slice_]
+			for slice_, owndata in zip(self.iterfastslices(), self.iterfast_raw()):
+				newdh.ds_data[slice_] = owndata ** other[slice_].magnitude
 			return newdh
 		else:
 			# Else we need the numpy broadcasting magic to an array of different shape.
@@ -831,6 +1986,8 @@ class Data_Handler_H5(u.Quantity):
 		return "<Data_Handler_H5 on {0} with shape {1}>".format(repr(self.h5target), self.shape)
 
 	def __del__(self):
+		if self._write_buffer:
+			self._write_buffer.flush()
 		if not (self.temp_file is None):
 			del self.temp_file
 
@@ -880,6 +2037,9 @@ class Data_Handler_np(u.Quantity):
 	array and can therefore be used as one in many contexts.
 	"""
 
+	# Numpy data is always held in (writable) memory, see Data_Handler_H5.readonly.
+	readonly = False
+
 	def __new__(cls, data=None, unit=None, shape=None):
 		if data is not None:
 			compiled_data = u.to_ureg(data, unit)
@@ -948,8 +2108,35 @@ class Data_Handler_np(u.Quantity):
 		"""
 		return self.magnitude.sum(axis=axis, dtype=dtype, out=out, keepdims=keepdims)
 
+	def histogram(self, bins=100, range=None, axis=None, threads=None):
+		"""
+		Calculates a histogram of the data values. The data is split into slabs along the first axis, whose partial
+		histograms are calculated in parallel threads and added up. See :func:`Data_Handler_H5.histogram` for details.
+
+		:return: The counts and the bin edges.
+		:rtype: tuple(numpy.ndarray, pint.Quantity)
+		"""
+		magnitude = numpy.asarray(self.magnitude)
+		edges, uniform = _histogram_edges(bins, range, self.get_unit(),
+										  lambda: (numpy.nanmin(magnitude), numpy.nanmax(magnitude)))
+		if magnitude.ndim:
+			rows = max(1, 2 ** 20 // max(magnitude[0].size, 1))
+			selections = [numpy.s_[i:i + rows] for i in builtins.range(0, magnitude.shape[0], rows)]
+		else:
+			selections = [()]
+		counts = _histogram_blocks(magnitude.__getitem__, selections, edges, uniform, axis, magnitude.shape, threads)
+		return counts, u.to_ureg(edges, self.get_unit())
+
 	def absmax(self):
-		return abs(self).max()
+		"""
+		The maximum absolute value of the data. For real data, it is derived from the maximum and minimum without an
+		absolute copy of the data.
+
+		:rtype: pint.Quantity
+		"""
+		if self.dtype.kind == 'c':
+			return abs(self).max()
+		return u.to_ureg(numpy.maximum(abs(self.max().magnitude), abs(self.min().magnitude)), self.get_unit())
 
 	def absmin(self):
 		return abs(self).min()
@@ -1167,6 +2354,399 @@ class Data_Handler_np(u.Quantity):
 		return cls(numpy.stack(u.magnitudes(u.as_ureg_quantities(tostack, unit)), axis), unit)
 
 
+class _SharedMemoryBuffer(object):
+	"""
+	Exposes a shared memory block to numpy as the base object of the arrays on it. As long as any array (or view of
+	it) exists, the block is referenced and therefore stays mapped. :code:`SharedMemory` closes its mapping when it is
+	collected, which would leave arrays created directly on its buffer dangling.
+	"""
+
+	def __init__(self, shm, shape, dtype):
+		self.shm = shm
+		dtype = numpy.dtype(dtype)
+		address = numpy.frombuffer(shm.buf, dtype=numpy.uint8).ctypes.data
+		self.__array_interface__ = {'shape': tuple(shape), 'typestr': dtype.str, 'descr': dtype.descr,
+									'data': (address, False), 'version': 3}
+
+
+class Data_Handler_shm(Data_Handler_np):
+	"""
+	A numpy mode Data Handler, whose data lives in shared memory (see :mod:`multiprocessing.shared_memory`). Pickling
+	it transfers only the name of the shared memory block, shape, data type and unit. On unpickling, e.g. in a worker
+	process, the handler is attached to the same memory, so the data is neither serialized nor copied, and writes are
+	visible to all processes.
+
+	The handler that created the shared memory block owns it: The block is unlinked when the owner is deleted or
+	:func:`release` is called, so the owner must be kept alive while other processes attach to it. The memory itself
+	is freed as soon as no process uses it anymore.
+
+	.. note::
+		Arithmetic results, reductions and indexed elements are plain :class:`Data_Handler_np` instances, so they are
+		not placed in new shared memory blocks. Views (like indexed elements) keep the shared memory mapped as long as
+		they exist. Copies (:code:`copy.copy`, :code:`copy.deepcopy` and :func:`copy`) are new shared memory blocks.
+	"""
+
+	def __new__(cls, data=None, unit=None, shape=None, dtype=None):
+		"""
+		:param data: The data to copy into shared memory.
+
+		:param str unit: A valid unit string.
+
+		:param tuple shape: The shape of the data, if initializing with zeros.
+
+		:param dtype: The data type. Default: The one of data, or float64 for zeros.
+		"""
+		assert shared_memory is not None, "Shared memory Data Handler requires python >= 3.8."
+		if data is not None:
+			compiled_data = u.to_ureg(data, unit)
+			source = numpy.asarray(compiled_data.magnitude, dtype=dtype)
+			shape, dtype, units = source.shape, source.dtype, compiled_data.units
+		elif shape is not None:
+			source = None
+			dtype = numpy.dtype(dtype or numpy.float64)
+			units = u.to_ureg(1, unit).units
+		else:
+			raise ValueError("Initialized Data_Handler_shm with wrong parameters.")
+		size = int(numpy.prod(shape, dtype=numpy.int64)) * dtype.itemsize
+		shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+		inst = cls._from_shm(shm, shape, dtype, units, owner=True)
+		if source is not None:  # Newly created shared memory is zeroed, so only data must be copied.
+			inst._magnitude[...] = source
+		return inst
+
+	@classmethod
+	def _from_shm(cls, shm, shape, dtype, units, owner):
+		array = numpy.asarray(_SharedMemoryBuffer(shm, shape, dtype))
+		inst = super(Data_Handler_np, cls).__new__(cls, array, units)
+		inst.shm = shm
+		inst.shm_owner = owner
+		return inst
+
+	@classmethod
+	def attach(cls, name, shape, dtype, unit):
+		"""
+		Attaches to an existing shared memory block, as done on unpickling.
+
+		:param str name: The name of the shared memory block.
+
+		:param tuple shape: The shape of the data.
+
+		:param dtype: The data type.
+
+		:param str unit: A valid unit string.
+
+		:return: A handler on the shared data, which doesn't own the memory block.
+		"""
+		assert shared_memory is not None, "Shared memory Data Handler requires python >= 3.8."
+		try:  # Python >= 3.13: Don't let the resource tracker of this process unlink the block of the owner.
+			shm = shared_memory.SharedMemory(name=name, track=False)
+		except TypeError:
+			shm = shared_memory.SharedMemory(name=name)
+		return cls._from_shm(shm, shape, dtype, u.to_ureg(1, unit).units, owner=False)
+
+	@property
+	def shm_name(self):
+		"""
+		The name of the shared memory block holding the data.
+		"""
+		return self.shm.name
+
+	def release(self):
+		"""
+		Unlinks the shared memory block if this handler owns it, so no further processes can attach to it. The data
+		stays valid for all handlers already attached to it. The mapping is never closed explicitly, it is closed when
+		the last array on it is collected, see :class:`_SharedMemoryBuffer`.
+		"""
+		if self.shm_owner:
+			self.shm_owner = False
+			self.shm.unlink()
+
+	def __setitem__(self, key, value):
+		# Write directly into the shared memory:
+		value = u.to_ureg(u.to_ureg(value), self.units)
+		self._magnitude[key] = value.magnitude
+
+	def __reduce__(self):
+		return self.__class__.attach, (self.shm.name, self.shape, self.dtype.str, self.get_unit())
+
+	def _np_view(self):
+		"""
+		A plain numpy mode handler on the same memory, used to generate derived results, see :func:`_on_np_view`.
+		"""
+		return super(Data_Handler_np, Data_Handler_np).__new__(Data_Handler_np, self._magnitude, self._units)
+
+	def __getattr__(self, item):
+		# Numpy methods like max and reshape are looked up by pint's Quantity.__getattr__, which generates its results
+		# as self.__class__(...), so run them on a numpy mode view:
+		if item.startswith('_') or item in ("shm", "shm_owner", "copy"):
+			return super(Data_Handler_shm, self).__getattr__(item)
+		return getattr(self._np_view(), item)
+
+	@property
+	def T(self):
+		return self._np_view().T
+
+	def __repr__(self):
+		return "<Data_Handler_shm on {0} with shape {1}>".format(self.shm.name, self.shape)
+
+	def __del__(self):
+		try:
+			self.release()  # Only unlinks, the mapping stays valid for remaining views.
+		except (AttributeError, OSError):  # Not fully initialized or already unlinked.
+			pass
+
+
+def _on_np_view(name):
+	"""
+	Generates a method of :class:`Data_Handler_shm`, which calls the method name on a numpy mode view of the data, so
+	pint generates the result as :class:`Data_Handler_np` instead of a new shared memory block.
+	"""
+
+	def method(self, *args, **kwargs):
+		return getattr(self._np_view(), name)(*args, **kwargs)
+
+	method.__name__ = name
+	return method
+
+
+for _name in ("__getitem__", "__add__", "__radd__", "__sub__", "__rsub__", "__mul__", "__rmul__", "__truediv__",
+			  "__rtruediv__", "__floordiv__", "__rfloordiv__", "__mod__", "__rmod__", "__pow__", "__rpow__", "__neg__",
+			  "__pos__", "__abs__", "to", "to_base_units", "to_reduced_units"):
+	setattr(Data_Handler_shm, _name, _on_np_view(_name))
+
+
+class H5Descriptor(object):
+	"""
+	A lightweight, picklable reference to (a selection of) the data of a Data_Handler_H5: The file path, the dataset
+	name, the unit and the selection. See :func:`Data_Handler_H5.descriptor`.
+	Files are opened in read-only mode without file locking and kept open for further descriptors in the same
+	process, so the data must not be modified by other processes while descriptors are used. At most
+	:code:`descriptor_files_max` files are kept open, the least recently used ones are closed. All of them are
+	closed with :func:`close_descriptor_files`.
+	"""
+
+	def __init__(self, filename, dsname, unit, selection=None):
+		"""
+		:param str filename: The path of the HDF5 file.
+
+		:param str dsname: The full name of the dataset in the file.
+
+		:param str unit: A valid unit string.
+
+		:param selection: A selection (e.g. a tuple of slices) of the data. Default: The whole data.
+		"""
+		self.filename = filename
+		self.dsname = dsname
+		self.unit = unit
+		self.selection = selection
+
+	@property
+	def dataset(self):
+		"""
+		The h5py Dataset, opened in this process.
+		"""
+		key = (os.getpid(), self.filename)
+		with _descriptor_files_lock:
+			h5file = _descriptor_files.pop(key, None)
+			if h5file is None or not h5file.id.valid:
+				try:
+					h5file = h5tools.File(self.filename, 'r', locking=False)
+				except OSError:  # The file is already open in this process with file locking, so open it the same way.
+					h5file = h5tools.File(self.filename, 'r')
+			_descriptor_files[key] = h5file  # (Re-)inserted as most recently used.
+			while len(_descriptor_files) > descriptor_files_max:
+				_descriptor_files.popitem(last=False)[1].close()
+			return h5file[self.dsname]
+
+	@property
+	def shape(self):
+		"""
+		The shape of the selected data.
+		"""
+		if self.selection is None:
+			return self.dataset.shape
+		return tools.sliced_shape(self.selection, self.dataset.shape)
+
+	def __getitem__(self, key):
+		"""
+		A descriptor of a selection of the data. Only possible for descriptors of the whole data.
+		"""
+		assert self.selection is None, "H5Descriptor already has a selection."
+		return self.__class__(self.filename, self.dsname, self.unit, key)
+
+	def read_raw(self, out=None):
+		"""
+		Reads the selected data.
+
+		:param numpy.ndarray out: An array of the shape of the selection to read into, e.g. the data of a
+			:class:`Data_Handler_shm`. Default: A new array.
+
+		:return: The data, without unit.
+		:rtype: numpy.ndarray
+		"""
+		dataset = self.dataset
+		selection = numpy.s_[...] if self.selection is None else self.selection
+		data = _read_fancy(dataset, selection)
+		if data is not None:  # Index arrays are not supported by read_direct.
+			if out is None:
+				return data
+			out[...] = data
+			return out
+		if out is None:
+			return dataset[selection]
+		dataset.read_direct(out, selection)
+		return out
+
+	def read(self):
+		"""
+		Reads the selected data.
+
+		:return: The data.
+		:rtype: Data_Handler_np
+		"""
+		return Data_Handler_np(self.read_raw(), self.unit)
+
+	def open(self):
+		"""
+		Opens the data as read-only view, see :func:`Data_Handler_H5.readonly_view`. Only possible for descriptors of
+		the whole data.
+
+		:rtype: Data_Handler_H5
+		"""
+		assert self.selection is None, "Only descriptors of whole data can be opened as Data_Handler_H5."
+		return Data_Handler_H5.readonly_view(self.dataset.parent)
+
+	def __repr__(self):
+		return "<H5Descriptor of {0} in {1}, selection {2}>".format(self.dsname, self.filename, self.selection)
+
+
+# The maximum number of files kept open by H5Descriptors in each process:
+descriptor_files_max = 8
+
+# The files opened by H5Descriptors, by process ID and file name, in the order of their last use:
+_descriptor_files = collections.OrderedDict()
+_descriptor_files_lock = threading.Lock()
+
+
+def close_descriptor_files():
+	"""
+	Closes all files opened by H5Descriptors in this process, see :class:`H5Descriptor`. They are reopened when
+	descriptors are used again.
+
+	:return: Nothing.
+	"""
+	with _descriptor_files_lock:
+		while _descriptor_files:
+			_descriptor_files.popitem()[1].close()
+
+
+def _open_h5descriptor(descriptor):
+	return descriptor.open()
+
+
+class _MapBlocksJob(object):
+	"""
+	The work of :func:`DataArray.map_blocks` on a single block, picklable for worker processes.
+	"""
+
+	def __init__(self, func, source, shape, halo, full_axes, drop_axis, dtype, output=None):
+		self.func = func
+		self.source = source
+		self.shape = shape
+		self.halo = halo
+		self.full_axes = full_axes
+		self.drop_axis = drop_axis
+		self.dtype = dtype
+		self.output = output
+
+	@staticmethod
+	def _raw(data):
+		if isinstance(data, H5Descriptor):
+			return data.dataset
+		if isinstance(data, Data_Handler_np):
+			return data.magnitude
+		return data
+
+	def out_selection(self, start, stop):
+		"""
+		The selection of the result of a block in the output. Axes that are processed as a whole are taken fully.
+		"""
+		selection = []
+		for i, (a, b) in enumerate(zip(start, stop)):
+			if i == self.drop_axis:
+				continue
+			if i in self.full_axes:
+				selection.append(slice(None))
+			else:
+				selection.append(slice(a, b))
+		return tuple(selection)
+
+	def __call__(self, block):
+		start, stop = numpy.asarray(block[0]), numpy.asarray(block[1])
+		lo = numpy.maximum(start - self.halo, 0)
+		hi = numpy.minimum(stop + self.halo, self.shape)
+		data = self._raw(self.source)[tuple(slice(a, b) for a, b in zip(lo, hi))]
+		result = numpy.asarray(self.func(data), dtype=self.dtype)
+		# Cut off the halo along the axes processed block-wise:
+		inner = tuple(slice(None) if i in self.full_axes else slice(a, b)
+					  for i, (a, b) in enumerate(zip(start - lo, stop - lo)))
+		result = result[inner]
+		if self.drop_axis is not None:
+			result = result.reshape(result.shape[:self.drop_axis] + result.shape[self.drop_axis + 1:])
+		selection = self.out_selection(start, stop)
+		if self.output is None:
+			return selection, result
+		self._raw(self.output)[selection] = result
+		return selection, None
+
+
+def _map_blocks_init(job):
+	global _map_blocks_job
+	_map_blocks_job = job
+
+
+def _map_blocks_worker(block):
+	return _map_blocks_job(block)
+
+
+def _apply_along_axis_block(func1d, axis, scalar, block):
+	result = numpy.apply_along_axis(func1d, axis, block)
+	if scalar:
+		result = numpy.expand_dims(result, axis)
+	return result
+
+
+# The valid normalization methods and the statistic they normalize with, see normalization_factor():
+normalization_methods = {"maximum": "max", "max": "max",
+						 "minimum": "min", "min": "min",
+						 "mean": "mean",
+						 "absolute maximum": "absmax", "absmax": "absmax",
+						 "absolute minimum": "absmin", "absmin": "absmin"}
+
+
+def normalization_factor(data, method="maximum"):
+	"""
+	The value to divide data by for a normalization. The global statistics of data in h5 mode are cached until the
+	data is written, so repeated normalizations don't read the data again, and absolute maxima of real data are
+	derived from maximum and minimum without an absolute copy.
+
+	:param data: The data to normalize.
+	:type data: DataArray *or* Data_Handler_H5 *or* Data_Handler_np *or* pint.Quantity
+
+	:param str method: Method to normalize with, see :func:`DataSet.get_datafield_normalized`.
+
+	:return: The normalization factor, or None if the method is not valid.
+	:rtype: pint.Quantity
+	"""
+	try:
+		stat = normalization_methods[method]
+	except (KeyError, TypeError):  # Invalid string, or no string at all.
+		return None
+	if not isinstance(data, (DataArray, Data_Handler_H5, Data_Handler_np)):
+		data = Data_Handler_np(data)
+	return getattr(data, stat)()
+
+
 class DataArray(object):
 	"""
 	A data array that holds additional metadata.
@@ -1245,7 +2825,7 @@ class DataArray(object):
 			self.plotlabel = str(plotlabel)
 
 	@classmethod
-	def from_h5(cls, h5source, h5target=None):
+	def from_h5(cls, h5source, h5target=None, readonly=False):
 		"""
 		This method initializes a DataArray from a HDF5 source.
 
@@ -1253,13 +2833,16 @@ class DataArray(object):
 
 		:param h5target: Optional. The HDF5 target to work on, if on-disk h5 mode is desired.
 
+		:param bool readonly: If True, the source data is not copied, but opened as a read-only view. It is copied to
+			h5target (or a temp file) only on the first write. See :func:`Data_Handler_H5.readonly_view`.
+
 		:return: The initialized DataArray.
 		"""
 		assert isinstance(h5source, h5py.Group), "DataArray.from_h5 requires h5py group as source."
-		if h5target:
+		if h5target and h5target is not True:
 			assert isinstance(h5target, h5py.Group), "DataArray.from_h5 requires h5py group as target."
 		out = cls(None, h5target=h5target)
-		out.load_from_h5(h5source)
+		out.load_from_h5(h5source, readonly=readonly)
 		return out
 
 	@classmethod
@@ -1337,7 +2920,7 @@ class DataArray(object):
 
 	def swapaxes(self, axis1, axis2):
 		"""
-		Swaps two axes of the data. Uses numpy.swapaxes.
+		Swaps two axes of the data. See :func:`transpose`.
 
 		:param axis1: int: First axis.
 
@@ -1345,10 +2928,70 @@ class DataArray(object):
 
 		:return: The data after the transformation.
 		"""
-		self.data = u.to_ureg(self.get_data_raw().swapaxes(axis1, axis2), self.get_unit())
-		# TODO: This is not feasible for big data in H5 handlers. Look for more efficient implementation.
+		axes = list(range(len(self.shape)))
+		axes[axis1], axes[axis2] = axes[axis2], axes[axis1]
+		return self.transpose(axes)
+
+	def transpose(self, axes=None, chunks=None, threads=None):
+		"""
+		Permutes the axes of the data. In h5 mode, this is done out-of-core in bounded memory, see
+		:func:`Data_Handler_H5.transpose_data`. Uses numpy.transpose otherwise.
+
+		:param axes: The permutation of the axes, as in :func:`numpy.transpose`. Default: Reverse the axes.
+		:type axes: sequence of int
+
+		:param tuple chunks: In h5 mode: The chunks of the new data. Default: The chunks of the data, permuted like the
+			axes.
+
+		:param int threads: In h5 mode: The number of threads transposing blocks in memory. Reading and writing is
+			serialized by h5py. Default: The number of CPUs.
+
+		:return: The data after the transformation.
+		"""
+		if isinstance(self._data, Data_Handler_H5):
+			self._data.transpose_data(axes, chunks=chunks, threads=threads)
+		else:
+			self.data = u.to_ureg(numpy.transpose(self.get_data_raw(), axes), self.get_unit())
 		return self.data
 
+	def make_resizable(self, axis=0, chunk_length=None):
+		"""
+		Makes the data resizable along an axis, so it can be extended with :func:`append`. In h5 mode, see
+		:func:`Data_Handler_H5.make_resizable`. In numpy mode, this does nothing.
+
+		:param int axis: The axis along which the data shall grow.
+
+		:param int chunk_length: The chunk size along the axis, in h5 mode.
+
+		:return: Nothing.
+		"""
+		if isinstance(self._data, Data_Handler_H5):
+			self._data.make_resizable(axis, chunk_length)
+
+	def append(self, data, axis=0):
+		"""
+		Appends data along an axis. In h5 mode, the HDF5 dataset is extended in place, see
+		:func:`Data_Handler_H5.append`. In numpy mode, the data is concatenated.
+
+		:param data: The data to append, with or without the axis. A DataArray or Quantity is converted to the unit of
+			this DataArray, numeric data (non-Quantities) is assumed to be in the unit of this DataArray.
+
+		:param int axis: The axis to append along.
+
+		:return: Nothing.
+		"""
+		if isinstance(data, DataArray):
+			data = data.get_data()
+		if not u.is_quantity(data):
+			data = u.to_ureg(numpy.asarray(data), self.get_unit())
+		if isinstance(self._data, Data_Handler_H5):
+			self._data.append(data, axis)
+		else:
+			data = u.to_ureg(data, self.get_unit()).magnitude
+			if len(data.shape) == len(self.shape) - 1:  # A single slice.
+				data = numpy.expand_dims(data, axis)
+			self.data = u.to_ureg(numpy.concatenate((self.get_data_raw(), data), axis=axis), self.get_unit())
+
 	def get_unit(self):
 		return str(self.data.units)
 
@@ -1425,12 +3068,20 @@ class DataArray(object):
 			compression_opts = None
 
 		if h5dest == self.h5target:
+			if self._data.readonly and self._data.h5target != h5dest:
+				# Data is still on the read-only source, so copy it to the target now.
+				self._data.make_writable()
 			self._data.flush()
 		else:
 			if self.h5target:
 				# We are in h5 mode, so copying on h5 level is faster because of compression.
 				h5tools.clear_name(h5dest, "data")
 				self.data.h5target.copy(self.data.ds_data.name, h5dest)
+				for name in ("chunkstats", "chunkstats_stale"):
+					h5tools.clear_name(h5dest, name)
+					if self.data.has_chunkstats:  # Keep the statistics index with the data.
+						self.data.get_chunkstats()  # Make sure stale chunks are up to date.
+						self.data.h5target.copy(name, h5dest)
 			else:
 				h5tools.write_dataset(h5dest, "data", data=self.get_data_raw(), chunks=chunks, compression=compression,
 									  compression_opts=compression_opts)
@@ -1439,13 +3090,22 @@ class DataArray(object):
 		h5tools.write_dataset(h5dest, "plotlabel", self.get_plotlabel())
 		return h5dest
 
-	def load_from_h5(self, h5source):
+	def load_from_h5(self, h5source, readonly=False):
 		"""
 		Loads the data from a HDF5 source.
 
 		:param h5source: The source to read from. This is the subgroup of the DataArray.
+
+		:param bool readonly: If True, don't copy the data but open it as a read-only view with copy-on-write
+			semantics. See :func:`Data_Handler_H5.readonly_view`.
 		"""
-		if self.h5target == h5source:  # We already work on the h5source. Just initialize handler.
+		if readonly and self.h5target != h5source:
+			# Wrap the source datasets directly. They are copied to our h5target (or a temp file) on the first write.
+			if not self.h5target:
+				self.h5target = True
+			self._data = Data_Handler_H5.readonly_view(h5source, h5target=self.h5target,
+													   chunk_cache_mem_size=self.chunk_cache_mem_size)
+		elif self.h5target == h5source:  # We already work on the h5source. Just initialize handler.
 			self._data = Data_Handler_H5(h5target=self.h5target)
 		elif isinstance(self.h5target, h5py.Group):
 			# We work on a h5target, but not h5source. Copy h5source and initialize handler. This should be much more
@@ -1456,6 +3116,9 @@ class DataArray(object):
 			self._data = Data_Handler_H5(h5target=self.h5target)
 		else:
 			self.set_data(numpy.array(h5source["data"]), h5tools.read_as_str(h5source["unit"]))
+		if isinstance(self._data, Data_Handler_H5) and not self._data.readonly and self._data.virtual:
+			# Writes must not go through to the sources of virtual data (see DataSet.stack_virtual), so copy on write:
+			self._data = Data_Handler_H5.readonly_view(self._data.h5target, h5target=self._data.h5target)
 		self.set_label(h5tools.read_as_str(h5source["label"]))
 		self.set_plotlabel(h5tools.read_as_str(h5source["plotlabel"]))
 
@@ -1470,6 +3133,28 @@ class DataArray(object):
 		else:
 			warnings.warn("DataSet cannot flush without working on valid HDF5 file.")
 
+	def share(self):
+		"""
+		Prepares the DataArray for worker processes, so pickling it doesn't serialize the data: Data in numpy mode is
+		moved to shared memory (see :class:`Data_Handler_shm`). Data in h5 mode is flushed to disk and pickled as
+		descriptor (see :func:`Data_Handler_H5.descriptor`), which is opened as read-only view on unpickling.
+
+		:return: The DataArray itself.
+		"""
+		if isinstance(self._data, Data_Handler_H5):
+			self._data.flush()
+		elif not isinstance(self._data, Data_Handler_shm):
+			self._data = Data_Handler_shm(self._data)
+		return self
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		if isinstance(state.get("h5target"), h5py.Group):
+			# h5py objects can't be pickled. The data is unpickled as read-only view, so work in temp file mode there:
+			state["h5target"] = True
+			state["own_h5file"] = False
+		return state
+
 	def get_nearest_index(self, value):
 		"""
 		Get the index of the value in the DataArray nearest to a given value.
@@ -1533,47 +3218,294 @@ class DataArray(object):
 
 	def project_nd(self, *args):
 		"""
-		Projects the datafield onto the given axes. Uses sum() method, but adresses axes to keep instead of axes to
-		sum over.
+		Projects the datafield onto the given axes. Uses sum() method, but adresses axes to keep instead of axes to
+		sum over.
+
+		:param args: Integer indices for the axes to project onto.
+
+		:return: ndarray quantity: The projected data.
+		"""
+		sumlist = list(range(len(self.shape)))  # initialize list of axes to sum over
+		for arg in args:
+			assert (type(arg) == int), "ERROR: Invalid type. Axis index must be integer."
+			sumlist.remove(arg)
+		sumtup = tuple(sumlist)
+		if len(sumtup):
+			return self.sum(sumtup)
+		else:
+			return self
+
+	def shift(self, shift, output=None, order=0, mode='constant', cval=numpy.nan, prefilter=None):
+		"""
+		Shifts the complete data. This is just calling the underlying methods implemented in
+			:func:`Data_Handler_H5.shift` and :func:`Data_Handler_np.shift`
+			See those methods for documentation or under-the-hood-used :func:`scipy.ndimage.interpolation.shift` for
+			full documentation of parameters.
+		"""
+		return self.data.shift(shift, output=output, order=order, mode=mode, cval=cval, prefilter=prefilter)
+
+	def shift_slice(self, slice_, shift, output=None, order=0, mode='constant', cval=numpy.nan, prefilter=None):
+		"""
+		Shifts a certain slice of the data. This is just calling the underlying methods implemented in
+			:func:`Data_Handler_H5.shift_slice` and :func:`Data_Handler_np.shift_slice`
+			See those methods for documentation or under-the-hood-used :func:`scipy.ndimage.interpolation.shift` for
+			full documentation of parameters.
+		"""
+		return self.data.shift_slice(slice_, shift, output=output, order=order, mode=mode, cval=cval,
+									 prefilter=prefilter)
+
+	@profiling.profiled("DataArray.map_blocks")
+	def map_blocks(self, func, halo=None, out_dtype=None, out_shape=None, unit=None, label=None, plotlabel=None,
+				   h5target=None, blockshape=None, processes=None, method="process", full_axes=(), drop_axis=None):
+		"""
+		Applies a function to the data block by block, in parallel. The blocks are aligned to the chunks of the data,
+		optionally with a halo of neighbouring data for neighborhood operations like filters. Each block is read,
+		processed and written by itself, so the memory used is bounded by a few blocks per worker.
+
+		With the default method :code:`"process"`, the blocks are processed in a pool of spawned worker processes:
+		H5 data is read by the workers directly from the file (see :func:`Data_Handler_H5.descriptor`), numpy data
+		and numpy results are exchanged through shared memory (see :class:`Data_Handler_shm`), which is released
+		afterwards, so results without :code:`h5target` are returned in numpy mode. The function must therefore be
+		picklable (e.g. defined on module level, not a lambda), and scripts must guard their main code
+		with :code:`if __name__ == "__main__":`. With :code:`"thread"`, a thread pool is used instead, which works
+		with any function but only runs in parallel as far as the function releases the GIL (like most numpy and
+		scipy routines).
+
+		Example for denoising with a median filter over 3x3 pixels of the image axes 1 and 2::
+
+			filtered = da.map_blocks(functools.partial(scipy.ndimage.median_filter, size=(1, 3, 3)), halo=(0, 1, 1))
+
+		:param func: The function to apply. It gets the raw data of a block (plus halo) as numpy array and must
+			return an array of the same shape along the axes that are processed block-wise. Along axes in
+			:code:`full_axes` and axes on which :code:`out_shape` differs from the shape of the data, the blocks span
+			the whole axis, and the function must return the full length of the output along them.
+
+		:param halo: The number of neighbouring elements along each axis that are given to the function in addition
+			to the block, and cut off from its result. An int for all axes or a sequence with one int per axis.
+			Default: No halo.
+		:type halo: int *or* tuple(int)
+
+		:param out_dtype: The data type of the result. Default: The data type of the data, but at least float32.
+
+		:param tuple out_shape: The shape of the result, with the same number of dimensions as the data, including a
+			dropped axis (see :code:`drop_axis`). Default: The shape of the data.
+
+		:param str unit: The unit of the result. Default: The unit of the data.
+
+		:param str label: The label of the result. Default: The label of the DataArray.
+
+		:param str plotlabel: The plotlabel of the result. Default: The plotlabel of the DataArray.
+
+		:param h5target: The h5target for the result: A h5py Group, True for a temp file or None for numpy mode.
+
+		:param tuple blockshape: The shape of the blocks. Default: The chunks of the data.
+
+		:param int processes: The number of worker processes or threads. Default: The number of CPUs.
+
+		:param str method: :code:`"process"` (default) for a process pool, :code:`"thread"` for a thread pool.
+
+		:param full_axes: Indices of axes along which the blocks span the whole axis.
+		:type full_axes: sequence of int
+
+		:param int drop_axis: An axis of length 1 in :code:`out_shape` that is removed from the result, e.g. for
+			reductions along it.
+
+		:return: The result.
+		:rtype: DataArray
+		"""
+		assert method in ("process", "thread"), "Unknown map_blocks method {0}".format(method)
+		if method == "process" and shared_memory is None:  # Python < 3.8
+			method = "thread"
+		shape = tuple(self.shape)
+		ndim = len(shape)
+		if out_shape is None:
+			out_shape = shape
+		out_shape = tuple(out_shape)
+		assert len(out_shape) == ndim, "Output shape must have the same number of dimensions as the data."
+		if drop_axis is not None:
+			drop_axis = drop_axis % ndim
+			assert out_shape[drop_axis] == 1, "Dropped axis must have length 1 in the output shape."
+		if halo is None:
+			halo = 0
+		halo = numpy.zeros(ndim, dtype=numpy.int64) + numpy.asarray(halo, dtype=numpy.int64)
+		if out_dtype is None:
+			out_dtype = numpy.result_type(self.data.dtype, numpy.float32)
+		out_dtype = numpy.dtype(out_dtype)
+		if unit is None:
+			unit = self.get_unit()
+		if label is None:
+			label = self.get_label()
+		if plotlabel is None:
+			plotlabel = self.get_plotlabel()
+
+		# Blocks, spanning the whole axis where requested or the output shape differs:
+		full_axes = set(i % ndim for i in full_axes) | set(i for i in range(ndim) if out_shape[i] != shape[i])
+		if blockshape is None:
+			if isinstance(self.data, Data_Handler_H5) and self.data.chunks:
+				blockshape = self.data.chunks
+			else:
+				blockshape = h5tools.probe_chunksize(shape)
+		blockshape = tuple(shape[i] if i in full_axes else min(blockshape[i], shape[i]) for i in range(ndim))
+		starts, stops = tools.chunk_grid(shape, blockshape)
+		result_shape = tuple(n for i, n in enumerate(out_shape) if i != drop_axis)
+		result_chunks = tuple(out_shape[i] if i in full_axes else b for i, b in enumerate(blockshape)
+							  if i != drop_axis)
+		if verbose:
+			print("Mapping function on {0:d} blocks of shape {1} with {2}".format(len(starts), blockshape, method))
+
+		# Source and output, in a form the workers can access:
+		temp_blocks = []  # Shared memory blocks only used for the exchange with the workers.
+		if method == "process":
+			if isinstance(self.data, Data_Handler_H5):
+				source = self.data.descriptor()
+			elif isinstance(self.data, Data_Handler_shm):
+				source = self.data
+			else:
+				source = Data_Handler_shm(self.data)
+				temp_blocks.append(source)
+		else:
+			if isinstance(self.data, Data_Handler_H5):
+				source = self.data.ds_data
+			else:
+				source = self.data.magnitude
+		if h5target:
+			h5grp = h5target if isinstance(h5target, h5py.Group) else None
+			out = Data_Handler_H5(unit=unit, shape=result_shape, h5target=h5grp, chunks=result_chunks,
+								  dtype=out_dtype)
+			output = None
+		elif method == "process":
+			out = Data_Handler_shm(unit=unit, shape=result_shape, dtype=out_dtype)
+			output = out
+			temp_blocks.append(out)
+		else:
+			out = Data_Handler_np(numpy.zeros(result_shape, dtype=out_dtype), unit)
+			output = out.magnitude
+		job = _MapBlocksJob(func, source, shape, halo, full_axes, drop_axis, out_dtype, output)
+
+		if method == "process":
+			context = multiprocessing.get_context("spawn")
+			pool = context.Pool(processes, initializer=_map_blocks_init, initargs=(job,))
+			worker = _map_blocks_worker
+		else:
+			pool = ThreadPool(processes)
+			worker = job
+		try:
+			for selection, result in pool.imap_unordered(worker, zip(starts, stops)):
+				if result is not None:
+					out.ds_data[selection] = result
+		finally:
+			pool.close()
+			pool.join()
+			for block in temp_blocks:
+				block.release()
+			close_descriptor_files()  # In case descriptors of the job were used in this process.
+		if isinstance(out, Data_Handler_shm):  # Hand out a normal numpy mode handler, owning its data.
+			out = Data_Handler_np(out.magnitude.copy(), out.units)
+
+		if isinstance(h5target, h5py.Group):
+			result_da = DataArray(None, label=label, plotlabel=plotlabel, h5target=h5target)
+			result_da._data = out
+			result_da.write_to_h5()
+		else:
+			result_da = DataArray(None, label=label, plotlabel=plotlabel, h5target=(h5target or None))
+			result_da._data = out
+		return result_da
+
+	def apply_along_axis(self, func1d, axis, **kwargs):
+		"""
+		Applies a function to 1D slices along an axis, like :func:`numpy.apply_along_axis`, in parallel blocks that
+		span the whole axis. See :func:`map_blocks`.
 
-		:param args: Integer indices for the axes to project onto.
+		:param func1d: The function, getting the raw data of a 1D slice as numpy array. It returns a scalar, which
+			removes the axis from the result, or a 1D array, whose length is the new length of the axis. With the
+			method :code:`"process"`, it must be picklable.
 
-		:return: ndarray quantity: The projected data.
+		:param int axis: The index of the axis.
+
+		:param kwargs: Further keyword arguments for :func:`map_blocks`, like :code:`h5target` and :code:`method`.
+
+		:return: The result.
+		:rtype: DataArray
 		"""
-		sumlist = list(range(len(self.shape)))  # initialize list of axes to sum over
-		for arg in args:
-			assert (type(arg) == int), "ERROR: Invalid type. Axis index must be integer."
-			sumlist.remove(arg)
-		sumtup = tuple(sumlist)
-		if len(sumtup):
-			return self.sum(sumtup)
+		shape = tuple(self.shape)
+		axis = axis % len(shape)
+		# Probe the function on the first slice to get the shape of its result:
+		probe = tuple(numpy.s_[:] if i == axis else 0 for i in range(len(shape)))
+		if isinstance(self.data, Data_Handler_H5):
+			probe_result = numpy.asarray(func1d(self.data.ds_data[probe]))
 		else:
-			return self
+			probe_result = numpy.asarray(func1d(self.data.magnitude[probe]))
+		scalar = probe_result.ndim == 0
+		out_shape = list(shape)
+		out_shape[axis] = 1 if scalar else probe_result.shape[0]
+		if scalar:
+			kwargs["drop_axis"] = axis
+		kwargs.setdefault("out_dtype", numpy.result_type(probe_result.dtype, numpy.float32))
+		kwargs["full_axes"] = tuple(kwargs.get("full_axes", ())) + (axis,)
+		func = functools.partial(_apply_along_axis_block, func1d, axis, scalar)
+		return self.map_blocks(func, out_shape=tuple(out_shape), **kwargs)
 
-	def shift(self, shift, output=None, order=0, mode='constant', cval=numpy.nan, prefilter=None):
+	def max(self):
+		return self.data.max()
+
+	def min(self):
+		return self.data.min()
+
+	def normalized(self, method="maximum"):
 		"""
-		Shifts the complete data. This is just calling the underlying methods implemented in
-			:func:`Data_Handler_H5.shift` and :func:`Data_Handler_np.shift`
-			See those methods for documentation or under-the-hood-used :func:`scipy.ndimage.interpolation.shift` for
-			full documentation of parameters.
+		Returns a normalized view of the data. The normalization factor is taken from the statistics of the data (see
+		:func:`normalization_factor`) when the view is generated, and applied only when data is read from the view, so
+		no normalized copy is generated. See :class:`NormalizedDataArray`.
+
+		:param str method: Method to normalize with, see :func:`DataSet.get_datafield_normalized`.
+
+		:return: The normalized view.
+		:rtype: NormalizedDataArray
 		"""
-		return self.data.shift(shift, output=output, order=order, mode=mode, cval=cval, prefilter=prefilter)
+		factor = normalization_factor(self, method)
+		assert factor is not None, "Invalid normalization method: {0}".format(method)
+		return NormalizedDataArray(self, factor)
 
-	def shift_slice(self, slice_, shift, output=None, order=0, mode='constant', cval=numpy.nan, prefilter=None):
+	def histogram(self, bins=100, range=None, axis=None, threads=None):
 		"""
-		Shifts a certain slice of the data. This is just calling the underlying methods implemented in
-			:func:`Data_Handler_H5.shift_slice` and :func:`Data_Handler_np.shift_slice`
-			See those methods for documentation or under-the-hood-used :func:`scipy.ndimage.interpolation.shift` for
-			full documentation of parameters.
+		Calculates a histogram of the data values. In h5 mode, the data is streamed chunk-wise, so it is never loaded
+		completely. See :func:`Data_Handler_H5.histogram` for details.
+
+		:param bins: The number of bins (of equal width) or the bin edges, as in :func:`numpy.histogram`.
+		:type bins: int *or* sequence
+
+		:param range: The lower and upper limit of the bins. Default: The minimum and maximum of the data.
+		:type range: tuple
+
+		:param int axis: If given, a histogram is calculated for each index along this axis.
+
+		:param int threads: The number of threads to use. Default: The number of CPUs.
+
+		:return: The counts and the bin edges.
+		:rtype: tuple(numpy.ndarray, pint.Quantity)
 		"""
-		return self.data.shift_slice(slice_, shift, output=output, order=order, mode=mode, cval=cval,
-									 prefilter=prefilter)
+		return self.data.histogram(bins=bins, range=range, axis=axis, threads=threads)
 
-	def max(self):
-		return self.data.max()
+	def quantile(self, q, bins=10000, range=None):
+		"""
+		Estimates quantiles of the data values from a histogram, see :func:`histogram` and
+		:func:`snomtools.data.tools.histogram_quantile`. This is useful for color scales or thresholds, e.g. with
+		:code:`q=(0.01, 0.99)` for the 1st and 99th percentile, without sorting (or loading) all data. The precision is
+		limited by the bin width.
 
-	def min(self):
-		return self.data.min()
+		:param q: The quantile(s) to compute, between 0 and 1.
+		:type q: float *or* sequence of floats
+
+		:param int bins: The number of bins of the histogram.
+
+		:param range: The range of the histogram. Default: The minimum and maximum of the data.
+		:type range: tuple
+
+		:return: The estimated value(s) of the quantile(s).
+		:rtype: pint.Quantity
+		"""
+		counts, edges = self.histogram(bins=bins, range=range)
+		return u.to_ureg(tools.histogram_quantile(counts, edges.magnitude, q), self.get_unit())
 
 	def absmax(self):
 		return self.data.absmax()
@@ -1854,6 +3786,172 @@ class Axis(DataArray):
 		return out
 
 
+class NormalizedDataArray(DataArray):
+	"""
+	A read-only view of a DataArray, divided by a normalization factor. The factor is applied at read time: Reading a
+	slice only reads and scales that slice of the source, and statistics and projections are derived from those of
+	the source, so the view costs neither an extra pass over the data nor extra storage. Reading the full
+	:attr:`data` generates the normalized data. Arithmetic and unit conversions return normal DataArrays, see
+	:func:`materialize`, while methods changing the data in place raise a TypeError.
+	Generate views with :func:`DataArray.normalized`.
+	"""
+
+	def __init__(self, source, factor, label=None, plotlabel=None):
+		"""
+		:param DataArray source: The DataArray to normalize.
+
+		:param factor: The value to divide the data by.
+		:type factor: pint.Quantity *or* numeric
+
+		:param label: The label of the view. Default: The label of the source.
+
+		:param plotlabel: The plotlabel of the view. Default: The plotlabel of the source.
+		"""
+		self.source = source
+		self.factor = u.to_ureg(factor)
+		self.label = label or source.get_label()
+		self.plotlabel = plotlabel or source.get_plotlabel()
+		self.chunks = source.chunks
+		self.compression = source.compression
+		self.compression_opts = source.compression_opts
+		self.chunk_cache_mem_size = source.chunk_cache_mem_size
+		self.h5target = None
+		self.own_h5file = False
+
+	def get_data(self):
+		return self.source.get_data() / self.factor
+
+	def _set_data(self, val):
+		raise TypeError("NormalizedDataArray is a read-only view.")
+
+	data = property(get_data, _set_data, DataArray.del_data, "The normalized data of the view.")
+
+	def materialize(self):
+		"""
+		Generates the normalized data as a normal DataArray in numpy mode, independent of the source.
+
+		:return: The normalized DataArray.
+		:rtype: DataArray
+		"""
+		return DataArray(self.data, label=self.label, plotlabel=self.plotlabel)
+
+	@property
+	def shape(self):
+		return self.source.shape
+
+	@property
+	def units(self):
+		return (u.to_ureg(1, self.source.units) / self.factor).units
+
+	def get_unit(self):
+		return str(self.units)
+
+	def set_unit(self, unitstr):
+		raise TypeError("NormalizedDataArray is a read-only view.")
+
+	def to(self, unitstr):
+		return self.materialize().to(unitstr)
+
+	def transpose(self, axes=None, chunks=None, threads=None):
+		raise TypeError("NormalizedDataArray is a read-only view.")
+
+	def make_resizable(self, axis=0, chunk_length=None):
+		raise TypeError("NormalizedDataArray is a read-only view.")
+
+	def append(self, data, axis=0):
+		raise TypeError("NormalizedDataArray is a read-only view.")
+
+	def load_from_h5(self, h5source, readonly=False):
+		raise TypeError("NormalizedDataArray is a read-only view.")
+
+	def share(self):
+		self.source.share()
+		return self
+
+	def __getstate__(self):
+		state = DataArray.__getstate__(self)
+		# Pickled Quantities are restored in pint's application registry, so store the factor in plain form:
+		state["factor"] = (self.factor.magnitude, str(self.factor.units))
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.factor = u.to_ureg(*state["factor"])
+
+	def _swap_for_sign(self, positive, negative):
+		# Dividing by a negative factor swaps maxima and minima:
+		return positive if self.factor.magnitude >= 0 else negative
+
+	def max(self):
+		return self._swap_for_sign(self.source.max, self.source.min)() / self.factor
+
+	def min(self):
+		return self._swap_for_sign(self.source.min, self.source.max)() / self.factor
+
+	def mean(self):
+		return self.source.mean() / self.factor
+
+	def absmax(self):
+		return self.source.absmax() / abs(self.factor)
+
+	def absmin(self):
+		return self.source.absmin() / abs(self.factor)
+
+	def sum(self, axis=None, dtype=None, out=None, keepdims=False):
+		return self.source.sum(axis=axis, dtype=dtype, out=out, keepdims=keepdims) / self.factor
+
+	def project_nd(self, *args):
+		return self.source.project_nd(*args) / self.factor
+
+	def __getitem__(self, key):
+		selected = self.source[key]
+		if isinstance(selected, DataArray):
+			return DataArray(selected.get_data() / self.factor, label=self.label, plotlabel=self.plotlabel)
+		return u.to_ureg(selected.magnitude, selected.units) / self.factor
+
+	def __setitem__(self, key, value):
+		raise TypeError("NormalizedDataArray is a read-only view.")
+
+	def __pos__(self):
+		return self.materialize()
+
+	def __neg__(self):
+		return -self.materialize()
+
+	def __abs__(self):
+		return abs(self.materialize())
+
+	def __add__(self, other):
+		return self.materialize() + other
+
+	def __sub__(self, other):
+		return self.materialize() - other
+
+	def __mul__(self, other):
+		return self.materialize() * other
+
+	def __truediv__(self, other):
+		return self.materialize() / other
+
+	def __floordiv__(self, other):
+		return self.materialize() // other
+
+	def __pow__(self, other):
+		return self.materialize() ** other
+
+	def __len__(self):
+		return len(self.source)
+
+	def __str__(self):
+		return "NormalizedDataArray: {0} with shape {1}".format(self.label, self.shape)
+
+	def __repr__(self):
+		return "NormalizedDataArray({0!r}, factor={1})".format(self.source, self.factor)
+
+	def __del__(self):
+		pass
+
+
 class ROI(object):
 	"""
 	A Region of Interest: This is a way to define a (rectangular) mask in the multidimensional DataSet,
@@ -2231,22 +4329,14 @@ class ROI(object):
 			* "absolute maximum", "absmax": divide every value by the maximum absolute value in the set
 			* "absolute minimum", "absmin": divide every value by the minimum absolute value in the set
 
-		:return: The normalized DataArray instance.
+		:return: The normalized DataArray, as a read-only view applying the normalization factor at read time, see
+			:func:`DataArray.normalized`.
 		"""
 		ds = self.get_datafield(label_or_index)
-		if method in ["maximum", "max"]:
-			return ds / ds.max()
-		elif method in ["minimum", "min"]:
-			return ds / ds.min()
-		elif method in ["mean"]:
-			return ds / ds.mean()
-		elif method in ["absolute maximum", "max"]:
-			return ds / ds.absmax()
-		elif method in ["absolute minimum", "min"]:
-			return ds / ds.absmin()
-		else:
+		if normalization_factor(ds, method) is None:
 			warnings.warn("Normalization method not valid. Returning unnormalized data.")
 			return ds
+		return ds.normalized(method)
 
 	# TODO: Testing of this method.
 
@@ -2286,14 +4376,22 @@ class ROI(object):
 		ax = self.dataset.get_axis_by_dimension(unit)
 		return ax[self.get_slice(ax.label)]
 
-	def meshgrid(self, axes=None):
+	def meshgrid(self, axes=None, indexing='xy', lazy=False):
 		"""
 		This function returns coordinate arrays corresponding to the axes. See numpy.meshgrid. If axes are not
-		constricted by axes argument, the output arrays will have the same shape as the data arrays of the dataset.
+		constricted by axes argument and :code:`indexing='ij'` is used, the output arrays will have the same shape as
+		the data arrays of the dataset.
 		Uses snomtools.calcs.units.meshgrid() under the hood to preserve units.
 
 		:param axes: optional: a list of axes identifiers to be included. If none is given, all axes are included.
 
+		:param str indexing: :code:`'xy'` (the default, as numpy.meshgrid) or :code:`'ij'` (matrix indexing, grids in
+			the order and shape of the data).
+
+		:param bool lazy: If :code:`True`, the coordinate arrays are read-only broadcast views of the axes with stride 0
+			instead of dense arrays, needing only the memory of the axes. Use this for coordinate-based calculations
+			on large data, e.g. evaluated chunk-wise by slicing the grids like the data.
+
 		:return: A tuple of coordinate arrays.
 		"""
 		if axes:
@@ -2302,14 +4400,14 @@ class ROI(object):
 			for identifier in axes:
 				list_of_axes.append(self.get_axis(identifier))
 			# Build grid:
-			return u.meshgrid(*list_of_axes)
+			return u.meshgrid(*list_of_axes, indexing=indexing, lazy=lazy)
 		else:
 			# Assemble axes:
 			list_of_axes = []
 			for identifier in range(len(self.dataset.axes)):
 				list_of_axes.append(self.get_axis(identifier))
 			# Build grid:
-			return u.meshgrid(*list_of_axes)
+			return u.meshgrid(*list_of_axes, indexing=indexing, lazy=lazy)
 
 	def project_nd(self, *args, **kwargs):
 		"""
@@ -2371,24 +4469,20 @@ class DataSet(object):
 		self.label = label
 		# check data format and convert it do correct DataArray and Axis objects before assigning it to members:
 		self.datafields = []
+		self.axes = []
 		for field in datafields:  # Fill datafield list with correctly formatted datafield objects.
 			if self.h5target is True:  # Temp h5 mode
 				moep = DataArray(field, h5target=True)
 			elif self.h5target:  # Proper h5 file mode
-				moep = DataArray(field, h5target=True)
-				grp = moep.store_to_h5(self.datafieldgrp)
-				moep = DataArray.in_h5(grp)
+				moep = self._place_in_h5(field, DataArray, self.datafieldgrp)
 			else:  # Numpy mode
 				moep = DataArray(field)
 			self.datafields.append(moep)
-		self.axes = []
 		for ax in axes:  # Fill axes list with correctly formatted axes objects.
 			if self.h5target is True:  # Temp h5 mode
 				moep = Axis(ax, h5target=True)
 			elif self.h5target:  # Proper h5 file mode
-				moep = Axis(ax, h5target=True)
-				grp = moep.store_to_h5(self.axesgrp)
-				moep = Axis.in_h5(grp)
+				moep = self._place_in_h5(ax, Axis, self.axesgrp)
 			else:  # Numpy mode
 				moep = Axis(ax)
 			self.axes.append(moep)
@@ -2401,7 +4495,7 @@ class DataSet(object):
 			self.plotconf = dict(plotconf)
 
 	@classmethod
-	def from_h5file(cls, path, h5target=None, chunk_cache_mem_size=None):
+	def from_h5file(cls, path, h5target=None, chunk_cache_mem_size=None, readonly=False):
 		"""
 		Initializes a new DataSet from an existing HDF5 file. The file must be structured in accordance to the
 		saveh5() and loadh5() methods in this class. Uses loadh5 under the hood!
@@ -2409,12 +4503,15 @@ class DataSet(object):
 
 		:param path: The (absolute or relative) path of the HDF5 file to read.
 
+		:param bool readonly: Open the file lazily in read-only mode. See :func:`from_h5`.
+
 		:return: The initialized DataSet
 		"""
-		return cls.from_h5(path, h5target=h5target, chunk_cache_mem_size=chunk_cache_mem_size)
+		return cls.from_h5(path, h5target=h5target, chunk_cache_mem_size=chunk_cache_mem_size, readonly=readonly)
 
 	@classmethod
-	def from_h5(cls, h5source, h5target=None, chunk_cache_mem_size=None):
+	@profiling.profiled("DataSet.from_h5")
+	def from_h5(cls, h5source, h5target=None, chunk_cache_mem_size=None, readonly=False):
 		"""
 		Initializes a new DataSet from an existing HDF5 source. The file must be structured in accordance to the
 		saveh5() and loadh5() methods in this class. Uses loadh5 under the hood!
@@ -2422,14 +4519,25 @@ class DataSet(object):
 		:param h5source: The (absolute or relative) path of the HDF5 file to read, or an existing h5py Group/File of
 			the base of	the Dataset.
 
+		:param h5target: The target to work on. In readonly mode, this is where datafields are copied to when they
+			are written to, and where derived datafields added to the DataSet are stored.
+
+		:param bool readonly: If True, nothing is copied. The datafields and axes are opened lazily as read-only views
+			on the source (see :func:`Data_Handler_H5.readonly_view`), with copy-on-write semantics. A file given as
+			path is opened in read-only mode without file locking, so many processes can open the same file at the
+			same time.
+
 		:return: The initialized DataSet
 		"""
 		dataset = cls(repr(h5source), h5target=h5target, chunk_cache_mem_size=chunk_cache_mem_size)
 		if isinstance(h5source, string_types):
 			path = os.path.abspath(h5source)
-			h5source = h5tools.File(path, chunk_cache_mem_size=chunk_cache_mem_size)
+			if readonly:
+				h5source = h5tools.File(path, 'r', chunk_cache_mem_size=chunk_cache_mem_size, locking=False)
+			else:
+				h5source = h5tools.File(path, chunk_cache_mem_size=chunk_cache_mem_size)
 		# Load data:
-		dataset.loadh5(h5source)
+		dataset.loadh5(h5source, readonly=readonly)
 		return dataset
 
 	@classmethod
@@ -2454,8 +4562,8 @@ class DataSet(object):
 
 		:param path: The (absolute or relative) path of the text file to read.
 
-		:param kwargs: Keyword arguments for load_textfile and the underlying numpy.loadtxt(). See there
-			documentation for specifics,
+		:param kwargs: Keyword arguments for load_textfile and the underlying
+			:func:`snomtools.data.tools.textfile_blocks`. See there documentation for specifics,
 
 		:return: The initialized DataSet
 		"""
@@ -2509,7 +4617,7 @@ class DataSet(object):
 		else:
 			return ()
 
-	def add_datafield(self, data, unit=None, label=None, plotlabel=None):
+	def add_datafield(self, data, unit=None, label=None, plotlabel=None, move=False):
 		"""
 		Initalizes a datafield and adds it to the list. All parameters have to be given like the __init__ of DataSets
 		expects them.
@@ -2522,19 +4630,71 @@ class DataSet(object):
 
 		:param plotlabel:
 
+		:param bool move: In h5 file mode: Hand over a DataArray in the same file by hard linking its data instead of
+			copying it. The source must not be used further then, as it shares the data. See :func:`_place_in_h5`.
+
 		:return:
 		"""
 		if self.h5target is True:  # Temp h5 mode
 			moep = DataArray(data, unit, label, plotlabel, h5target=True)
 		elif self.h5target:  # Proper h5 file mode
-			moep = DataArray(data, unit, label, plotlabel, h5target=True)
-			grp = moep.store_to_h5(self.datafieldgrp)
-			moep = DataArray.in_h5(grp)
+			assert self.check_label_uniqueness(self._h5label(data, label)), \
+				"Cannot add datafield. Label already exists!"
+			moep = self._place_in_h5(data, DataArray, self.datafieldgrp, unit, label, plotlabel, move)
 		else:  # Numpy mode
 			moep = DataArray(data, unit, label, plotlabel)
 		assert self.check_label_uniqueness(moep.label), "Cannot add datafield. Label already exists!"
 		self.datafields.append(moep)
 
+	@staticmethod
+	def _h5label(data, label=None):
+		"""
+		The label a DataArray initialized with the given data and label gets, as in :func:`DataArray.__init__`.
+		"""
+		if isinstance(data, DataArray) and not label:
+			return data.get_label()
+		return str(label)
+
+	def _place_in_h5(self, data, cls, h5group, unit=None, label=None, plotlabel=None, move=False):
+		"""
+		Places a DataArray or Axis in a subgroup of a h5 group of the DataSet in file mode, without intermediate
+		copies: H5 data in the same or another file is copied on h5 level, all other data is written once, directly to
+		the subgroup.
+
+		:param data: The data, as given to the initializer of cls.
+
+		:param cls: DataArray or Axis.
+
+		:param h5group: The h5 group to place the subgroup in, typically :code:`self.datafieldgrp` or
+			:code:`self.axesgrp`.
+
+		:param bool move: If True and the data is already in h5 mode in the same file, the datasets are hard linked
+			into the subgroup instead, so nothing is copied at all. The source and the new DataArray then share their
+			data, so this is only for sources that are handed over and not used further.
+
+		:return: The DataArray or Axis, working on the subgroup.
+		"""
+		label = self._h5label(data, label)
+		grp = h5group.require_group(label)
+		handler = data.get_data() if isinstance(data, DataArray) else None
+		if (isinstance(handler, Data_Handler_H5) and not handler.readonly and handler.h5target.file == grp.file
+				and (unit is None or handler.units == u.to_ureg(1, unit).units)):
+			if handler.h5target != grp:
+				handler.flush()
+				for name in ("data", "unit", "chunkstats", "chunkstats_stale"):
+					h5tools.clear_name(grp, name)
+					if name in handler.h5target:
+						if move:
+							grp[name] = handler.h5target[name]  # Hard link, the data is shared.
+						else:
+							grp.copy(handler.h5target[name], grp, name)
+			h5tools.write_dataset(grp, "label", label)
+			h5tools.write_dataset(grp, "plotlabel", plotlabel or data.get_plotlabel())
+			return cls.in_h5(grp)
+		moep = cls(data, unit, label, plotlabel, h5target=grp)
+		moep.write_to_h5()
+		return moep
+
 	def get_datafield(self, label_or_index):
 		"""
 		Tries to assign a DataField to a given parameter, that can be an integer as an index in the
@@ -2575,22 +4735,14 @@ class DataSet(object):
 			* "absolute maximum", "absmax": divide every value by the maximum absolute value in the set
 			* "absolute minimum", "absmin": divide every value by the minimum absolute value in the set
 
-		:return: The normalized DataArray instance.
+		:return: The normalized DataArray, as a read-only view applying the normalization factor at read time, see
+			:func:`DataArray.normalized`.
 		"""
 		ds = self.get_datafield(label_or_index)
-		if method in ["maximum", "max"]:
-			return ds / ds.max()
-		elif method in ["minimum", "min"]:
-			return ds / ds.min()
-		elif method in ["mean"]:
-			return ds / ds.mean()
-		elif method in ["absolute maximum", "max"]:
-			return ds / ds.absmax()
-		elif method in ["absolute minimum", "min"]:
-			return ds / ds.absmin()
-		else:
+		if normalization_factor(ds, method) is None:
 			warnings.warn("Normalization method not valid. Returning unnormalized data.")
 			return ds
+		return ds.normalized(method)
 
 	# TODO: Testing of this method.
 
@@ -2627,9 +4779,13 @@ class DataSet(object):
 															 "same shape as old one."
 		assert self.check_label_uniqueness(new_datafield.label) or old_datafield.label == new_datafield.label, \
 			"Cannot add datafield. Label already exists!"
+		if isinstance(self.h5target, h5py.Group):  # Proper h5 file mode
+			new_datafield = self._place_in_h5(new_datafield, DataArray, self.datafieldgrp)
+			if new_datafield.label != old_datafield.label:  # Don't leave the old data orphaned in the file.
+				h5tools.clear_name(self.datafieldgrp, old_datafield.label)
 		self.datafields[old_datafield_index] = new_datafield
 
-	def add_axis(self, data, unit=None, label=None, plotlabel=None):
+	def add_axis(self, data, unit=None, label=None, plotlabel=None, move=False):
 		"""
 		Initalizes a datafield and adds it to the list. All parameters have to be given like the __init__ of Axis
 		expects them.
@@ -2642,14 +4798,16 @@ class DataSet(object):
 
 		:param plotlabel:
 
+		:param bool move: In h5 file mode: Hand over an Axis in the same file by hard linking its data instead of
+			copying it, see :func:`add_datafield`.
+
 		:return:
 		"""
 		if self.h5target is True:  # Temp h5 mode
 			moep = Axis(data, unit, label, plotlabel, h5target=True)
 		elif self.h5target:  # Proper h5 file mode
-			moep = Axis(data, unit, label, plotlabel, h5target=True)
-			grp = moep.store_to_h5(self.axesgrp)
-			moep = Axis.in_h5(grp)
+			assert self.check_label_uniqueness(self._h5label(data, label)), "Cannot add axis. Label already exists!"
+			moep = self._place_in_h5(data, Axis, self.axesgrp, unit, label, plotlabel, move)
 		else:  # Numpy mode
 			moep = Axis(data, unit, label, plotlabel)
 		assert self.check_label_uniqueness(moep.label), "Cannot add axis. Label already exists!"
@@ -2712,6 +4870,10 @@ class DataSet(object):
 		assert (old_axis.shape == new_axis.shape), "ERROR in replace_axis: New Axis must have same shape as old one."
 		assert self.check_label_uniqueness(new_axis.label) or old_axis.label == new_axis.label, \
 			"Cannot add axis. Label already exists!"
+		if isinstance(self.h5target, h5py.Group):  # Proper h5 file mode
+			new_axis = self._place_in_h5(new_axis, Axis, self.axesgrp)
+			if new_axis.label != old_axis.label:  # Don't leave the old data orphaned in the file.
+				h5tools.clear_name(self.axesgrp, old_axis.label)
 		self.axes[old_axis_index] = new_axis
 
 	def get_plotconf(self):
@@ -2723,14 +4885,22 @@ class DataSet(object):
 	def set_label(self, newlabel):
 		self.label = newlabel
 
-	def meshgrid(self, axes=None):
+	def meshgrid(self, axes=None, indexing='xy', lazy=False):
 		"""
 		This function returns coordinate arrays corresponding to the axes. See numpy.meshgrid. If axes are not
-		constricted by axes argument, the output arrays will have the same shape as the data arrays of the dataset.
+		constricted by axes argument and :code:`indexing='ij'` is used, the output arrays will have the same shape as
+		the data arrays of the dataset.
 		Uses snomtools.calcs.units.meshgrid() under the hood to preserve units.
 
 		:param axes: optional: a list of axes identifiers to be included. If none is given, all axes are included.
 
+		:param str indexing: :code:`'xy'` (the default, as numpy.meshgrid) or :code:`'ij'` (matrix indexing, grids in
+			the order and shape of the data).
+
+		:param bool lazy: If :code:`True`, the coordinate arrays are read-only broadcast views of the axes with stride 0
+			instead of dense arrays, needing only the memory of the axes. Use this for coordinate-based calculations
+			on large data, e.g. evaluated chunk-wise by slicing the grids like the data.
+
 		:return: A tuple of coordinate arrays.
 		"""
 		if axes:
@@ -2739,9 +4909,9 @@ class DataSet(object):
 			for identifier in axes:
 				list_of_axes.append(self.get_axis(identifier))
 			# Build grid:
-			return u.meshgrid(*list_of_axes)
+			return u.meshgrid(*list_of_axes, indexing=indexing, lazy=lazy)
 		else:
-			return u.meshgrid(*self.axes)
+			return u.meshgrid(*self.axes, indexing=indexing, lazy=lazy)
 
 	def swapaxis(self, axis1, axis2):
 		"""
@@ -2765,6 +4935,25 @@ class DataSet(object):
 		# Assure we did nothing wrong:
 		self.check_data_consistency()
 
+	def transpose(self, *axes, **kwargs):
+		"""
+		Reorders the axes, e.g. to make the axis that is iterated over the leading one. In h5 mode, the data is
+		transposed out-of-core in bounded memory, see :func:`DataArray.transpose`.
+
+		:param axes: The axes in their new order, addressed by their labels or indices.
+
+		:param kwargs: :code:`chunks` and :code:`threads` for :func:`DataArray.transpose`.
+
+		:return: Nothing.
+		"""
+		order = [self.get_axis_index(ax) for ax in axes]
+		assert sorted(order) == list(range(len(self.axes))), "All axes must be given exactly once."
+		for field in self.datafields:
+			field.transpose(order, **kwargs)
+		self.axes = [self.axes[i] for i in order]
+		self.check_data_consistency()
+
+	@profiling.profiled("DataSet.project_nd")
 	def project_nd(self, *args, **kwargs):
 		"""
 		Projects the datafield onto the given axes. Uses the DataSet.project_nd() method for every datset and returns a
@@ -2793,6 +4982,60 @@ class DataSet(object):
 		# TODO: Implement binning.
 		raise NotImplementedError()
 
+	def make_appendable(self, axis_id=0, chunk_length=None):
+		"""
+		Makes the DataSet growable along an axis with :func:`append`: All datafields and the axis itself are made
+		resizable along it. In h5 mode, this copies the data once (see :func:`Data_Handler_H5.make_resizable`) if it
+		isn't resizable yet, all appends afterwards extend the data in place.
+
+		:param axis_id: Identifier of the Axis along which the DataSet shall grow. Must be a valid identifier as in
+			get_axis_index and get_axis.
+
+		:param int chunk_length: The chunk size of the datafields along the axis, see
+			:func:`Data_Handler_H5.make_resizable`.
+
+		:return: Nothing.
+		"""
+		axis_index = self.get_axis_index(axis_id)
+		for field in self.datafields:
+			field.make_resizable(axis_index, chunk_length)
+		self.axes[axis_index].make_resizable(0)
+
+	def append(self, slice_dataset, axis_id=0, axis_value=None):
+		"""
+		Appends the data of another DataSet along an axis, for example the next scan step of a growing acquisition or
+		a further measurement run. The datafields and the axis are extended in place, existing data is not copied.
+		The DataSet must be made appendable along the axis with :func:`make_appendable` first.
+
+		:param slice_dataset: The DataSet to append. It must hold datafields with the same labels, and either the same
+			axes (a block along the axis), or the same axes without the one to append along (a single slice). The other
+			axes are assumed to be identical and not checked for their values.
+		:type slice_dataset: DataSet
+
+		:param axis_id: Identifier of the Axis to append along. Must be a valid identifier as in get_axis_index and
+			get_axis.
+
+		:param axis_value: The axis value of a single slice. Required if slice_dataset doesn't have the axis. Numeric
+			values are assumed to be in the unit of the axis.
+
+		:return: Nothing.
+		"""
+		assert isinstance(slice_dataset, DataSet), "DataSet.append requires a DataSet to append."
+		axis_index = self.get_axis_index(axis_id)
+		axis = self.axes[axis_index]
+		if slice_dataset.dimensions == self.dimensions:
+			axis_data = slice_dataset.get_axis(axis.get_label()).get_data()
+		else:
+			assert slice_dataset.dimensions == self.dimensions - 1, "DataSet to append has wrong dimensionality."
+			assert axis_value is not None, "Appending a single slice requires an axis value."
+			axis_data = u.to_ureg(axis_value, axis.get_unit())
+			axis_data = u.to_ureg(numpy.atleast_1d(axis_data.magnitude), axis_data.units)
+		assert set(slice_dataset.dlabels) == set(self.dlabels), "DataSet to append has different datafields."
+		for field in self.datafields:
+			field.append(slice_dataset.get_datafield(field.get_label()), axis_index)
+		axis.append(axis_data)
+		self.check_data_consistency()
+
 	def check_data_consistency(self):
 		"""
 		Self test method which checks the dimensionality and shapes of the axes and datafields. Raises
@@ -2827,6 +5070,7 @@ class DataSet(object):
 			assert (len(self.labels) == len(set(self.labels))), "DataSet data array and axes labels not unique."
 			return True
 
+	@profiling.profiled("DataSet.saveh5")
 	def saveh5(self, h5dest=None):
 		"""
 		Saves the Dataset to a HDF5 destination in a unified format.
@@ -2868,12 +5112,18 @@ class DataSet(object):
 		if path:  # We got a path and wrote in new h5 file, so we'll close that file.
 			h5dest.close()
 
-	def loadh5(self, h5source):
+	def loadh5(self, h5source, readonly=False):
 		if isinstance(h5source, string_types):
 			path = os.path.abspath(h5source)
-			h5source = h5tools.File(path, 'r')
+			if readonly:
+				h5source = h5tools.File(path, 'r', locking=False)
+			else:
+				h5source = h5tools.File(path, 'r')
 		else:
 			path = False
+		if readonly:
+			# The views work on the source, so it must be kept open as long as the DataSet lives.
+			self.h5source = h5source
 		assert isinstance(h5source, h5py.Group), \
 			"DataSet.saveh5 needs h5 group or destination path as argument if no instance h5target is set."
 		h5tools.check_version(h5source)
@@ -2890,7 +5140,7 @@ class DataSet(object):
 				dest = self.datafieldgrp.require_group(datafield)
 			else:
 				dest = None
-			self.datafields[index] = (DataArray.from_h5(datafieldgrp[datafield], h5target=dest))
+			self.datafields[index] = (DataArray.from_h5(datafieldgrp[datafield], h5target=dest, readonly=readonly))
 		axesgrp = h5source["axes"]
 		self.axes = [None for i in range(len(axesgrp))]
 		for axis in axesgrp:
@@ -2913,20 +5163,22 @@ class DataSet(object):
 					"Axis {0} occurs more than once in H5 file! Overwriting with Axis '{1}'".format(index, axis))
 				# If one element is overwritten, there was one too much initialized... remove one None element:
 				self.axes.remove(None)
-			self.axes[index] = (Axis.from_h5(axesgrp[axis], h5target=dest))
+			self.axes[index] = (Axis.from_h5(axesgrp[axis], h5target=dest, readonly=readonly))
 		self.plotconf = h5tools.load_dictionary(h5source['plotconf'])
 		self.check_data_consistency()
-		if path:  # We got a path and read from opened h5 file, so we'll close that file.
+		if path and not readonly:  # We got a path and read from opened h5 file, so we'll close that file.
 			h5source.close()
 
 	def load_textfile(self, path, axis=0, comments='#', delimiter=None, unitsplitter="[-\/ ]+", labelline=0,
-					  unitsline=0, **kwargs):
+					  unitsline=0, decimal='.', blocklines=65536, **kwargs):
 		"""
 		Loads the contents of a textfile to the dataset instance. The text files are two-dimensional arrays of lines
 		and n columns, so it can hold up to one axis and (n-1) or n DataFields. See axis parameter for information on
 		how to set axis. Data consistency is checked at the end, so shapes of data and axis arrays must fit (as
 		always),
-		Uses numpy.loadtxt() under the hood!
+		The file is read in a single pass with :func:`snomtools.data.tools.textfile_blocks`, collecting the comment
+		lines on the way. In h5 mode, the data is streamed block-wise into resizable h5 datasets, so the file content
+		never has to fit into memory.
 		Defaults fit for gnuplot friendly files. Tries to cast the heading comment line(s) as labels and units for
 		the data fields.
 
@@ -2943,41 +5195,42 @@ class DataSet(object):
 			which matches combinations of the chars '-'. '/' and ' '.
 
 		:param labelline: Index (starting with 0) of the comment line in which the labels are stored. (Default 0)
+			Only the comment lines before the first data line are considered.
 
 		:param unitsline: Index (starting with 0) of the comment line in which the units are stored. (Default 0) If
 			this is different from labelline, it is assumed that ONLY the unit is in that line.
 
-		:param kwargs: Keyword arguments as used for the numpy.loadtxt() method
+		:param decimal: The character used as decimal mark. Use :code:`','` for files written with german locale.
+
+		:param blocklines: The number of lines that are read and parsed at once.
+
+		:param kwargs: Keyword arguments for :func:`snomtools.data.tools.textfile_blocks`, like usecols, skiprows and
+			dtype, as known from numpy.loadtxt().
 
 		:return: Nothing
 		"""
 		# Normalize path:
 		path = os.path.abspath(path)
-		# Load data from text file:
-		datacontent = numpy.loadtxt(path, comments=comments, delimiter=delimiter, **kwargs)
+		# Start reading data from text file. The header comments are collected until the first block is parsed:
+		commentlines = []
+		blocks = tools.textfile_blocks(path, comments=comments, delimiter=delimiter, decimal=decimal,
+									   blocklines=blocklines, commentlines=commentlines, **kwargs)
+		firstblock = next(blocks)
 		# All columns contain data by default. This can change if there is an Axis:
-		datacolumns = list(range(datacontent.shape[1]))
+		datacolumns = list(range(firstblock.shape[1]))
 
 		# Handle comment lines which hold metadata like labels and units of the data columns:
-		commentsentries = []  # The list which will hold the strings of the comment lines.
+		commentsentries = [line.split(delimiter) for line in commentlines]  # The entries of the header lines.
 		labels = ["" for i in datacolumns]  # The list which will hold the label for each data column.
 		units = [None for i in datacolumns]  # The list which will hold the unit string for each data column.
-		textfile = open(path, 'r')
-		try:
-			for line in textfile:
-				line = line.strip()
-				if line.startswith(comments):
-					commentsentries.append(line.strip(comments).strip().split(delimiter))
-		finally:
-			textfile.close()
 
-		# Check if relevant comments lines have the correct number of columns:
+		# Check if relevant comments lines exist and have the correct number of columns:
 		lines_not_ok = []
 		for comments_line_i in {labelline, unitsline}:
-			if len(commentsentries[comments_line_i]) != len(datacolumns):
+			if comments_line_i >= len(commentsentries) or len(commentsentries[comments_line_i]) != len(datacolumns):
 				lines_not_ok.append(comments_line_i)
 		if lines_not_ok:  # The list is not empty.
-			warnings.warn("Comment line(s) {0} in textfile {1} has wrong number of columns. "
+			warnings.warn("Comment line(s) {0} in textfile {1} missing or has wrong number of columns. "
 						  "No metadata can be read.".format(lines_not_ok, path))
 		else:  # There is a corresponding column in the comment line to each data line.
 			if labelline == unitsline:  # Labels and units in same line. We need to extract units, rest are labels:
@@ -2997,12 +5250,54 @@ class DataSet(object):
 									  "".format(unitsline, path, unit))
 					labels[column] = commentsentries[labelline][column]
 
-		# If we should handle axis:
-		if not (axis is None):
-			if type(axis) == int:  # Column number was given.
-				datacolumns.remove(axis)  # Column contains axis and not data.
-				self.axes = [Axis(datacontent[:, axis], unit=units[axis], label=labels[axis])]  # Initialize axis
-			elif type(axis) == Axis:  # Complete axis was given.
+		if type(axis) == int:  # Column number was given.
+			datacolumns.remove(axis)  # Column contains axis and not data.
+
+		if self.h5target:
+			# Stream the remaining blocks into resizable datasets, one for each column:
+			columns = {}
+			for column in range(len(labels)):
+				if type(axis) == int and column == axis:
+					arraytype = Axis
+					h5grp = self.axesgrp
+				elif column in datacolumns:
+					arraytype = DataArray
+					h5grp = self.datafieldgrp
+				else:
+					continue
+				if h5grp is not True:  # Proper h5 file mode
+					h5grp = h5grp.require_group(labels[column] or "column{0}".format(column))
+				array = arraytype(None, label=labels[column], h5target=h5grp)
+				array._data = Data_Handler_H5(unit=str(u.to_ureg(1, units[column]).units), shape=(0,),
+											  h5target=(None if h5grp is True else h5grp),
+											  chunks=(min(blocklines, 2 ** 16),), maxshape=(None,),
+											  dtype=firstblock.dtype)
+				columns[column] = array
+			length = 0
+			for block in itertools.chain([firstblock], blocks):
+				for column, array in columns.items():
+					array._data.ds_data.resize((length + len(block),))
+					array._data.ds_data[length:] = block[:, column]
+				length += len(block)
+			if self.h5target is not True:  # Proper h5 file mode, so write metadata next to data.
+				for array in columns.values():
+					array.write_to_h5()
+			if type(axis) == int:
+				self.axes = [columns[axis]]
+			self.datafields = [columns[i] for i in datacolumns]
+
+		else:
+			datacontent = numpy.concatenate([firstblock] + list(blocks))
+			if type(axis) == int:  # Initialize axis from column
+				self.axes = [Axis(datacontent[:, axis], unit=units[axis], label=labels[axis])]
+			# Write the remaining data to datafields:
+			self.datafields = []  # Reset datafields
+			for i in datacolumns:  # Initialize new datafields
+				self.add_datafield(datacontent[:, i], unit=units[i], label=labels[i])
+
+		# Handle axis given as object:
+		if not (axis is None or type(axis) == int):
+			if type(axis) == Axis:  # Complete axis was given.
 				self.axes = [axis]
 			elif type(axis) == DataArray:  # DataArray was given for axis.
 				self.axes = [Axis.from_dataarray(axis)]
@@ -3013,14 +5308,34 @@ class DataSet(object):
 					print(("ERROR! Axis initialization in load_textfile failed.", "red"))
 					raise e
 
-		# Write the remaining data to datafields:
-		self.datafields = []  # Reset datafields
-		for i in datacolumns:  # Initialize new datafields
-			self.add_datafield(datacontent[:, i], unit=units[i], label=labels[i])
-
 		self.check_label_uniqueness()
 		return self.check_data_consistency()
 
+	def share(self):
+		"""
+		Prepares all DataArrays and Axes of the DataSet for worker processes, so pickling the DataSet doesn't
+		serialize the data. See :func:`DataArray.share`.
+
+		:return: The DataSet itself.
+		"""
+		for da in self.datafields + self.axes:
+			da.share()
+		return self
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		if self.h5target is not None:
+			# h5py objects can't be pickled. The data is unpickled as read-only views, so work in temp file mode there:
+			for key in ("h5target", "datafieldgrp", "axesgrp"):
+				state[key] = True
+			state["own_h5file"] = False
+		state.pop("h5file", None)
+		return state
+
+	def __setstate__(self, state):
+		# Set the state directly, __getattr__ must not be invoked on the empty instance:
+		self.__dict__.update(state)
+
 	def __del__(self):
 		if self.own_h5file:
 			self.h5target.close()
@@ -3090,6 +5405,172 @@ class DataSet(object):
 		stack.check_data_consistency()
 		return stack
 
+	@classmethod
+	def stack_virtual(cls, sources, new_axis=None, axis=0, label=None, plotconf=None, h5target=True):
+		"""
+		Stacks a sequence of DataSets stored in HDF5 files, like several runs of a measurement, to a new DataSet
+		without copying their data. The datafields of the new DataSet are HDF5 virtual datasets, which map the
+		datafields of the sources, so only the small axes are written. All reading methods work across the sources
+		(reading chunk-wise follows the chunks of the sources). The sources are never modified: The first write to a
+		datafield copies its data, as for read-only views (see :func:`Data_Handler_H5.readonly_view`).
+
+		The source files must stay available as long as the stacked DataSet is used. They are referenced by absolute
+		paths, but if they are moved together with the file of the stacked DataSet, they are also found relative to it.
+
+		:param sources: The DataSets to stack, or paths or h5py Groups of DataSets saved with :func:`saveh5`. DataSets
+			must be in h5 file mode (not temp file mode), because the data of temp files is lost when they are closed.
+			All sources must have the same shape and datafields with the same labels, units and data types.
+		:type sources: sequence of (DataSet *or* str *or* h5py.Group)
+
+		:param new_axis: The new axis for the dimension along which the sources are stacked. Default: An axis
+			:code:`"run"`, numbering the sources.
+		:type new_axis: Axis *or* castable as Axis
+
+		:param int axis: The position of the new axis in the stacked DataSet.
+
+		:param label: The label for the new DataSet. If not given, the label of the first source is used.
+
+		:param plotconf: The plot configuration for the new DataSet. If not given, the one of the first source is
+			used.
+
+		:param h5target: The HDF5 target to write the stacked DataSet to. Only the virtual mapping and the axes are
+			written.
+		:type h5target: str **or** h5py.Group **or** True
+
+		:return: The stacked DataSet.
+		"""
+		assert h5target, "Virtual stacking requires h5 mode."
+		datastack = []
+		for source in sources:
+			if not isinstance(source, DataSet):
+				source = cls.from_h5(source, readonly=True)
+			datastack.append(source)
+		first = datastack[0]
+		if new_axis is None:
+			new_axis = Axis(numpy.arange(len(datastack)), label="run", plotlabel="Run")
+		else:
+			new_axis = Axis(new_axis)
+		assert len(new_axis) == len(datastack), "New axis doesn't fit to number of sources."
+		if axis < 0:
+			axis += len(first.shape) + 1
+		if label is None:
+			label = first.get_label()
+		if plotconf is None:
+			plotconf = first.get_plotconf()
+		for ds in datastack:
+			assert ds.shape == first.shape, "DataSets of inconsistent dimensions given to stack_virtual."
+			assert set(ds.dlabels) == set(first.dlabels), "DataSets with different datafields given to stack_virtual."
+
+		stack = cls(label=label, plotconf=plotconf, h5target=h5target)
+		for field in first.datafields:
+			dlabel = field.get_label()
+			handlers = [ds.get_datafield(dlabel).get_data() for ds in datastack]
+			for dh in handlers:
+				assert isinstance(dh, Data_Handler_H5) and dh.temp_file is None, \
+					"Virtual stacking requires sources stored in HDF5 files."
+				assert dh.units == handlers[0].units, "Datafields with different units given to stack_virtual."
+				assert dh.dtype == handlers[0].dtype, "Datafields with different data types given to stack_virtual."
+			layout = h5py.VirtualLayout(shape=first.shape[:axis] + (len(handlers),) + first.shape[axis:],
+										dtype=handlers[0].dtype)
+			for i, dh in enumerate(handlers):
+				layout[(numpy.s_[:],) * axis + (i,)] = h5py.VirtualSource(os.path.abspath(dh.ds_data.file.filename),
+																		   dh.ds_data.name, shape=dh.shape,
+																		   dtype=dh.dtype)
+			if stack.h5target is True:  # Temp h5 mode
+				grp = h5tools.Tempfile()
+			else:  # Proper h5 file mode
+				grp = stack.datafieldgrp.require_group(dlabel)
+			h5tools.clear_name(grp, "data")
+			fillvalue = numpy.nan if handlers[0].dtype.kind in 'fc' else 0
+			ds_data = grp.create_virtual_dataset("data", layout, fillvalue=fillvalue)
+			if handlers[0].chunks:
+				ds_data.attrs["virtual_chunks"] = handlers[0].chunks[:axis] + (1,) + handlers[0].chunks[axis:]
+			h5tools.write_dataset(grp, "unit", handlers[0].get_unit())
+			h5tools.write_dataset(grp, "label", dlabel)
+			h5tools.write_dataset(grp, "plotlabel", field.get_plotlabel())
+			array = DataArray(None, label=dlabel, plotlabel=field.get_plotlabel(),
+							  h5target=(True if stack.h5target is True else grp))
+			array._data = Data_Handler_H5.readonly_view(grp, h5target=array.h5target)
+			stack.datafields.append(array)
+
+		axes = list(first.axes)
+		axes.insert(axis, new_axis)
+		for ax in axes:
+			stack.add_axis(ax)
+		stack.check_data_consistency()
+		return stack
+
+
+def _histogram_edges(bins, range_, unit, datarange):
+	"""
+	Generates the bin edges for the histogram methods of the data handlers.
+
+	:param bins: The number of bins or the bin edges.
+
+	:param range_: The limits of the bins, or None to take them from datarange.
+
+	:param str unit: The unit of the data, in which the edges are given if they are not quantities.
+
+	:param datarange: A callable returning the minimum and maximum of the data.
+
+	:return: The bin edges and if the bins are of equal width.
+	:rtype: tuple(numpy.ndarray, bool)
+	"""
+	if numpy.ndim(bins) == 0:
+		if range_ is None:
+			vmin, vmax = datarange()
+		else:
+			vmin, vmax = [u.to_ureg(limit, unit).magnitude for limit in range_]
+		if vmin == vmax:  # Like numpy, generate a range of width 1 around the value.
+			vmin, vmax = vmin - 0.5, vmax + 0.5
+		return numpy.linspace(vmin, vmax, int(bins) + 1), True
+	edges = numpy.asarray(u.to_ureg(bins, unit).magnitude, dtype=numpy.float64)
+	assert numpy.all(numpy.diff(edges) > 0), "Bin edges must increase monotonically."
+	return edges, False
+
+
+def _histogram_blocks(read_block, selections, edges, uniform, axis, shape, threads=None):
+	"""
+	Calculates the histogram of data block-wise, with a pool of threads, each reading and processing one block.
+
+	:param read_block: A callable returning the data for a selection.
+
+	:param selections: The selections of the blocks. They must be tuples of slices for the axis given.
+
+	:param edges: The bin edges.
+
+	:param bool uniform: If the bins are of equal width.
+
+	:param int axis: If given, a histogram is calculated for each index along this axis.
+
+	:param tuple shape: The shape of the data.
+
+	:param int threads: The number of threads to use. Default: The number of CPUs.
+
+	:return: The counts.
+	:rtype: numpy.ndarray
+	"""
+	if axis is None:
+		counts = numpy.zeros(len(edges) - 1, dtype=numpy.int64)
+	else:
+		axis = axis % len(shape)
+		counts = numpy.zeros((shape[axis], len(edges) - 1), dtype=numpy.int64)
+
+	def partial_histogram(selection):
+		return selection, tools.block_histogram(read_block(selection), edges, uniform, axis)
+
+	pool = ThreadPool(threads)
+	try:
+		for selection, partial_counts in pool.imap_unordered(partial_histogram, selections):
+			if axis is None:
+				counts += partial_counts
+			else:
+				counts[full_slice(selection, len(shape))[axis]] += partial_counts
+	finally:
+		pool.close()
+		pool.join()
+	return counts
+
 
 def stack_DataArrays(datastack, axis=0, unit=None, label=None, plotlabel=None, h5target=None):
 	"""
@@ -3107,6 +5588,14 @@ def stack_DataSets(datastack, new_axis, axis=0, label=None, plotconf=None, h5tar
 	return DataSet.stack(datastack, new_axis, axis=axis, label=label, plotconf=plotconf, h5target=h5target)
 
 
+def stack_DataSets_virtual(sources, new_axis=None, axis=0, label=None, plotconf=None, h5target=True):
+	"""
+	Stacks a sequence of DataSets stored in HDF5 files to a new DataSet, without copying their data.
+	See DataSet.stack_virtual.
+	"""
+	return DataSet.stack_virtual(sources, new_axis, axis=axis, label=label, plotconf=plotconf, h5target=h5target)
+
+
 if __name__ == "__main__":  # just for testing
 	print("snomtools version " + __version__)
 	print('Testing...')
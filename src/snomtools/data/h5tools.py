@@ -12,8 +12,11 @@ import tempfile
 import os.path
 import sys
 import numpy
+from six import string_types
 from snomtools import __package__, __version__
 from snomtools.data.tools import find_next_prime
+from snomtools.data import profiling
+from snomtools.data import resources
 import snomtools.calcs.units as u
 
 __author__ = 'Michael Hartelt'
@@ -29,8 +32,8 @@ class File(h5py.File):
 	:code:`chunk_cache_mem_size_default` as defined above as buffer size if not given otherwise explicitly.
 	"""
 
-	def __init__(self, name, mode='a', chunk_cache_mem_size=None, w0=0.75, n_cache_chunks=None,
-				 **kwargs):
+	def __init__(self, name, mode='a', chunk_cache_mem_size=None, w0=0.75, n_cache_chunks=None, locking=None,
+				 libver=None, swmr=False, **kwargs):
 		"""
 		The constructor. Apart from calling the parent constructor. It uses code from the h5py_cache package
 		(Copyright (c) 2016 Mike Boyle, under MIT license)
@@ -59,6 +62,18 @@ class File(h5py.File):
 			integer greater than) the square root of the number of elements that can fit
 			into memory.  This is just used for the number of slots (nslots) maintained
 			in the cache metadata, so it can be set larger than needed with little cost.
+
+		:param bool locking: If :code:`False`, HDF5 file locking is disabled for this file handle. This allows several
+			processes to open the same file read-only at the same time, even if the file system doesn't support
+			locks. Default is :code:`None` for the HDF5 library default (locking enabled).
+
+		:param libver: The HDF5 library version bounds for the file format, as in h5py: A name like :code:`"latest"` or
+			:code:`"v110"`, or a tuple of lower and upper bound. Writing in SWMR mode requires :code:`"latest"`.
+			Default is :code:`None` for the HDF5 library default.
+		:type libver: str *or* tuple(str)
+
+		:param bool swmr: Open a file in read-only mode as a single-writer-multiple-reader (SWMR) reader, so data
+			appended by a writer in SWMR mode can be read while it is written. See :func:`start_swmr_write`.
 		"""
 		# Get default cache size if needed:
 		if chunk_cache_mem_size is None:
@@ -91,9 +106,31 @@ class File(h5py.File):
 		settings = list(propfaid.get_cache())
 		settings[1:] = (nslots, chunk_cache_mem_size, w0)
 		propfaid.set_cache(*settings)
+		if locking is not None:
+			if hasattr(propfaid, 'set_file_locking'):
+				propfaid.set_file_locking(bool(locking), True)
+			else:
+				warnings.warn("HDF5 file locking cannot be configured with this h5py version.")
+		if libver is not None:
+			if isinstance(libver, string_types):
+				libver = (libver, libver)
+			propfaid.set_libver_bounds(*[getattr(h5py.h5f, "LIBVER_" + bound.upper()) for bound in libver])
+		if swmr and mode == h5py.h5f.ACC_RDONLY:
+			mode |= h5py.h5f.ACC_SWMR_READ
 
 		h5py.File.__init__(self, h5py.h5f.open(name, flags=mode, fapl=propfaid), **kwargs)
 
+	def start_swmr_write(self):
+		"""
+		Switches the file to single-writer-multiple-reader (SWMR) mode, so readers opening it with :code:`swmr=True`
+		see data written afterwards after refreshing their datasets. The file must be opened with
+		:code:`libver="latest"`. In SWMR mode, no new groups, datasets or attributes can be created, but existing
+		datasets can be written to and resized. Data is visible to readers after :func:`flush`.
+
+		:return: Nothing.
+		"""
+		self.swmr_mode = True
+
 	def get_PropFAID(self):
 		"""
 		Retrieve a copy of the file access property list which manages access to this file.
@@ -123,7 +160,10 @@ class File(h5py.File):
 		return self.get_cache_params()[2]
 
 	def __del__(self):
-		self.__exit__()
+		try:
+			self.__exit__()
+		except AttributeError:  # Opening the file failed, so there is nothing to close.
+			pass
 
 
 class Tempfile(File):
@@ -146,6 +186,9 @@ class Tempfile(File):
 		# Save paths to clean up later:
 		self.temp_dir = temp_dir
 		self.temp_file_path = temp_file_path
+		profiling.count("temp files created")
+		if resources.monitors:
+			resources.tempfile_created(temp_file_path)
 
 	def __del__(self):
 		"""
@@ -154,6 +197,8 @@ class Tempfile(File):
 		"""
 		file_to_remove = self.temp_file_path
 		self.__exit__()
+		if resources.monitors:
+			resources.tempfile_closing(file_to_remove)
 		os.remove(file_to_remove)
 		try:
 			os.rmdir(self.temp_dir)
@@ -0,0 +1,372 @@
+"""
+This file provides the import of raw event lists of a delay line detector (DLD) and a histogramming engine to bin them
+into DataSets. In contrast to the histograms saved by Terra (see :mod:`snomtools.data.imports.tiff`), whose binning is
+fixed at acquisition, the events can be binned after the fact in any way: Energy (time channel) and space can be
+rebinned and restricted to a region of interest without reacquiring.
+
+Each event consists of a number of fields, typically the detector position x and y, the time channel t and the index
+of the delay or scan step. Event lists are read from HDF5 files, either as one compound dataset or as a group with a
+1D dataset per field, or from flat binary files of fixed-size records described by a numpy structured dtype (see
+:class:`EventList`).
+
+The events are streamed in blocks, so event lists of 10^9 events and more never need to fit into memory. The bins are
+regular and defined per field by :class:`Binning`. For each block, the flat bin index of each event is calculated and
+the counts are accumulated into the histogram, with blocks processed in parallel threads. If the histogram itself is
+larger than the memory budget, it is calculated in slabs along the first binned field, with one pass over the events
+per slab.
+
+Example::
+
+	events = EventList.from_h5("run.hdf5")
+	data = histogram_events(events, [Binning('scan', 0, 100, label='delay'),
+									 Binning('t', 1000, 1800, 4, label='channel', plotlabel='Time Channel'),
+									 Binning('y', 0, 1024, 2, unit='pixel'),
+									 Binning('x', 0, 1024, 2, unit='pixel')],
+							h5target="binned.hdf5")
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy
+import h5py
+import snomtools.data.datasets
+from snomtools.data import h5tools
+
+__author__ = 'Michael Hartelt'
+
+if '-v' in sys.argv or __name__ == "__main__":
+	verbose = True
+else:
+	verbose = False
+
+# An example record layout of flat binary event files, as numpy structured dtype. Give the actual layout of the files
+# to read to EventList.from_binary.
+binary_dtype_default = numpy.dtype([('x', '<u2'), ('y', '<u2'), ('t', '<u4'), ('scan', '<u2')])
+
+
+class EventList(object):
+	"""
+	A list of DLD events, read block-wise from a HDF5 file or a flat binary file. Use the classmethods
+	:func:`from_h5` and :func:`from_binary` to open one.
+	"""
+
+	def __init__(self, columns, label="events"):
+		"""
+		:param dict columns: The event fields, as a dict of field names and array-likes of equal length, supporting
+			slicing (numpy arrays, memmaps or h5py Datasets).
+
+		:param str label: A label for the events, used as label of the histogrammed DataSet.
+		"""
+		assert columns, "EventList without fields."
+		lengths = set(len(column) for column in columns.values())
+		assert len(lengths) == 1, "Event fields of different lengths given."
+		self.columns = columns
+		self.label = label
+
+	@classmethod
+	def from_h5(cls, h5source, name=None, fields=None):
+		"""
+		Opens an event list in a HDF5 file. The events are either stored as one compound dataset with a named field
+		per event field, or as a group with one 1D dataset per event field.
+
+		:param h5source: The path of the HDF5 file, or a h5py Group. A file given as path is opened in read-only mode
+			without file locking.
+		:type h5source: str *or* h5py.Group
+
+		:param str name: The name of the compound dataset or the group of the event fields. Default: The root group.
+
+		:param fields: The names of the fields to use. Default: All fields.
+		:type fields: sequence of str
+
+		:rtype: EventList
+		"""
+		if isinstance(h5source, h5py.Group):
+			label = os.path.basename(h5source.file.filename)
+		else:
+			label = os.path.basename(h5source)
+			h5source = h5tools.File(os.path.abspath(h5source), 'r', locking=False)
+		events = h5source if name is None else h5source[name]
+		if isinstance(events, h5py.Dataset):
+			assert events.dtype.names, "HDF5 event dataset must be a compound dataset with named fields."
+			names = fields or events.dtype.names
+			columns = dict((field, _CompoundField(events, field)) for field in names)
+		else:
+			names = fields or [key for key in events.keys() if isinstance(events[key], h5py.Dataset)]
+			columns = dict((field, events[field]) for field in names)
+		inst = cls(columns, label)
+		inst.h5source = h5source  # Keep the file open as long as the events are used.
+		return inst
+
+	@classmethod
+	def from_binary(cls, path, dtype=None, offset=0):
+		"""
+		Opens an event list in a flat binary file of fixed-size records. The file is memory mapped, so nothing is read
+		before it is used.
+
+		:param str path: The path of the file.
+
+		:param dtype: The record layout, as numpy structured dtype. Default: :code:`binary_dtype_default`.
+
+		:param int offset: The number of header bytes before the first record.
+
+		:rtype: EventList
+		"""
+		if dtype is None:
+			dtype = binary_dtype_default
+		dtype = numpy.dtype(dtype)
+		assert dtype.names, "Binary event records must be given as numpy structured dtype."
+		records = numpy.memmap(path, dtype=dtype, mode='r', offset=offset)
+		return cls(dict((field, records[field]) for field in dtype.names), os.path.basename(path))
+
+	@property
+	def fields(self):
+		return list(self.columns.keys())
+
+	def __len__(self):
+		return len(next(iter(self.columns.values())))
+
+	def read(self, start, stop, fields=None):
+		"""
+		Reads a block of events.
+
+		:param int start: The index of the first event.
+
+		:param int stop: The index after the last event.
+
+		:param fields: The fields to read. Default: All fields.
+		:type fields: sequence of str
+
+		:return: The data of the fields.
+		:rtype: dict
+		"""
+		if fields is None:
+			fields = self.fields
+		return dict((field, numpy.asarray(self.columns[field][start:stop])) for field in fields)
+
+
+class _CompoundField(object):
+	"""
+	A single field of a HDF5 compound dataset, readable by slicing without reading the other fields.
+	"""
+
+	def __init__(self, dataset, field):
+		self.dataset = dataset
+		self.field = field
+
+	def __len__(self):
+		return len(self.dataset)
+
+	def __getitem__(self, key):
+		return self.dataset.fields(self.field)[key]
+
+
+class Binning(object):
+	"""
+	The regular binning of an event field: Events with values in [start, stop) are counted in bins of width step,
+	all other events are dropped, so start and stop define the region of interest.
+	"""
+
+	def __init__(self, field, start, stop, step=1, label=None, unit=None, plotlabel=None, axis=None):
+		"""
+		:param str field: The name of the event field.
+
+		:param start: The lower limit of the first bin.
+
+		:param stop: The upper limit of the region of interest. If it is not a multiple of step above start, the last
+			bin is cut at stop.
+
+		:param step: The width of the bins.
+
+		:param str label: The label of the resulting axis. Default: The field name.
+
+		:param str unit: The unit of the resulting axis. Default: Dimensionless.
+
+		:param str plotlabel: The plotlabel of the resulting axis. Default: The label.
+
+		:param axis: An axis to use for the binned field instead of the lower bin limits, e.g. the delay values of
+			the scan steps. Its length must be the number of bins.
+		:type axis: snomtools.data.datasets.Axis
+		"""
+		assert stop > start, "Binning of field {0} with empty range.".format(field)
+		assert step > 0, "Binning of field {0} with non-positive bin width.".format(field)
+		self.field = field
+		self.start = start
+		self.stop = stop
+		self.step = step
+		self.label = label or field
+		self.unit = unit
+		self.plotlabel = plotlabel or self.label
+		if axis is not None:
+			assert len(axis) == self.nbins, "Axis for binning of field {0} doesn't fit number of bins.".format(field)
+		self.axis = axis
+
+	@property
+	def nbins(self):
+		return int(numpy.ceil((self.stop - self.start) / self.step))
+
+	def indices(self, values):
+		"""
+		The bin indices of values.
+
+		:param numpy.ndarray values: The values of the event field.
+
+		:return: The bin indices, and a mask of the values inside the region of interest.
+		:rtype: tuple(numpy.ndarray)
+		"""
+		valid = (values >= self.start) & (values < self.stop)
+		if numpy.issubdtype(values.dtype, numpy.integer) and float(self.step).is_integer() and \
+				float(self.start).is_integer():
+			indices = (values.astype(numpy.int64) - int(self.start)) // int(self.step)
+		else:
+			indices = numpy.floor((values - self.start) / self.step).astype(numpy.int64)
+			# Rounding can put values just below stop into the bin nbins, which doesn't exist, so they go to the last:
+			numpy.minimum(indices, self.nbins - 1, out=indices)
+		return indices, valid
+
+	def get_axis(self):
+		"""
+		The axis of the binned field.
+
+		:rtype: snomtools.data.datasets.Axis
+		"""
+		if self.axis is not None:
+			return snomtools.data.datasets.Axis(self.axis, label=self.label, plotlabel=self.plotlabel)
+		return snomtools.data.datasets.Axis(self.start + numpy.arange(self.nbins) * self.step, unit=self.unit,
+											label=self.label, plotlabel=self.plotlabel)
+
+
+def _histogram_slab(events, binnings, slab, blocksize, threads):
+	"""
+	Histograms the events into a slab of bins along the first binning.
+
+	:param tuple slab: The range of bin indices (start, stop) of the first binning.
+
+	:return: The counts of the slab.
+	:rtype: numpy.ndarray
+	"""
+	shape = (slab[1] - slab[0],) + tuple(b.nbins for b in binnings[1:])
+	nbins = int(numpy.prod(shape, dtype=numpy.int64))
+	strides = numpy.cumprod((1,) + shape[:0:-1], dtype=numpy.int64)[::-1]
+	hist = numpy.zeros(nbins, dtype=numpy.int64)
+	lock = threading.Lock()
+	fields = [b.field for b in binnings]
+
+	def process(start):
+		data = events.read(start, min(start + blocksize, len(events)), fields)
+		flat = numpy.zeros(len(data[fields[0]]), dtype=numpy.int64)
+		valid = numpy.ones(len(flat), dtype=bool)
+		for i, (binning, stride) in enumerate(zip(binnings, strides)):
+			indices, inside = binning.indices(data[binning.field])
+			if i == 0:
+				indices -= slab[0]
+				inside &= (indices >= 0) & (indices < shape[0])
+			valid &= inside
+			flat += indices * stride
+		flat = flat[valid]
+		if nbins <= 4 * len(flat):
+			counts = numpy.bincount(flat, minlength=nbins)
+			with lock:
+				numpy.add(hist, counts, out=hist)
+		else:  # Sparse block: Avoid touching the whole histogram.
+			occupied, counts = numpy.unique(flat, return_counts=True)
+			with lock:
+				hist[occupied] += counts
+
+	pool = ThreadPool(threads)
+	try:
+		for _ in pool.imap_unordered(process, range(0, len(events), blocksize)):
+			pass
+	finally:
+		pool.close()
+		pool.join()
+	return hist.reshape(shape)
+
+
+def histogram_events(events, binnings, h5target=None, label=None, blocksize=2 ** 22, threads=None,
+					 max_memory=2 ** 30, dtype=numpy.uint32):
+	"""
+	Histograms DLD events into a DataSet, streaming the events in blocks.
+
+	:param events: The events.
+	:type events: EventList
+
+	:param binnings: The binnings of the event fields, in the order of the axes of the result.
+	:type binnings: sequence of Binning
+
+	:param h5target: The h5target for the resulting DataSet: A path of a HDF5 file, a h5py Group, True for a temp
+		file or None for numpy mode.
+
+	:param str label: The label of the resulting DataSet. Default: The label of the events.
+
+	:param int blocksize: The number of events read and processed per block.
+
+	:param int threads: The number of threads processing blocks in parallel. Default: The number of CPUs.
+
+	:param int max_memory: The memory budget for the histogram in bytes, including the temporary counts of each
+		thread. Larger histograms are calculated in slabs along the first binning, with one pass over the events per
+		slab.
+
+	:param dtype: The data type of the counts.
+
+	:return: The DataSet with the DataArray "counts" and one axis per binning.
+	:rtype: snomtools.data.datasets.DataSet
+	"""
+	binnings = list(binnings)
+	for binning in binnings:
+		assert binning.field in events.fields, "Event field {0} not found.".format(binning.field)
+	if label is None:
+		label = events.label
+	shape = tuple(b.nbins for b in binnings)
+	if threads is None:
+		threads = multiprocessing.cpu_count()
+	# The accumulator is int64, per slab, and each thread may count a block into a temporary of the same size:
+	slab_bins = max(int(max_memory // (8 * (threads + 1) * numpy.prod(shape[1:], dtype=numpy.int64))), 1)
+	slabs = [(a, min(a + slab_bins, shape[0])) for a in range(0, shape[0], slab_bins)]
+	if verbose:
+		print("Histogramming {0:d} events into {1} bins in {2:d} slab(s)".format(len(events), shape, len(slabs)))
+
+	if len(slabs) == 1:
+		hist = _histogram_slab(events, binnings, slabs[0], blocksize, threads).astype(dtype)
+		da = snomtools.data.datasets.DataArray(hist, unit='count', label='counts', plotlabel='Counts')
+		return snomtools.data.datasets.DataSet(label, [da], [b.get_axis() for b in binnings], h5target=h5target)
+
+	# The histogram doesn't fit into memory, so write it slab by slab:
+	ds = snomtools.data.datasets.DataSet(label, h5target=(h5target or True))
+	h5grp = ds.datafieldgrp
+	if h5grp is not True:  # Proper h5 file mode
+		h5grp = h5grp.require_group('counts')
+	da = snomtools.data.datasets.DataArray(None, label='counts', plotlabel='Counts', h5target=h5grp)
+	da._data = snomtools.data.datasets.Data_Handler_H5(unit='count', shape=shape,
+													   h5target=(None if h5grp is True else h5grp), dtype=dtype)
+	for slab in slabs:
+		da._data.ds_data[slab[0]:slab[1]] = _histogram_slab(events, binnings, slab, blocksize, threads)
+		if verbose:
+			print("Slab {0} done.".format(slab))
+	if ds.h5target is not True:  # Proper h5 file mode, so write metadata next to data.
+		da.write_to_h5()
+	ds.datafields = [da]
+	for binning in binnings:
+		ds.add_axis(binning.get_axis())
+	return ds
+
+
+if __name__ == "__main__":
+	n = 10 ** 6
+	testevents = numpy.empty(n, dtype=binary_dtype_default)
+	testevents['x'] = numpy.random.randint(0, 512, n)
+	testevents['y'] = numpy.random.randint(0, 512, n)
+	testevents['t'] = numpy.random.normal(1400, 100, n).clip(0)
+	testevents['scan'] = numpy.random.randint(0, 10, n)
+	testevents.tofile("testevents.bin")
+	events = EventList.from_binary("testevents.bin")
+	binned = histogram_events(events, [Binning('scan', 0, 10, label='delay'),
+									   Binning('t', 1000, 1800, 8, label='channel', plotlabel='Time Channel'),
+									   Binning('y', 0, 512, 4, unit='pixel'),
+									   Binning('x', 0, 512, 4, unit='pixel')])
+	print(binned.shape, binned.get_datafield(0).data.sum())
@@ -12,6 +12,7 @@ import os
 import numpy
 import sys
 import snomtools.data.datasets as ds
+import snomtools.data.tools
 import snomtools.data.imports.tiff as tiff
 
 __author__ = 'Michael Hartelt'
@@ -55,7 +56,7 @@ def hist_asc(source, T_start=None, T_bin=1, tif_probe=None):
 		infile.close()
 
 	# Read the "HistoXplusY" column from the .asc file to an array:
-	count_data = numpy.loadtxt(filepath, dtype=int, skiprows=1, usecols=2)
+	count_data = snomtools.data.tools.read_textfile(filepath, dtype=int, skiprows=1, usecols=2)[0][:, 0]
 	# Trim the trailing zeroes:
 	count_data = numpy.trim_zeros(count_data, 'b')
 
@@ -0,0 +1,428 @@
+"""
+This file provides the live acquisition mode for Terra scans: A watcher follows a Terra scan folder while it is
+measured, reads each new tiff file as soon as Terra has finished writing it, and appends it to a DataSet in a HDF5
+file. Running projections of the data (e.g. the summed image and the spectrum of each scan step) are updated with
+each step. The file is written in single-writer-multiple-reader (SWMR) mode, so another process can open it with
+:func:`open_live` and read or plot the growing data while the scan is running::
+
+	# In the acquisition process:
+	watcher = tr_dld_watcher("/path/to/measurement/1. Durchlauf", "live.hdf5")
+	watcher.watch(timeout=600)
+	watcher.close()
+
+	# In a separate process:
+	data = open_live("live.hdf5", projection="y_x")
+	while True:
+		refresh(data)
+		(plot data)
+
+The file has the same structure as written by :func:`snomtools.data.datasets.DataSet.saveh5`, so after the scan it
+can be loaded like any other DataSet. The running projections are stored as DataSets in the group
+:code:`projections`.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import numpy
+from six import string_types
+import snomtools.calcs.units as u
+import snomtools.data.datasets
+import snomtools.data.profiling
+import snomtools.data.imports.tiff as tiff
+from snomtools.data import h5tools
+
+__author__ = 'Michael Hartelt'
+
+if '-v' in sys.argv:
+	verbose = True
+else:
+	verbose = False
+
+
+class TerraFolderWatcher(object):
+	"""
+	Follows a Terra scan folder and ingests the scan steps into a growing DataSet in a HDF5 file in SWMR mode, as
+	they arrive. See the module documentation.
+	"""
+
+	def __init__(self, folderpath, h5target, detector="dld", pattern="D", scanunit="um", scanfactor=1,
+				 scanaxislabel="scanaxis", scanaxispl=None, projections=None, settle_time=1.,
+				 chunk_cache_mem_size=None):
+		"""
+		The parameters describing the scan are the same as for
+		:func:`snomtools.data.imports.tiff.measurement_folder_peem_terra`.
+
+		:param str folderpath: The path of the folder containing the scan data. Example:
+			"/path/to/measurement/1. Durchlauf"
+
+		:param str h5target: The path of the HDF5 file to write to. It is overwritten if it exists. SWMR requires a file
+			of its own, so groups of other files are not supported.
+
+		:param str detector: :code:`"dld"` or :code:`"camera"`.
+
+		:param str pattern: The pattern in the filenames that indicates the scan enumeration.
+
+		:param str scanunit: A valid unit string, according to the physical dimension that was scanned over.
+
+		:param float scanfactor: A factor that the numbers in the filenames need to be multiplied with to get the
+			real value of the scan point in units of scanunit.
+
+		:param str scanaxislabel: A label for the axis of the scan.
+
+		:param str scanaxispl: A plot label for the axis of the scan.
+
+		:param projections: The running projections to keep up to date, each given as a sequence of axis labels to
+			project onto. Projections containing the scan axis grow with the scan, all others are accumulated. Default:
+			The image (:code:`("y", "x")`) and, for DLD data, the spectrum of each scan step
+			(:code:`(scanaxislabel, "channel")`) or, for camera data, the total counts of each scan step
+			(:code:`(scanaxislabel,)`).
+		:type projections: sequence of tuple(str)
+
+		:param float settle_time: The time in seconds a file must stay unchanged before it is read, so files that are
+			still being written by Terra are not read.
+
+		:param int chunk_cache_mem_size: The chunk cache size for the HDF5 file.
+		"""
+		assert detector in ["dld", "camera"], "Invalid detector mode."
+		self.folderpath = os.path.abspath(folderpath)
+		self.h5path = os.path.abspath(h5target)
+		self.detector = detector
+		self.pattern = pattern
+		self.scanunit = scanunit
+		self.scanfactor = scanfactor
+		self.scanaxislabel = scanaxislabel
+		if scanaxispl is None:
+			scanaxispl = 'Scan / ' + scanunit
+		self.scanaxispl = scanaxispl
+		if projections is None:
+			if detector == "dld":
+				projections = [("y", "x"), (scanaxislabel, "channel")]
+			else:
+				projections = [("y", "x"), (scanaxislabel,)]
+		self.projection_axes = [tuple(labels) for labels in projections]
+		self.settle_time = settle_time
+		self.chunk_cache_mem_size = chunk_cache_mem_size
+
+		self.h5file = None
+		self.dataset = None
+		self.projections = {}
+		self.ingested = []  # The filenames that were ingested, in order.
+		self.last_scanstep = None  # The scan step ingested last.
+		self._candidates = {}  # Files not ingested yet: (size, modification time) at the last poll.
+
+	@staticmethod
+	def projection_name(labels):
+		"""
+		The name of a running projection in the :code:`projections` group of the file.
+
+		:param labels: The axis labels the projection is onto.
+		:type labels: sequence of str
+
+		:rtype: str
+		"""
+		return "_".join(labels)
+
+	def new_files(self):
+		"""
+		Inspects the folder for scan files that are complete and not ingested yet. A file is regarded complete if its
+		size and modification time didn't change since the last call and it is older than :code:`settle_time`.
+		Complete files are held back while a file of an earlier scan step is still incomplete, so the scan axis stays
+		sorted like in :func:`snomtools.data.imports.tiff.measurement_folder_peem_terra`.
+
+		:return: The scan steps and filenames of the complete files that can be ingested, sorted by scan step.
+		:rtype: list(tuple)
+
+		:raises ValueError: If a file of a scan step before the last ingested one appears, as it can't be inserted
+			into the scan anymore.
+		"""
+		complete = []
+		first_incomplete = None
+		now = time.time()
+		for scanstep, filename in tiff.terra_scanfiles(self.folderpath, self.pattern).items():
+			if filename in self.ingested:
+				continue
+			if self.last_scanstep is not None and scanstep < self.last_scanstep:
+				raise ValueError("Scan file {0} of step {1} appeared after step {2} was ingested.".format(
+					filename, scanstep, self.last_scanstep))
+			try:
+				stat = os.stat(os.path.join(self.folderpath, filename))
+			except OSError:  # File was moved or deleted in the meantime.
+				continue
+			state = (stat.st_size, stat.st_mtime)
+			if self._candidates.get(filename) == state and now - stat.st_mtime >= self.settle_time:
+				complete.append((scanstep, filename))
+			elif first_incomplete is None or scanstep < first_incomplete:
+				first_incomplete = scanstep
+			self._candidates[filename] = state
+		return sorted(entry for entry in complete if first_incomplete is None or entry[0] < first_incomplete)
+
+	def poll(self):
+		"""
+		Ingests all complete new files in the folder.
+
+		:return: The number of ingested files.
+		:rtype: int
+		"""
+		files = self.new_files()
+		for scanstep, filename in files:
+			self.ingest(filename, scanstep)
+		return len(files)
+
+	def read(self, filename):
+		"""
+		Reads a single scan file.
+
+		:param str filename: The name of the file in the folder.
+
+		:rtype: snomtools.data.datasets.DataSet
+		"""
+		with snomtools.data.profiling.span("read tiff", file=filename):
+			if self.detector == "dld":
+				return tiff.peem_dld_read_terra(os.path.join(self.folderpath, filename))
+			else:
+				return tiff.peem_camera_read_terra(os.path.join(self.folderpath, filename))
+
+	def ingest(self, filename, scanstep):
+		"""
+		Reads a scan file, appends it to the DataSet and updates the running projections. The data is flushed, so
+		readers see it after refreshing.
+
+		:param str filename: The name of the file in the folder.
+
+		:param float scanstep: The number of the scan step, as in the filename.
+
+		:return: Nothing.
+		"""
+		step = self.read(filename)
+		scanvalue = u.to_ureg(scanstep * self.scanfactor, self.scanunit)
+		with snomtools.data.profiling.span("ingest scan step", file=filename):
+			if self.dataset is None:
+				self._initialize(step, scanvalue)
+			else:
+				assert step.shape == self.dataset.shape[1:], "Trying to combine scan data with different shape."
+				self.dataset.append(step, self.scanaxislabel, scanvalue)
+				for labels, projection in self.projections.items():
+					self._update_projection(labels, projection, step, scanvalue)
+			self.h5file.flush()
+		self.ingested.append(filename)
+		self.last_scanstep = scanstep
+		self._candidates.pop(filename, None)
+		if verbose:
+			print("Ingested {0} as scan step {1:d}".format(filename, self.dataset.shape[0]))
+
+	def _project_step(self, labels, step):
+		"""
+		Projects a single scan step onto the axes of a running projection, except the scan axis.
+		"""
+		others = [label for label in labels if label != self.scanaxislabel]
+		if others:
+			return step.project_nd(*others)
+		field = step.get_datafield(0)
+		return snomtools.data.datasets.DataSet(step.get_label(), [
+			snomtools.data.datasets.DataArray(field.sum(), label=field.get_label(), plotlabel=field.get_plotlabel())])
+
+	def _initialize(self, step, scanvalue):
+		"""
+		Creates the HDF5 file with the DataSet and the running projections from the first scan step and starts SWMR
+		mode. All HDF5 objects must be created here, because none can be added in SWMR mode.
+		"""
+		self.h5file = h5tools.File(self.h5path, 'w', chunk_cache_mem_size=self.chunk_cache_mem_size, libver='latest')
+		scanaxis = snomtools.data.datasets.Axis(u.to_ureg(numpy.atleast_1d(scanvalue.magnitude), scanvalue.units),
+												label=self.scanaxislabel, plotlabel=self.scanaxispl)
+		datafields = [snomtools.data.datasets.DataArray(u.to_ureg(field.get_data_raw()[numpy.newaxis],
+																 field.get_unit()),
+														label=field.get_label(), plotlabel=field.get_plotlabel())
+					  for field in step.datafields]
+		self.dataset = snomtools.data.datasets.DataSet("Terra Scan " + self.folderpath, datafields,
+													   [scanaxis] + step.axes, h5target=self.h5file)
+		# Chunks of one scan step, so each appended step writes complete chunks:
+		self.dataset.make_appendable(self.scanaxislabel, chunk_length=1)
+		self.dataset.saveh5()
+
+		projectionsgrp = self.h5file.require_group("projections")
+		for labels in self.projection_axes:
+			projected = self._project_step(labels, step)
+			if self.scanaxislabel in labels:
+				axes = [scanaxis] + projected.axes
+				datafields = [snomtools.data.datasets.DataArray(u.to_ureg(field.get_data_raw()[numpy.newaxis],
+																		 field.get_unit()),
+																label=field.get_label(),
+																plotlabel=field.get_plotlabel())
+							  for field in projected.datafields]
+			else:
+				axes = projected.axes
+				datafields = projected.datafields
+			grp = projectionsgrp.require_group(self.projection_name(labels))
+			projection = snomtools.data.datasets.DataSet(self.projection_name(labels), datafields, axes, h5target=grp)
+			if self.scanaxislabel in labels:
+				projection.make_appendable(self.scanaxislabel)
+			projection.saveh5()
+			self.projections[labels] = projection
+
+		self.h5file.flush()
+		self.h5file.start_swmr_write()
+
+	def _update_projection(self, labels, projection, step, scanvalue):
+		"""
+		Adds a scan step to a running projection.
+		"""
+		projected = self._project_step(labels, step)
+		if self.scanaxislabel in labels:
+			projection.append(projected, self.scanaxislabel, scanvalue)
+		else:
+			for field in projection.datafields:
+				data = field.get_data()
+				data[...] = u.to_ureg(data.ds_data[...], field.get_unit()) + \
+							projected.get_datafield(field.get_label()).get_data()
+
+	def watch(self, interval=1., timeout=None, steps=None):
+		"""
+		Follows the folder, ingesting new files as they arrive, until one of the stop conditions is met or the watch
+		is interrupted with Ctrl-C.
+
+		:param float interval: The time in seconds between two inspections of the folder.
+
+		:param float timeout: Stop if no new file arrived for this time in seconds. Default: No timeout.
+
+		:param int steps: Stop after this number of scan steps was ingested in total. Default: No limit.
+
+		:return: The DataSet, or None if no file was ingested yet.
+		:rtype: snomtools.data.datasets.DataSet
+		"""
+		last_arrival = time.time()
+		try:
+			while True:
+				if self.poll():
+					last_arrival = time.time()
+				if steps is not None and len(self.ingested) >= steps:
+					break
+				if timeout is not None and time.time() - last_arrival > timeout:
+					break
+				time.sleep(interval)
+		except KeyboardInterrupt:
+			if verbose:
+				print("Watch interrupted.")
+		return self.dataset
+
+	def close(self):
+		"""
+		Closes the HDF5 file. The file can then be loaded like any saved DataSet.
+
+		:return: Nothing.
+		"""
+		if self.h5file is not None:
+			self.dataset = None
+			self.projections = {}
+			self.h5file.close()
+			self.h5file = None
+
+
+def tr_dld_watcher(folderpath, h5target, delayunit="um", delayfactor=0.2, delayunitlabel=None, **kwargs):
+	"""
+	A watcher for a time scan measured with the DLD, with the same axis conventions as
+	:func:`snomtools.data.imports.tiff.tr_folder_peem_dld_terra`.
+
+	:param str folderpath: The path of the folder containing the scan data.
+
+	:param str h5target: The path of the HDF5 file to write to.
+
+	:param str delayunit: A valid unit string, according to the physical dimension that was scanned over.
+
+	:param float delayfactor: A factor that the numbers in the filenames need to be multiplied with to get the
+		real value of the scan point in units of delayunit.
+
+	:param str delayunitlabel: A label for the delay axis.
+
+	:param kwargs: Further keyword arguments for :class:`TerraFolderWatcher`.
+
+	:rtype: TerraFolderWatcher
+	"""
+	if delayunitlabel is None:
+		delayunitlabel = delayunit
+	return TerraFolderWatcher(folderpath, h5target, "dld", "D", delayunit, delayfactor, "delay",
+							  'Pulse Delay / ' + delayunitlabel, **kwargs)
+
+
+def open_live(path, projection=None, chunk_cache_mem_size=None):
+	"""
+	Opens a file written by a :class:`TerraFolderWatcher` as a SWMR reader, while it is still being written. Nothing
+	is copied, the DataSet works on read-only views of the file. Use :func:`refresh` to see newly ingested scan steps.
+
+	:param str path: The path of the HDF5 file.
+
+	:param projection: The name of a running projection to open (see :func:`TerraFolderWatcher.projection_name`)
+		instead of the full data.
+	:type projection: str *or* sequence of str
+
+	:param int chunk_cache_mem_size: The chunk cache size for the HDF5 file.
+
+	:rtype: snomtools.data.datasets.DataSet
+	"""
+	h5file = h5tools.File(os.path.abspath(path), 'r', chunk_cache_mem_size=chunk_cache_mem_size, swmr=True)
+	if projection is not None:
+		if not isinstance(projection, string_types):
+			projection = TerraFolderWatcher.projection_name(projection)
+		h5source = h5file["projections"][projection]
+	else:
+		h5source = h5file
+	dataset = snomtools.data.datasets.DataSet.from_h5(h5source, readonly=True)
+	# The file is closed when its File object is deleted, so keep it with the DataSet working on it:
+	dataset.h5file = h5file
+	return dataset
+
+
+def refresh(dataset, retries=10, wait=0.01):
+	"""
+	Refreshes a DataSet opened with :func:`open_live`, so it contains all scan steps written so far. As the writer
+	updates the datafields and the axes one after the other, a refresh can catch them with different lengths. In that
+	case it is retried after a short wait.
+
+	:param dataset: The DataSet opened with :func:`open_live`.
+
+	:param int retries: The number of retries if the data is caught in an inconsistent state.
+
+	:param float wait: The time in seconds to wait before a retry.
+
+	:return: True if the DataSet is consistent after the refresh.
+	:rtype: bool
+	"""
+	for i in range(retries + 1):
+		for array in dataset.alldata:
+			array.get_data().refresh()
+		try:
+			return dataset.check_data_consistency()
+		except AssertionError:
+			time.sleep(wait)
+	return False
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Watch a Terra scan folder and ingest new tiff files into a HDF5 file "
+												 "in SWMR mode, which can be read while the scan is running.")
+	parser.add_argument("folder", help="The Terra scan folder to watch.")
+	parser.add_argument("output", help="The HDF5 file to write.")
+	parser.add_argument("--detector", default="dld", choices=["dld", "camera"], help="The detector used.")
+	parser.add_argument("--pattern", default="D", help="The pattern of the scan device in the filenames.")
+	parser.add_argument("--scanunit", default="um", help="The unit of the scan values.")
+	parser.add_argument("--scanfactor", type=float, default=0.2, help="The factor for the numbers in the filenames.")
+	parser.add_argument("--scanaxislabel", default="delay", help="The label of the scan axis.")
+	parser.add_argument("--interval", type=float, default=1., help="Seconds between inspections of the folder.")
+	parser.add_argument("--timeout", type=float, help="Stop if no new file arrived for this many seconds.")
+	parser.add_argument("--steps", type=int, help="Stop after this number of scan steps.")
+	parser.add_argument("-v", action="store_true", help="Verbose output.")
+	args = parser.parse_args(argv)
+	watcher = TerraFolderWatcher(args.folder, args.output, args.detector, args.pattern, args.scanunit,
+								 args.scanfactor, args.scanaxislabel)
+	watcher.watch(args.interval, args.timeout, args.steps)
+	print("Ingested {0:d} scan steps into {1}".format(len(watcher.ingested), watcher.h5path))
+	watcher.close()
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
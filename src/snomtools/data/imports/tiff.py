@@ -8,13 +8,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import snomtools.data.datasets
+import snomtools.data.profiling
 import os
 import numpy
 import tifffile
 import re
 import warnings
 import sys
+import h5py
 import snomtools.calcs.units as u
+from snomtools.data import h5tools
 from snomtools.data.h5tools import probe_chunksize
 
 __author__ = 'Michael Hartelt'
@@ -80,6 +83,28 @@ def is_tif(filename):
 	return os.path.splitext(filename)[1] in [".tiff", ".tif"]
 
 
+def terra_scanfiles(folderpath, pattern="D"):
+	"""
+	Finds the files of a Terra scan in a folder, by the pattern in the filenames that indicates the scan enumeration
+	and is followed by the number of the scan step.
+
+	:param str folderpath: The path of the folder containing the scan data.
+
+	:param str pattern: The pattern in the filenames, see :func:`measurement_folder_peem_terra`.
+
+	:return: The filenames, by the number of their scan step.
+	:rtype: dict
+	"""
+	pat = re.compile(pattern + "(-?\d*).tif")
+	scanfiles = {}
+	for filename in filter(is_tif, os.listdir(folderpath)):
+		found = re.search(pat, filename)
+		if found:
+			scanstep = float(found.group(1))
+			scanfiles[scanstep] = filename
+	return scanfiles
+
+
 def search_tag(tif, tag_id):
 	"""
 	Searches for a tag in all pages of a tiff file and returns the first match as
@@ -102,6 +127,58 @@ def search_tag(tif, tag_id):
 	return None
 
 
+def tiff_data_segments(filepath, skip_pages=0):
+	"""
+	Locates the raw pixel data of an uncompressed tiff file, as written by Terra. The byte ranges of the image strips
+	of all pages are collected in order, coalescing strips that follow each other directly in the file. Together, they
+	hold the image stack in C order, so they can be used as external storage of a HDF5 dataset, see
+	:func:`measurement_folder_peem_terra`.
+
+	:param str filepath: The path of the tiff file.
+
+	:param int skip_pages: The number of pages to skip at the beginning, e.g. 2 for the sum and error images of Terra
+		DLD files.
+
+	:return: The shape of the image stack (or image for single page files), its data type (with the byte order of the
+		file), and the byte ranges of the data, as a list of (offset, size) tuples.
+	:rtype: tuple(tuple(int), numpy.dtype, list)
+
+	:raises ValueError: If the pixel data cannot be referenced directly, e.g. because it is compressed or tiled.
+	"""
+	segments = []
+	frameshape, dtype = None, None
+	with tifffile.TiffFile(filepath) as tif:
+		pages = list(tif.pages)[skip_pages:]
+		for page in pages:
+			keyframe = getattr(page, "keyframe", page)
+			if keyframe.compression != 1 or keyframe.predictor != 1 or keyframe.fillorder != 1:
+				raise ValueError("Tiff data in {0} is compressed or encoded.".format(filepath))
+			if keyframe.is_tiled or keyframe.samplesperpixel != 1:
+				raise ValueError("Tiff data in {0} is not a plain stack of images.".format(filepath))
+			pagetype = numpy.dtype(keyframe.dtype).newbyteorder(tif.byteorder)
+			if keyframe.bitspersample != 8 * pagetype.itemsize:
+				raise ValueError("Tiff data in {0} has no byte-aligned pixels.".format(filepath))
+			if frameshape is None:
+				frameshape, dtype = tuple(keyframe.shape), pagetype
+			elif tuple(keyframe.shape) != frameshape or pagetype != dtype:
+				raise ValueError("Tiff pages in {0} have different shapes or data types.".format(filepath))
+			pagebytes = 0
+			for offset, size in zip(page.dataoffsets, page.databytecounts):
+				size = min(int(size), int(numpy.prod(frameshape)) * dtype.itemsize - pagebytes)
+				pagebytes += size
+				if segments and segments[-1][0] + segments[-1][1] == offset:
+					segments[-1] = (segments[-1][0], segments[-1][1] + size)
+				else:
+					segments.append((int(offset), size))
+			if pagebytes != numpy.prod(frameshape) * dtype.itemsize:
+				raise ValueError("Tiff data in {0} is incomplete.".format(filepath))
+	if frameshape is None:
+		raise ValueError("No image data in {0}.".format(filepath))
+	if len(pages) > 1:
+		return (len(pages),) + frameshape, dtype, segments
+	return frameshape, dtype, segments
+
+
 def peem_dld_read(filepath, mode="terra"):
 	"""
 	Reads a time-resolved dld dataset. Shadows the different readin functions for the different measurement programs
@@ -483,8 +560,9 @@ def dummy_folder_peem_dld_terra(folderpath, h5target=True):
 	return measurement_folder_peem_terra(folderpath, "dld", "N", "", 1, "dummyaxis", pl, h5target)
 
 
+@snomtools.data.profiling.profiled("measurement_folder_peem_terra")
 def measurement_folder_peem_terra(folderpath, detector="dld", pattern="D", scanunit="um", scanfactor=1,
-								  scanaxislabel="scanaxis", scanaxispl=None, h5target=True):
+								  scanaxislabel="scanaxis", scanaxispl=None, h5target=True, index_only=False):
 	"""
 	The base method for importing terra scan folders. Covers all scan possibilities, so far only in 1D scans.
 
@@ -518,6 +596,14 @@ def measurement_folder_peem_terra(folderpath, detector="dld", pattern="D", scanu
 	:param h5target: The HDF5 target to write to.
 	:type h5target: str **or** h5py.Group **or** True, *optional*
 
+	:param bool index_only: If :code:`True`, the pixel data is not copied. Instead, the byte ranges of the image data
+		in the tiffs are recorded (see :func:`tiff_data_segments`) and used as external storage of one HDF5 dataset per
+		tiff, which are stacked with a virtual dataset. The import then only reads the tiff headers, and all reads
+		come straight from the tiffs, which must stay where they are. The data is a read-only view (see
+		:func:`snomtools.data.datasets.Data_Handler_H5.readonly_view`): The first write, or
+		:func:`~snomtools.data.datasets.Data_Handler_H5.make_writable`, converts it to a compressed HDF5 dataset. This
+		requires uncompressed tiffs, as written by Terra.
+
 	:return: Imported DataSet.
 	:rtype: DataSet
 	"""
@@ -525,19 +611,11 @@ def measurement_folder_peem_terra(folderpath, detector="dld", pattern="D", scanu
 	if scanaxispl is None:
 		scanaxispl = 'Scan / ' + scanunit
 
-	# Compile regex for file detection:
-	pat = re.compile(pattern + "(-?\d*).tif")
-
 	# Translate input path to absolute path:
 	folderpath = os.path.abspath(folderpath)
 
 	# Inspect the given folder for time step files:
-	scanfiles = {}
-	for filename in filter(is_tif, os.listdir(folderpath)):
-		found = re.search(pat, filename)
-		if found:
-			scanstep = float(found.group(1))
-			scanfiles[scanstep] = filename
+	scanfiles = terra_scanfiles(folderpath, pattern)
 
 	# Generate delay axis:
 	axlist = []
@@ -554,6 +632,9 @@ def measurement_folder_peem_terra(folderpath, detector="dld", pattern="D", scanu
 	axlist = [scanaxis] + sample_data.axes
 	newshape = scanaxis.shape + sample_data.shape
 
+	if index_only:
+		return _measurement_folder_index(folderpath, scanfiles, detector, sample_data, axlist, h5target)
+
 	chunks = True
 	compression = 'gzip'
 	compression_opts = 4
@@ -581,37 +662,96 @@ def measurement_folder_peem_terra(folderpath, detector="dld", pattern="D", scanu
 	dataset = snomtools.data.datasets.DataSet("Terra Scan " + folderpath, [dataarray], axlist, h5target=h5target,
 											  chunk_cache_mem_size=use_cache_size)
 	dataarray = dataset.get_datafield(0)
+	# The chunks span several scan steps, so collect the steps of each chunk before compressing it:
+	buffered = isinstance(dataarray.data, snomtools.data.datasets.Data_Handler_H5)
+	if buffered:
+		dataarray.data.buffer_writes(use_cache_size)
 
 	# Fill in data from imported tiffs:
 	slicebase = tuple([numpy.s_[:] for j in range(len(sample_data.shape))])
 
 	if verbose:
-		import time
 		print("Reading Terra Scan Folder of shape: ", dataset.shape)
 		print("... generating chunks of shape: ", dataset.get_datafield(0).data.ds_data.chunks)
 		print("... using cache size {0:d} MB".format(use_cache_size // 1024 ** 2))
-		start_time = time.time()
-
-	for i, scanstep in zip(list(range(len(scanfiles))), iter(sorted(scanfiles.keys()))):
-		islice = (i,) + slicebase
-		# Import tiff:
-		if detector == "dld":
-			idata = peem_dld_read_terra(os.path.join(folderpath, scanfiles[scanstep]))
-		else:
-			idata = peem_camera_read_terra(os.path.join(folderpath, scanfiles[scanstep]))
-		# Check data consistency:
-		assert idata.shape == sample_data.shape, "Trying to combine scan data with different shape."
-		for ax1, ax2 in zip(idata.axes, sample_data.axes):
-			assert ax1.units == ax2.units, "Trying to combine scan data with different axis dimensionality."
-		assert idata.get_datafield(0).units == sample_data.get_datafield(0).units, \
-			"Trying to combine scan data with different data dimensionality."
-		# Write data:
-		dataarray[islice] = idata.get_datafield(0).data
-		if verbose:
-			tpf = ((time.time() - start_time) / float(i + 1))
-			etr = tpf * (dataset.shape[0] - i + 1)
-			print("tiff {0:d} / {1:d}, Time/File {3:.2f}s ETR: {2:.1f}s".format(i, dataset.shape[0], etr, tpf))
 
+	with snomtools.data.profiling.span("import scan steps", report=verbose) as importspan:
+		for i, scanstep in zip(list(range(len(scanfiles))), iter(sorted(scanfiles.keys()))):
+			islice = (i,) + slicebase
+			# Import tiff:
+			with snomtools.data.profiling.span("read tiff", file=scanfiles[scanstep]):
+				if detector == "dld":
+					idata = peem_dld_read_terra(os.path.join(folderpath, scanfiles[scanstep]))
+				else:
+					idata = peem_camera_read_terra(os.path.join(folderpath, scanfiles[scanstep]))
+			# Check data consistency:
+			assert idata.shape == sample_data.shape, "Trying to combine scan data with different shape."
+			for ax1, ax2 in zip(idata.axes, sample_data.axes):
+				assert ax1.units == ax2.units, "Trying to combine scan data with different axis dimensionality."
+			assert idata.get_datafield(0).units == sample_data.get_datafield(0).units, \
+				"Trying to combine scan data with different data dimensionality."
+			# Write data:
+			with snomtools.data.profiling.span("write scan step"):
+				dataarray[islice] = idata.get_datafield(0).data
+			if verbose:
+				tpf = importspan.elapsed / float(i + 1)
+				etr = tpf * (dataset.shape[0] - i + 1)
+				print("tiff {0:d} / {1:d}, Time/File {3:.2f}s ETR: {2:.1f}s".format(i, dataset.shape[0], etr, tpf))
+	if buffered:
+		dataarray.data.buffer_writes(None)
+
+	return dataset
+
+
+def _measurement_folder_index(folderpath, scanfiles, detector, sample_data, axlist, h5target):
+	"""
+	The index-only mode of :func:`measurement_folder_peem_terra`: Generates a DataSet whose data references the
+	pixel data in the tiffs as HDF5 external storage, without copying it.
+
+	:return: The DataSet.
+	:rtype: DataSet
+	"""
+	assert h5target, "Index-only import requires h5 mode."
+	sample_field = sample_data.get_datafield(0)
+	label, plotlabel = sample_field.get_label(), sample_field.get_plotlabel()
+	skip_pages = 2 if detector == "dld" else 0  # Sum and error image of DLD data.
+
+	dataset = snomtools.data.datasets.DataSet("Terra Scan " + folderpath, h5target=h5target)
+	if dataset.h5target is True:  # Temp h5 mode
+		grp = h5tools.Tempfile()
+	else:  # Proper h5 file mode
+		grp = dataset.datafieldgrp.require_group(label)
+	h5tools.clear_name(grp, "tiffs")
+	tiffgrp = grp.create_group("tiffs")
+	layout, dtype = None, None
+	for i, scanstep in enumerate(sorted(scanfiles.keys())):
+		filepath = os.path.join(folderpath, scanfiles[scanstep])
+		with snomtools.data.profiling.span("index tiff", file=scanfiles[scanstep]):
+			shape, filetype, segments = tiff_data_segments(filepath, skip_pages)
+		assert shape == sample_data.shape, "Trying to combine scan data with different shape."
+		if layout is None:
+			dtype = filetype
+			layout = h5py.VirtualLayout(shape=(len(scanfiles),) + shape, dtype=dtype)
+		assert filetype == dtype, "Trying to combine scan data with different data types."
+		external = [(filepath, offset, size) for offset, size in segments]
+		tiffdata = tiffgrp.create_dataset("{0:d}".format(i), shape=shape, dtype=dtype, external=external)
+		# Sources in the same file are referenced as ".", so the HDF5 file can be moved:
+		layout[i] = h5py.VirtualSource(".", tiffdata.name, shape=shape, dtype=dtype)
+		if verbose:
+			print("tiff {0:d} / {1:d} indexed in {2:d} segments".format(i, len(scanfiles), len(segments)))
+	h5tools.clear_name(grp, "data")
+	ds_data = grp.create_virtual_dataset("data", layout, fillvalue=0)
+	ds_data.attrs["virtual_chunks"] = (1,) + sample_data.shape  # Read tiff by tiff.
+	h5tools.write_dataset(grp, "unit", sample_field.get_unit())
+	h5tools.write_dataset(grp, "label", label)
+	h5tools.write_dataset(grp, "plotlabel", plotlabel)
+	dataarray = snomtools.data.datasets.DataArray(None, label=label, plotlabel=plotlabel,
+												  h5target=(True if dataset.h5target is True else grp))
+	dataarray._data = snomtools.data.datasets.Data_Handler_H5.readonly_view(grp, h5target=dataarray.h5target)
+	dataset.datafields.append(dataarray)
+	for ax in axlist:
+		dataset.add_axis(ax)
+	dataset.check_data_consistency()
 	return dataset
 
 
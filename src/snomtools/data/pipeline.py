@@ -0,0 +1,419 @@
+"""
+This file provides a pipeline executor for chains of transformations on DataSets, like the standard evaluation chain
+of flatfield normalization, drift correction, energy calibration and projection. Instead of running each step on the
+whole data and writing a full intermediate copy, the chain is run in one streaming pass over blocks of the data:
+Each block is read once (together with the halo its steps need from the neighbouring blocks), pushed through all
+steps and written only to the outputs that were requested. Independent blocks are processed in parallel threads, so
+the memory used is bounded by a few blocks per thread.
+
+Steps are subclasses of :class:`Step`. They declare how they change the axes and the unit of the data
+(:func:`Step.setup`), which halo of neighbouring data they need along each axis (:func:`Step.halo`) and along which
+axes they need the full extent of the data in each block (:func:`Step.full_axes`). Reducing steps like
+:class:`ProjectionStep` don't change the data stream, but tap it at their position in the chain.
+
+Example for the standard chain, with steps defined in the evaluation modules::
+
+	p = Pipeline("measurement.hdf5")
+	p.add(snomtools.evaluation.microscopy.FlatfieldStep(flatfield))
+	p.add(snomtools.evaluation.driftcorrection.DriftStep(drift))
+	p.add(snomtools.evaluation.peem_dld.EnergyCalibrationStep("kalfit.txt"))
+	p.add(ProjectionStep('energy'))
+	results = p.run(outputs=('driftcorrected', 'projection'),
+					h5target={'driftcorrected': "corrected.hdf5", 'projection': None})
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+import numpy
+from six import string_types
+from snomtools.data import datasets
+from snomtools.data import h5tools
+from snomtools.data import profiling
+from snomtools.data import tools
+
+__author__ = 'Michael Hartelt'
+
+if '-v' in sys.argv:
+	verbose = True
+else:
+	verbose = False
+
+
+class Step(object):
+	"""
+	The base class for a step of a :class:`Pipeline`. It passes the data unchanged. Subclasses overwrite the methods
+	they need.
+	"""
+	#: If True, the step reduces the data instead of transforming it, see :class:`ProjectionStep`.
+	reduces = False
+
+	def __init__(self, name="step"):
+		"""
+		:param str name: The name of the step, used to request its result as an output of the pipeline.
+		"""
+		self.name = name
+
+	def setup(self, axes, unit, label, plotlabel):
+		"""
+		Prepares the step for the data it gets. This is called once before the pipeline is run.
+
+		:param list axes: The Axis instances of the incoming data.
+
+		:param str unit: The unit of the incoming data.
+
+		:param str label: The label of the incoming data.
+
+		:param str plotlabel: The plotlabel of the incoming data.
+
+		:return: The axes, unit, label and plotlabel of the outgoing data.
+		:rtype: tuple
+		"""
+		return axes, unit, label, plotlabel
+
+	def halo(self, shape):
+		"""
+		The number of elements of the neighbouring data needed along each axis to calculate a block correctly.
+
+		:param tuple shape: The shape of the data.
+
+		:return: The halo for each axis.
+		:rtype: tuple(int)
+		"""
+		return (0,) * len(shape)
+
+	def full_axes(self):
+		"""
+		The indices of the axes along which the step needs the full extent of the data in each block.
+
+		:rtype: tuple(int)
+		"""
+		return ()
+
+	def apply(self, data, selection):
+		"""
+		Calculates the step for a block of data.
+
+		:param numpy.ndarray data: The data of the block, including the halo (cut at the borders of the data).
+
+		:param tuple selection: The position of the data in the full data, as a tuple of slices.
+
+		:return: The transformed data, of the same shape as :code:`data`.
+		:rtype: numpy.ndarray
+		"""
+		return data
+
+
+class FunctionStep(Step):
+	"""
+	A step applying a function to the data of the blocks, e.g. an elementwise calculation.
+	"""
+
+	def __init__(self, function, name="function", unit=None, label=None, plotlabel=None, halo=None):
+		"""
+		:param function: A callable taking a numpy array of a block and returning the transformed array of the same
+			shape.
+
+		:param str name: The name of the step.
+
+		:param str unit: The unit of the outgoing data. Default: The unit of the incoming data.
+
+		:param str label: The label of the outgoing data. Default: The label of the incoming data.
+
+		:param str plotlabel: The plotlabel of the outgoing data. Default: The plotlabel of the incoming data.
+
+		:param halo: The halo the function needs along each axis, see :func:`Step.halo`. Default: No halo.
+		:type halo: tuple(int)
+		"""
+		Step.__init__(self, name)
+		self.function = function
+		self.unit = unit
+		self.label = label
+		self.plotlabel = plotlabel
+		self._halo = halo
+
+	def setup(self, axes, unit, label, plotlabel):
+		return axes, self.unit or unit, self.label or label, self.plotlabel or plotlabel
+
+	def halo(self, shape):
+		if self._halo is None:
+			return (0,) * len(shape)
+		assert len(self._halo) == len(shape), "Halo doesn't fit dimensions of data."
+		return tuple(self._halo)
+
+	def apply(self, data, selection):
+		return self.function(data)
+
+
+class ProjectionStep(Step):
+	"""
+	A step projecting the data onto some of its axes by summing over all the others, like
+	:func:`snomtools.data.transformation.project.project_nd`. The sum is accumulated over all blocks, so the
+	projection never needs the full data.
+	"""
+	reduces = True
+
+	def __init__(self, *axes, **kwargs):
+		"""
+		:param axes: Identifiers (labels or indices) of the axes to project onto.
+
+		:param str name: Keyword argument: The name of the step. Default: "projection"
+		"""
+		Step.__init__(self, kwargs.pop('name', "projection"))
+		assert not kwargs, "Invalid keyword argument(s) {0}".format(list(kwargs))
+		self.axes_ids = axes
+		self.sumaxes = None
+
+	def setup(self, axes, unit, label, plotlabel):
+		keep = [axis_index(axes, axis_id) for axis_id in self.axes_ids]
+		self.sumaxes = tuple(i for i in range(len(axes)) if i not in keep)
+		return [ax for i, ax in enumerate(axes) if i not in self.sumaxes], unit, label, plotlabel
+
+	def apply(self, data, selection):
+		"""
+		:return: The sum of the block over the axes not projected onto.
+		:rtype: numpy.ndarray
+		"""
+		return data.sum(axis=self.sumaxes)
+
+	def output_selection(self, selection):
+		"""
+		The position of the result of :func:`apply` in the full projection.
+
+		:param tuple selection: The position of the block in the full data, as a tuple of slices.
+
+		:rtype: tuple(slice)
+		"""
+		return tuple(s for i, s in enumerate(selection) if i not in self.sumaxes)
+
+
+class Pipeline(object):
+	"""
+	A chain of :class:`Step`s on a DataArray of a DataSet, run in one streaming pass over blocks of the data.
+	"""
+
+	def __init__(self, source, data_id=0):
+		"""
+		:param source: The DataSet to process, or the path of a HDF5 file containing it.
+		:type source: snomtools.data.datasets.DataSet *or* str
+
+		:param data_id: An identifier of the DataArray in the DataSet to process. Default: The first one.
+		"""
+		if isinstance(source, string_types):
+			source = datasets.DataSet.from_h5file(source, readonly=True)
+		assert isinstance(source, datasets.DataSet), "No DataSet given as source of pipeline."
+		self.source = source
+		self.data_id = data_id
+		self.steps = []
+
+	def add(self, step):
+		"""
+		Appends a step to the chain.
+
+		:param Step step: The step. Its name must be unique in the pipeline.
+
+		:return: The step.
+		:rtype: Step
+		"""
+		assert isinstance(step, Step), "Pipeline steps must be Step instances."
+		assert step.name not in self.names, "Step name {0} is already used in pipeline.".format(step.name)
+		self.steps.append(step)
+		return step
+
+	@property
+	def names(self):
+		return [step.name for step in self.steps]
+
+	@profiling.profiled("Pipeline.run")
+	def run(self, outputs=None, h5target=True, blockshape=None, threads=None, dtype=None):
+		"""
+		Runs the pipeline. Only the steps needed for the requested outputs are calculated, and only their results
+		are written.
+
+		:param outputs: The names of the steps whose results are returned. Default: The last step.
+		:type outputs: str *or* sequence of str
+
+		:param h5target: The h5target for the resulting DataSets: A path of a HDF5 file to write to, True for a
+			temp file or None for numpy mode. To give different targets for several outputs, give a dict with the
+			names of the outputs as keys. Results of reducing steps are small and therefore kept in numpy mode if
+			not requested otherwise.
+
+		:param tuple blockshape: The shape of the blocks in which the data is processed. Default: The chunks of the
+			source data. Steps requiring full axes enlarge the blocks accordingly.
+
+		:param int threads: The number of threads processing blocks in parallel. Default: The number of CPUs.
+
+		:param dtype: The data type in which the data is calculated and written. Default: The data type of the
+			source, but at least float32.
+
+		:return: The resulting DataSets, in the order of outputs. A single DataSet if a single output name was
+			given.
+		:rtype: list(snomtools.data.datasets.DataSet) *or* snomtools.data.datasets.DataSet
+		"""
+		single_output = outputs is None or isinstance(outputs, string_types)
+		if outputs is None:
+			assert self.steps, "Pipeline without steps has no output."
+			outputs = [self.steps[-1].name]
+		elif isinstance(outputs, string_types):
+			outputs = [outputs]
+		for name in outputs:
+			assert name in self.names, "Unknown pipeline step {0}".format(name)
+		active = self.steps[:max(self.names.index(name) for name in outputs) + 1]
+
+		sourceda = self.source.get_datafield(self.data_id)
+		if isinstance(sourceda.data, datasets.Data_Handler_H5):
+			source = sourceda.data.ds_data
+		else:
+			source = sourceda.data.magnitude
+		shape = tuple(source.shape)
+		ndim = len(shape)
+		if dtype is None:
+			dtype = numpy.result_type(source.dtype, numpy.float32)
+
+		# Set up steps, halos and blocks:
+		infos = []
+		stream = (list(self.source.axes), str(sourceda.get_unit()), sourceda.get_label(), sourceda.get_plotlabel())
+		halos = []
+		full_axes = set()
+		for step in active:
+			info = step.setup(*stream)
+			infos.append(info)
+			if step.reduces:
+				halos.append((0,) * ndim)
+			else:
+				stream = info
+				halos.append(tuple(step.halo(shape)))
+				full_axes.update(i % ndim for i in step.full_axes())
+		# remaining[i] is the halo still needed after step i, which is the sum of the halos of the later steps:
+		halos = numpy.array(halos, dtype=numpy.int64)
+		tail = numpy.cumsum(halos[::-1], axis=0)[::-1]  # tail[i] is the sum of the halos of step i and later.
+		remaining = tail - halos
+		readhalo = tail[0]
+		if blockshape is None:
+			if isinstance(source, numpy.ndarray) or source.chunks is None:
+				blockshape = h5tools.probe_chunksize(shape)
+			else:
+				blockshape = source.chunks
+		blockshape = tuple(shape[i] if i in full_axes else min(blockshape[i], shape[i]) for i in range(ndim))
+		starts, stops = tools.chunk_grid(shape, blockshape)
+		if verbose:
+			print("Running pipeline on {0} blocks of shape {1} with steps {2}".format(len(starts), blockshape,
+																					 [s.name for s in active]))
+
+		# Prepare outputs:
+		if not isinstance(h5target, dict):
+			assert not (isinstance(h5target, string_types) and len(outputs) > 1), \
+				"A single file given as h5target for several outputs."
+			h5target = dict((name, h5target) for name in outputs)
+		results = {}
+		for name in outputs:
+			i = self.names.index(name)
+			axes, unit, label, plotlabel = infos[i]
+			if active[i].reduces:
+				results[name] = numpy.zeros([len(ax) for ax in axes], dtype=dtype)
+			else:
+				target = h5target.get(name)
+				ds = datasets.DataSet(self.source.label + " " + name, plotconf=self.source.plotconf,
+									  h5target=(target or True))
+				h5grp = ds.datafieldgrp
+				if h5grp is not True:  # Proper h5 file mode
+					h5grp = h5grp.require_group(label)
+				array = datasets.DataArray(None, label=label, plotlabel=plotlabel, h5target=h5grp)
+				array._data = datasets.Data_Handler_H5(unit=unit, shape=shape,
+													   h5target=(None if h5grp is True else h5grp),
+													   chunks=blockshape, dtype=dtype)
+				results[name] = (ds, array)
+
+		# Process blocks:
+		write_lock = threading.Lock()
+
+		def process(block):
+			start, stop = block
+			selection = tuple(slice(a, b) for a, b in zip(start, stop))
+			lo = numpy.maximum(start - readhalo, 0)
+			hi = numpy.minimum(stop + readhalo, shape)
+			data = numpy.asarray(source[tuple(slice(a, b) for a, b in zip(lo, hi))], dtype=dtype)
+			reductions = []
+			for i, step in enumerate(active):
+				inner = tuple(slice(a, b) for a, b in zip(start - lo, stop - lo))
+				if step.reduces:
+					if step.name in results:
+						reductions.append((step, selection, step.apply(data[inner], selection)))
+					continue
+				data = step.apply(data, tuple(slice(a, b) for a, b in zip(lo, hi)))
+				if step.name in results:
+					with write_lock:
+						results[step.name][1]._data.ds_data[selection] = data[inner]
+				# Cut off the halo that is not needed anymore by the following steps:
+				newlo = numpy.maximum(start - remaining[i], 0)
+				newhi = numpy.minimum(stop + remaining[i], shape)
+				data = data[tuple(slice(a, b) for a, b in zip(newlo - lo, newhi - lo))]
+				lo, hi = newlo, newhi
+			return reductions
+
+		pool = ThreadPool(threads)
+		try:
+			for reductions in pool.imap_unordered(process, zip(starts, stops)):
+				for step, selection, partial in reductions:
+					results[step.name][step.output_selection(selection)] += partial
+		finally:
+			pool.close()
+			pool.join()
+
+		# Assemble resulting DataSets:
+		returnlist = []
+		for name in outputs:
+			i = self.names.index(name)
+			axes, unit, label, plotlabel = infos[i]
+			if active[i].reduces:
+				array = datasets.DataArray(results[name], unit=unit, label=label, plotlabel=plotlabel)
+				returnlist.append(datasets.DataSet(self.source.label + " " + name, (array,), axes,
+												   self.source.plotconf, h5target=h5target.get(name)))
+			else:
+				ds, array = results[name]
+				if ds.h5target is not True:  # Proper h5 file mode, so write metadata next to data.
+					array.write_to_h5()
+				ds.datafields = [array]
+				for ax in axes:
+					ds.add_axis(ax)
+				if not h5target.get(name):  # Numpy mode was requested.
+					ds = datasets.DataSet(ds.label, ds.datafields, ds.axes, ds.plotconf)
+				returnlist.append(ds)
+		if single_output:
+			return returnlist[0]
+		return returnlist
+
+
+def axis_index(axes, label_or_index):
+	"""
+	Finds the index of an axis in a list of axes.
+
+	:param list axes: The Axis instances.
+
+	:param label_or_index: The label or index of the axis.
+	:type label_or_index: str *or* int
+
+	:return: The index of the axis.
+	:rtype: int
+	"""
+	if isinstance(label_or_index, string_types):
+		labels = [ax.get_label() for ax in axes]
+		assert label_or_index in labels, "Axis {0} not found.".format(label_or_index)
+		return labels.index(label_or_index)
+	return int(label_or_index) % len(axes)
+
+
+if __name__ == '__main__':
+	testdata = datasets.DataSet("test", [datasets.DataArray(numpy.random.rand(4, 50, 60), 'count', label='counts')],
+								[datasets.Axis(numpy.arange(4), label='delay'),
+								 datasets.Axis(numpy.arange(50), label='y'),
+								 datasets.Axis(numpy.arange(60), label='x')])
+	p = Pipeline(testdata)
+	p.add(FunctionStep(lambda data: data * 2, name="double"))
+	p.add(ProjectionStep('delay'))
+	double, projection = p.run(outputs=('double', 'projection'), h5target=None, blockshape=(1, 16, 16))
+	print(projection.get_datafield(0).get_data())
+	print(numpy.allclose(double.get_datafield(0).get_data(), testdata.get_datafield(0).get_data() * 2))
@@ -0,0 +1,476 @@
+"""
+This file provides performance instrumentation for snomtools: Named stage spans with timing and (optionally) peak
+memory, and counters for HDF5 I/O per file, estimated chunk cache hits, chunks decompressed and temp files created.
+The recorded data can be printed as a summary table or exported as a Chrome trace JSON file, which can be viewed with
+chrome://tracing or https://ui.perfetto.dev.
+
+Instrumentation is disabled by default. It is enabled with :func:`enable`, the :func:`recording` context manager, or
+by giving :code:`--profile` as a command line argument to a script (which prints the summary at exit). While disabled,
+a span costs one function call and counters nothing, because the HDF5 I/O counting is done by wrappers around the
+:code:`h5py.Dataset` access methods, which are installed only while instrumentation is enabled.
+
+Chunk cache hits are estimated with a model of the HDF5 chunk cache (least recently used chunks, with the cache size
+of the file), because the HDF5 library doesn't report them. Chunk cache misses on compressed datasets are counted as
+chunks decompressed. Reads done in read-ahead helper processes are counted when their data is handed over.
+
+Example::
+
+	with profiling.recording(memory=True):
+		with profiling.span("projection"):
+			data.project_nd('energy')
+	print(profiling.summary())
+	profiling.export_chrome_trace("trace.json")
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+import itertools
+import contextlib
+import collections
+import numpy
+import h5py
+
+try:
+	import tracemalloc
+except ImportError:  # Python 2
+	tracemalloc = None
+
+__author__ = 'Michael Hartelt'
+
+# The state of the instrumentation. Read-only, use enable() and disable() to change it.
+enabled = False
+memory_tracing = False
+
+_lock = threading.Lock()
+_local = threading.local()
+_t0 = time.time()
+_spans = []
+_counters = collections.OrderedDict()
+_counter_events = []
+_chunk_caches = {}
+_h5py_originals = {}
+
+
+class _Span(object):
+	"""
+	A span of a named stage, as returned by :func:`span` if instrumentation is enabled or the span is reported.
+	"""
+	__slots__ = ('name', 'start', 'duration', 'peak', 'mem_start', 'thread', 'args', 'record', 'report')
+
+	def __init__(self, name, args, report=False):
+		self.name = name
+		self.args = args
+		self.record = enabled
+		self.report = report
+		self.peak = 0
+		self.mem_start = 0
+		self.duration = None
+
+	def __enter__(self):
+		stack = _span_stack()
+		if memory_tracing:
+			current, peak = tracemalloc.get_traced_memory()
+			if stack:  # The peak so far belongs to the enclosing span.
+				stack[-1].peak = max(stack[-1].peak, peak)
+			tracemalloc.reset_peak()
+			self.mem_start = current
+		stack.append(self)
+		self.thread = threading.current_thread().ident
+		self.start = time.time()
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.duration = time.time() - self.start
+		stack = _span_stack()
+		stack.pop()
+		if memory_tracing:
+			self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+			if stack:
+				stack[-1].peak = max(stack[-1].peak, self.peak)
+			tracemalloc.reset_peak()
+		if self.record:
+			with _lock:
+				_spans.append(self)
+				_counter_events.append((self.start + self.duration, _counter_totals()))
+		if self.report:
+			print("{0} done in {1:.2f} s".format(self.name, self.duration))
+		return False
+
+	@property
+	def elapsed(self):
+		"""
+		The time since the start of the span in seconds, or its duration if it has ended.
+		"""
+		if self.duration is None:
+			return time.time() - self.start
+		return self.duration
+
+	@property
+	def peak_memory(self):
+		"""
+		The peak memory allocated during the span, relative to the memory allocated at its start, in bytes. 0 if
+		memory tracing is disabled.
+		"""
+		return max(self.peak - self.mem_start, 0)
+
+
+class _NullSpan(object):
+	"""
+	The span returned by :func:`span` if instrumentation is disabled. Does nothing.
+	"""
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		return False
+
+
+_null_span = _NullSpan()
+
+
+def _span_stack():
+	try:
+		return _local.stack
+	except AttributeError:
+		_local.stack = []
+		return _local.stack
+
+
+def span(name, report=False, **args):
+	"""
+	A context manager recording a named stage.
+
+	:param str name: The name of the stage. Spans of the same name are aggregated in the summary.
+
+	:param bool report: Print the duration of the stage when it ends, also if instrumentation is disabled. Used for
+		the verbose output of the snomtools functions, e.g. :code:`span("...", report=verbose)`. A reported span
+		also provides the time since its start as :code:`elapsed`, e.g. to estimate the remaining time of a loop.
+
+	:param args: Additional information to store with the span, shown in the trace.
+
+	:return: The span context manager.
+	"""
+	if not (enabled or report):
+		return _null_span
+	return _Span(name, args, report)
+
+
+def profiled(name=None):
+	"""
+	A decorator recording each call of a function as a span.
+
+	:param str name: The name of the span. Default: The qualified name of the function.
+	"""
+
+	def decorator(func):
+		spanname = name or getattr(func, '__qualname__', func.__name__)
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return func(*args, **kwargs)
+			with _Span(spanname, {}):
+				return func(*args, **kwargs)
+
+		return wrapper
+
+	return decorator
+
+
+def count(name, value=1, key=None):
+	"""
+	Adds to a counter.
+
+	:param str name: The name of the counter.
+
+	:param value: The value to add.
+
+	:param key: An additional key, e.g. the file the counter refers to.
+	"""
+	if not enabled:
+		return
+	with _lock:
+		_counters[(name, key)] = _counters.get((name, key), 0) + value
+
+
+def counter(name, key=None):
+	"""
+	The value of a counter.
+
+	:param str name: The name of the counter.
+
+	:param key: The additional key. If :code:`all`, the sum over all keys is returned.
+
+	:return: The value.
+	"""
+	if key is all:
+		return sum(value for (cname, ckey), value in _counters.items() if cname == name)
+	return _counters.get((name, key), 0)
+
+
+def _counter_totals():
+	totals = collections.OrderedDict()
+	for (name, key), value in _counters.items():
+		totals[name] = totals.get(name, 0) + value
+	return totals
+
+
+def enable(memory=False):
+	"""
+	Enables instrumentation.
+
+	:param bool memory: Also trace the peak memory of the spans with :mod:`tracemalloc`. This slows down allocations.
+	"""
+	global enabled, memory_tracing
+	enabled = True
+	if memory:
+		assert tracemalloc is not None and hasattr(tracemalloc, 'reset_peak'), \
+			"Memory tracing requires Python 3.9 or newer."
+		if not tracemalloc.is_tracing():
+			tracemalloc.start()
+		memory_tracing = True
+	_install_h5py_hooks()
+
+
+def disable():
+	"""
+	Disables instrumentation. The recorded data is kept.
+	"""
+	global enabled, memory_tracing
+	enabled = False
+	if memory_tracing:
+		tracemalloc.stop()
+		memory_tracing = False
+	_remove_h5py_hooks()
+
+
+def reset():
+	"""
+	Deletes all recorded data.
+	"""
+	global _t0
+	with _lock:
+		del _spans[:]
+		del _counter_events[:]
+		_counters.clear()
+		_chunk_caches.clear()
+		_t0 = time.time()
+
+
+@contextlib.contextmanager
+def recording(memory=False, reset_data=True):
+	"""
+	A context manager enabling instrumentation inside its block.
+
+	:param bool memory: Also trace peak memory, see :func:`enable`.
+
+	:param bool reset_data: Delete previously recorded data first.
+	"""
+	was_enabled = enabled
+	if reset_data:
+		reset()
+	enable(memory)
+	try:
+		yield
+	finally:
+		if not was_enabled:
+			disable()
+
+
+def summary():
+	"""
+	Generates a summary table of the recorded spans and counters.
+
+	:return: The table.
+	:rtype: str
+	"""
+	with _lock:
+		spans = list(_spans)
+		counters = list(_counters.items())
+	stats = collections.OrderedDict()
+	for s in sorted(spans, key=lambda s: s.start):
+		calls, total, longest, peak = stats.get(s.name, (0, 0., 0., 0))
+		stats[s.name] = (calls + 1, total + s.duration, max(longest, s.duration), max(peak, s.peak_memory))
+	lines = ["{0:<40} {1:>8} {2:>12} {3:>12} {4:>12} {5:>14}".format("Span", "Calls", "Total / s", "Mean / s",
+																	  "Max / s", "Peak mem / MB")]
+	for name, (calls, total, longest, peak) in stats.items():
+		lines.append("{0:<40} {1:>8d} {2:>12.4f} {3:>12.4f} {4:>12.4f} {5:>14.1f}".format(
+			name[:40], calls, total, total / calls, longest, peak / 1024 ** 2))
+	lines.append("")
+	lines.append("{0:<40} {1:<40} {2:>16}".format("Counter", "Key", "Value"))
+	for (name, key), value in counters:
+		if key is not None and len(str(key)) > 40:
+			key = "..." + str(key)[-37:]
+		lines.append("{0:<40} {1:<40} {2:>16}".format(name[:40], "" if key is None else str(key), value))
+	return "\n".join(lines)
+
+
+def export_chrome_trace(path):
+	"""
+	Writes the recorded spans and counters to a JSON file in the Chrome trace event format.
+
+	:param str path: The path of the file to write.
+	"""
+	pid = os.getpid()
+	with _lock:
+		events = [{"name": s.name, "ph": "X", "ts": (s.start - _t0) * 1e6, "dur": s.duration * 1e6, "pid": pid,
+				   "tid": s.thread, "args": dict(s.args, peak_memory=s.peak_memory)} for s in _spans]
+		for timestamp, totals in _counter_events:
+			events.extend({"name": name, "ph": "C", "ts": (timestamp - _t0) * 1e6, "pid": pid,
+						   "args": {"value": value}} for name, value in totals.items())
+	with open(path, 'w') as f:
+		json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+# HDF5 I/O counting:
+
+def _selection_chunks(selection, shape, chunks):
+	"""
+	The ranges of chunk indices along each axis touched by a selection of a chunked dataset.
+	Selections that are not slices or integers are assumed to touch all chunks along their axis.
+	"""
+	if selection is None or selection is Ellipsis:
+		selection = ()
+	elif not isinstance(selection, tuple):
+		selection = (selection,)
+	if Ellipsis in [s for s in selection if not isinstance(s, numpy.ndarray)]:
+		i = [s is Ellipsis for s in selection].index(True)
+		selection = selection[:i] + (slice(None),) * (len(shape) - len(selection) + 1) + selection[i + 1:]
+	selection = selection + (slice(None),) * (len(shape) - len(selection))
+	ranges = []
+	for s, n, c in zip(selection, shape, chunks):
+		if isinstance(s, slice):
+			start, stop, step = s.indices(n)
+			if step < 0:
+				start, stop = stop + 1, start + 1
+			ranges.append(range(start // c, (stop - 1) // c + 1) if stop > start else range(0))
+		elif isinstance(s, (int, numpy.integer)):
+			ranges.append(range((s % n) // c, (s % n) // c + 1))
+		else:
+			ranges.append(range(-(-n // c)))
+	return ranges
+
+
+def _count_chunks(dataset, selection, write=False):
+	"""
+	Counts the chunk cache hits and misses of an access to a chunked dataset with a LRU model of the chunk cache.
+	"""
+	chunks = dataset.chunks
+	if chunks is None:
+		return
+	try:
+		ranges = _selection_chunks(selection, dataset.shape, chunks)
+	except (TypeError, ValueError):
+		return
+	filename = dataset.file.filename
+	key = (filename, dataset.name)
+	with _lock:
+		if key not in _chunk_caches:
+			cache_bytes = dataset.file.id.get_access_plist().get_cache()[2]
+			chunk_bytes = int(numpy.prod(chunks)) * dataset.dtype.itemsize
+			_chunk_caches[key] = (collections.OrderedDict(), cache_bytes // chunk_bytes)
+		cache, capacity = _chunk_caches[key]
+		hits = misses = 0
+		for index in itertools.product(*ranges):
+			if index in cache:
+				cache.move_to_end(index)
+				hits += 1
+			else:
+				misses += 1
+				if capacity:
+					cache[index] = True
+					if len(cache) > capacity:
+						cache.popitem(last=False)
+	if write:
+		return
+	count("h5 chunk cache hits", hits, filename)
+	count("h5 chunk cache misses", misses, filename)
+	if dataset.compression is not None:
+		count("h5 chunks decompressed", misses, filename)
+
+
+def count_h5_read(dataset, selection, nbytes):
+	"""
+	Counts a read of a HDF5 dataset. This is done automatically for reads in this process while instrumentation is
+	enabled, and only needs to be called for reads done elsewhere, like in read-ahead helper processes.
+
+	:param h5py.Dataset dataset: The dataset.
+
+	:param selection: The selection that was read.
+
+	:param int nbytes: The number of bytes read.
+	"""
+	if not enabled:
+		return
+	count("h5 bytes read", int(nbytes), dataset.file.filename)
+	_count_chunks(dataset, selection)
+
+
+def count_h5_write(dataset, selection, nbytes):
+	"""
+	Counts a write to a HDF5 dataset, see :func:`count_h5_read`.
+	"""
+	if not enabled:
+		return
+	count("h5 bytes written", int(nbytes), dataset.file.filename)
+	_count_chunks(dataset, selection, write=True)
+
+
+def _selection_nbytes(dataset, selection):
+	try:
+		return int(numpy.prod(numpy.empty(dataset.shape, dtype=[])[selection].shape)) * dataset.dtype.itemsize
+	except Exception:
+		return 0
+
+
+def _install_h5py_hooks():
+	if _h5py_originals:
+		return
+	original_getitem = h5py.Dataset.__getitem__
+	original_setitem = h5py.Dataset.__setitem__
+	original_read_direct = h5py.Dataset.read_direct
+	original_write_direct = h5py.Dataset.write_direct
+
+	def __getitem__(self, args, *more):
+		data = original_getitem(self, args, *more)
+		count_h5_read(self, args, getattr(data, 'nbytes', 0))
+		return data
+
+	def __setitem__(self, args, val):
+		original_setitem(self, args, val)
+		count_h5_write(self, args, _selection_nbytes(self, args))
+
+	def read_direct(self, dest, source_sel=None, dest_sel=None):
+		original_read_direct(self, dest, source_sel, dest_sel)
+		count_h5_read(self, source_sel, _selection_nbytes(self, () if source_sel is None else source_sel))
+
+	def write_direct(self, source, source_sel=None, dest_sel=None):
+		original_write_direct(self, source, source_sel, dest_sel)
+		count_h5_write(self, dest_sel, _selection_nbytes(self, () if dest_sel is None else dest_sel))
+
+	_h5py_originals.update(__getitem__=original_getitem, __setitem__=original_setitem,
+						   read_direct=original_read_direct, write_direct=original_write_direct)
+	h5py.Dataset.__getitem__ = __getitem__
+	h5py.Dataset.__setitem__ = __setitem__
+	h5py.Dataset.read_direct = read_direct
+	h5py.Dataset.write_direct = write_direct
+
+
+def _remove_h5py_hooks():
+	for name, method in _h5py_originals.items():
+		setattr(h5py.Dataset, name, method)
+	_h5py_originals.clear()
+
+
+if '--profile' in sys.argv:
+	enable()
+	atexit.register(lambda: print(summary()))
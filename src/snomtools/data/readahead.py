@@ -0,0 +1,192 @@
+"""
+This file provides read-ahead for block-wise iteration over HDF5 datasets. While the current block is processed, the
+next blocks are read and decompressed in a helper process and handed over through shared memory, so reading and
+computing overlap instead of alternating. Read-ahead is opt-in: It is used by the iterators of Data_Handler_H5 and the
+loops that use them if a read-ahead depth is given there, or if the module default :code:`readahead_default` is set to
+a number of blocks larger than 0.
+For the helper process, the source file is flushed and opened a second time in read-only mode without file locking,
+so the source data must not be modified while iterating over it. The helper process is spawned, which takes a moment,
+so read-ahead pays off for long loops over big data. Like for all multiprocessing with spawned processes, scripts
+using it must guard their main code with :code:`if __name__ == "__main__":`. Where shared memory is not available
+(python < 3.8), a helper thread is used instead.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+import threading
+import multiprocessing
+import numpy
+import h5py
+from six.moves import queue
+from snomtools.data import h5tools
+from snomtools.data import profiling
+from snomtools.data.tools import sliced_shape
+
+try:
+	from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+	shared_memory = None
+
+__author__ = 'Michael Hartelt'
+
+if '-v' in sys.argv:
+	verbose = True
+else:
+	verbose = False
+
+# The default number of blocks to read ahead, if not specified in the call. 0 means no read-ahead.
+readahead_default = 0
+
+
+def iterblocks(source, selections, depth=None, method="process"):
+	"""
+	Iterator, which yields the data of a source for a sequence of selections, reading up to :code:`depth` blocks
+	ahead in the background.
+
+	.. warning::
+		With read-ahead, the yielded arrays are views on reused buffers, so they are overwritten in later iteration
+		steps. Copy them if they are needed for longer.
+
+	:param source: The data to read. If this is not a h5py Dataset (e.g. a numpy array), it is just indexed.
+	:type source: h5py.Dataset
+
+	:param selections: The selections (typically tuples of slices) of the blocks to read, in the order of iteration.
+
+	:param int depth: The number of blocks to read ahead. 0 disables read-ahead, None takes
+		:code:`readahead_default`.
+
+	:param str method: :code:`"process"` (default) for a helper process handing over the data in shared memory,
+		:code:`"thread"` for a helper thread.
+
+	:return: The data of the current block.
+	:rtype: numpy.ndarray
+	"""
+	if depth is None:
+		depth = readahead_default
+	selections = list(selections)
+	if not depth or len(selections) < 2 or not isinstance(source, h5py.Dataset):
+		for selection in selections:
+			yield source[selection]
+		return
+	if method == "process" and shared_memory is not None:
+		blocks = _iterblocks_process(source, selections, depth)
+	else:
+		blocks = _iterblocks_thread(source, selections, depth)
+	for data in blocks:
+		yield data
+
+
+def _iterblocks_thread(source, selections, depth):
+	"""
+	Read-ahead with a helper thread and a bounded queue. See :func:`iterblocks`.
+	"""
+	blockqueue = queue.Queue(maxsize=depth)
+	stop = threading.Event()
+
+	def put(item):
+		# Wait for a free place in the queue, but give up if the iteration was stopped, so the thread can't hang:
+		while not stop.is_set():
+			try:
+				blockqueue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def reader():
+		try:
+			for selection in selections:
+				if not put(source[selection]):
+					return
+		except Exception as e:
+			put(e)
+
+	thread = threading.Thread(target=reader, name="snomtools read-ahead")
+	thread.daemon = True
+	thread.start()
+	try:
+		for i in range(len(selections)):
+			data = blockqueue.get()
+			if isinstance(data, Exception):
+				raise data
+			yield data
+	finally:
+		stop.set()
+		thread.join()
+
+
+def _iterblocks_process(source, selections, depth):
+	"""
+	Read-ahead with a helper process handing over the data in shared memory slots. See :func:`iterblocks`.
+	"""
+	source.file.flush()  # Make everything written so far visible to the helper process.
+	shapes = [sliced_shape(selection, source.shape) for selection in selections]
+	blocksize = max(int(numpy.prod(shape, dtype=numpy.int64)) for shape in shapes) * source.dtype.itemsize
+	slots = [shared_memory.SharedMemory(create=True, size=max(blocksize, 1)) for i in range(depth)]
+	# The helper process must not inherit the HDF5 library state with open files, so it is spawned, not forked:
+	context = multiprocessing.get_context("spawn")
+	free_slots = context.Queue()
+	ready_slots = context.Queue()
+	for i in range(depth):
+		free_slots.put(i)
+	worker = context.Process(target=_readahead_worker,
+							 args=(source.file.filename, source.name, selections, shapes, source.dtype,
+								   [slot.name for slot in slots], free_slots, ready_slots),
+							 name="snomtools read-ahead")
+	worker.daemon = True
+	worker.start()
+	data = None
+	try:
+		for selection, shape in zip(selections, shapes):
+			while True:
+				try:
+					message = ready_slots.get(timeout=1.)
+					break
+				except queue.Empty:
+					if not worker.is_alive():
+						raise IOError("Read-ahead process died unexpectedly.")
+			if isinstance(message, str):
+				raise IOError("Read-ahead process failed: " + message)
+			data = numpy.ndarray(shape, dtype=source.dtype, buffer=slots[message].buf)
+			profiling.count_h5_read(source, selection, data.nbytes)
+			yield data
+			free_slots.put(message)
+		worker.join()
+	finally:
+		if worker.is_alive():
+			worker.terminate()
+			worker.join()
+		del data
+		for slot in slots:
+			try:
+				slot.close()
+			except BufferError:  # A yielded array is still referenced outside. Memory is freed with it.
+				pass
+			slot.unlink()
+
+
+def _readahead_worker(filename, dsname, selections, shapes, dtype, slotnames, free_slots, ready_slots):
+	"""
+	The helper process for read-ahead: Reads the blocks into free shared memory slots and reports the slots as ready.
+	"""
+	slots = [shared_memory.SharedMemory(name=name) for name in slotnames]
+	try:
+		h5file = h5tools.File(filename, 'r', locking=False)
+		try:
+			dataset = h5file[dsname]
+			for selection, shape in zip(selections, shapes):
+				slot = free_slots.get()
+				buffer = numpy.ndarray(shape, dtype=dtype, buffer=slots[slot].buf)
+				if buffer.size:
+					dataset.read_direct(buffer, selection)
+				del buffer
+				ready_slots.put(slot)
+		finally:
+			h5file.close()
+	except Exception as e:
+		ready_slots.put(repr(e))
+	finally:
+		for slot in slots:
+			slot.close()
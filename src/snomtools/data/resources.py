@@ -0,0 +1,305 @@
+"""
+This file provides a harness that tracks the resources used by snomtools operations: The peak resident memory (RSS)
+of the process, the disk space used by HDF5 temp files (:class:`snomtools.data.h5tools.Tempfile`) and the number of
+full-array materializations, which happen when the whole data of a :class:`snomtools.data.datasets.Data_Handler_H5`
+is loaded into RAM (e.g. by accessing its :code:`magnitude`). For temp files and materializations, the call stacks
+where they happened are recorded, so the culprit of an unexpected memory or disk use can be found.
+
+The harness is used as a context manager. Optionally, budgets can be declared, which are checked when the block
+is left, so it can serve as a pass/fail guard, e.g. in :mod:`snomtools.benchmarks.suite`::
+
+	with ResourceMonitor(rss=512 * 1024 ** 2, materializations=0) as monitor:
+		data.project_nd('energy')
+	print(monitor.report())
+
+While no monitor is active, the hooks in the monitored code cost a single check of a list.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+import os
+import threading
+import traceback
+import psutil
+
+__author__ = 'Michael Hartelt'
+
+if '-v' in sys.argv:
+	verbose = True
+else:
+	verbose = False
+
+# The active monitors. Used by the hooks to check quickly if anything needs to be recorded.
+monitors = []
+_lock = threading.Lock()
+
+
+class BudgetExceeded(AssertionError):
+	"""
+	Raised by :class:`ResourceMonitor` if an operation used more resources than declared in its budgets.
+	"""
+	pass
+
+
+class ResourceMonitor(object):
+	"""
+	A context manager tracking peak RSS, temp file disk usage and full-array materializations inside its block.
+	"""
+
+	def __init__(self, rss=None, temp_bytes=None, materializations=None, materialization_threshold=1024 ** 2,
+				 interval=0.01, stack_depth=8, raise_on_violation=True, reset_peak=False):
+		"""
+		:param int rss: The budget for the increase of the peak RSS over the RSS at the start, in bytes.
+
+		:param int temp_bytes: The budget for the peak disk usage of temp files created inside the block, in bytes.
+
+		:param int materializations: The budget for the number of full-array materializations.
+
+		:param int materialization_threshold: The size in bytes from which on materializations are recorded. Smaller
+			ones, like of the small handlers created while iterating over chunks, are ignored.
+
+		:param float interval: The interval in seconds in which RSS and temp file sizes are sampled.
+
+		:param int stack_depth: The number of stack frames recorded for each temp file and materialization.
+
+		:param bool raise_on_violation: Raise :class:`BudgetExceeded` when leaving the block if a budget is exceeded.
+			Otherwise, the violations are only available in :attr:`violations`.
+
+		:param bool reset_peak: Reset the peak RSS recorded by the kernel (VmHWM on Linux) when entering the block,
+			so short peaks between two samples are caught even if they stay below an earlier peak of the process.
+			This resets the peak for the whole process, so other code reading it (e.g. :code:`getrusage` or an
+			enclosing monitor) is affected. By default, the kernel peak is only used if it rose inside the block.
+		"""
+		self.budgets = {"rss": rss, "temp_bytes": temp_bytes, "materializations": materializations}
+		self.interval = interval
+		self.stack_depth = stack_depth
+		self.materialization_threshold = materialization_threshold
+		self.raise_on_violation = raise_on_violation
+		self.reset_peak = reset_peak
+		self.process = psutil.Process()
+		self.rss_start = 0
+		self.rss_peak = 0
+		self._kernel_peak_start = 0
+		self.tempfiles = []  # Entries: [path, peak size, stack]
+		self.materialization_events = []  # Entries: (shape, nbytes, stack)
+		self.violations = []
+		self._stop = threading.Event()
+		self._sampler = None
+
+	def __enter__(self):
+		self.rss_start = self.process.memory_info().rss
+		self.rss_peak = self.rss_start
+		if self.reset_peak:
+			_reset_peak_rss()
+		self._kernel_peak_start = _read_peak_rss()
+		self._stop.clear()
+		self._sampler = threading.Thread(target=self._sample_loop, name="snomtools resource monitor")
+		self._sampler.daemon = True
+		with _lock:
+			monitors.append(self)
+		self._sampler.start()
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self._stop.set()
+		self._sampler.join()
+		self._sample()
+		kernel_peak = _read_peak_rss()
+		if kernel_peak > self._kernel_peak_start:  # A new peak of the process was reached inside the block.
+			self.rss_peak = max(self.rss_peak, kernel_peak)
+		with _lock:
+			monitors.remove(self)
+		self.violations = self.check()
+		if self.violations and self.raise_on_violation and exc_type is None:
+			raise BudgetExceeded("Resource budget exceeded: " + "; ".join(self.violations) + "\n" + self.report())
+		return False
+
+	def _sample_loop(self):
+		while not self._stop.wait(self.interval):
+			self._sample()
+
+	def _sample(self):
+		try:
+			self.rss_peak = max(self.rss_peak, self.process.memory_info().rss)
+		except psutil.Error:
+			pass
+		with _lock:
+			for entry in self.tempfiles:
+				entry[1] = max(entry[1], _filesize(entry[0]))
+
+	def _tempfile_created(self, path, stack):
+		with _lock:
+			self.tempfiles.append([path, 0, stack])
+
+	def _tempfile_closing(self, path):
+		size = _filesize(path)
+		with _lock:
+			for entry in self.tempfiles:
+				if entry[0] == path:
+					entry[1] = max(entry[1], size)
+
+	def _materialized(self, shape, nbytes, stack):
+		with _lock:
+			self.materialization_events.append((shape, nbytes, stack))
+
+	@property
+	def rss_increase(self):
+		"""
+		The increase of the peak RSS over the RSS at the start of the block, in bytes.
+		"""
+		return max(self.rss_peak - self.rss_start, 0)
+
+	@property
+	def temp_bytes(self):
+		"""
+		The sum of the peak sizes of all temp files created inside the block, in bytes.
+		"""
+		return sum(entry[1] for entry in self.tempfiles)
+
+	@property
+	def materializations(self):
+		"""
+		The number of full-array materializations inside the block, at least as large as the threshold.
+		"""
+		return len(self.materialization_events)
+
+	def usage(self):
+		"""
+		The recorded resource usage, in the units of the budgets.
+
+		:rtype: dict
+		"""
+		return {"rss": self.rss_increase, "rss_peak": self.rss_peak, "temp_bytes": self.temp_bytes,
+				"tempfiles": len(self.tempfiles), "materializations": self.materializations,
+				"materialized_bytes": sum(event[1] for event in self.materialization_events)}
+
+	def check(self):
+		"""
+		Checks the recorded usage against the budgets.
+
+		:return: A description of each exceeded budget.
+		:rtype: list(str)
+		"""
+		usage = self.usage()
+		violations = []
+		for key, budget in self.budgets.items():
+			if budget is not None and usage[key] > budget:
+				violations.append("{0} = {1} exceeds budget {2}".format(key, usage[key], budget))
+		return violations
+
+	def report(self):
+		"""
+		Generates a report of the recorded usage, with the call stacks of temp file creations and materializations.
+		Events with identical call stacks are reported once, with their number and total size.
+
+		:rtype: str
+		"""
+		lines = ["Peak RSS increase: {0:.1f} MB (peak {1:.1f} MB)".format(self.rss_increase / 1024 ** 2,
+																		 self.rss_peak / 1024 ** 2),
+				 "Temp files: {0:d} using {1:.1f} MB".format(len(self.tempfiles), self.temp_bytes / 1024 ** 2),
+				 "Full-array materializations: {0:d}".format(self.materializations)]
+		for stack, (number, size) in _by_stack((entry[2], entry[1]) for entry in self.tempfiles):
+			lines.append("  {0:d} temp file(s) of {1:.1f} MB in total created at:".format(number, size / 1024 ** 2))
+			lines.extend("    " + line for line in stack)
+		for stack, (number, nbytes) in _by_stack((event[2], event[1]) for event in self.materialization_events):
+			lines.append("  {0:d} materialization(s) of {1:.1f} MB in total at:".format(number, nbytes / 1024 ** 2))
+			lines.extend("    " + line for line in stack)
+		return "\n".join(lines)
+
+
+def _stack(depth):
+	"""
+	The current call stack outside this module, formatted as short lines.
+	"""
+	frames = traceback.extract_stack()[:-2][-depth:]
+	return ["{0}:{1} in {2}".format(os.path.basename(frame[0]), frame[1], frame[2]) for frame in frames]
+
+
+def _by_stack(events):
+	"""
+	Groups events by their call stack, keeping the order of first occurrence.
+
+	:param events: Tuples of (stack, size).
+
+	:return: Tuples of (stack, (number of events, total size)).
+	:rtype: list(tuple)
+	"""
+	groups = {}
+	order = []
+	for stack, size in events:
+		key = tuple(stack)
+		if key not in groups:
+			groups[key] = [0, 0]
+			order.append(key)
+		groups[key][0] += 1
+		groups[key][1] += size
+	return [(key, tuple(groups[key])) for key in order]
+
+
+def _filesize(path):
+	try:
+		return os.path.getsize(path)
+	except OSError:
+		return 0
+
+
+def _reset_peak_rss():
+	"""
+	Resets the peak RSS recorded by the kernel for the whole process, if possible (Linux).
+	"""
+	try:
+		with open("/proc/self/clear_refs", 'w') as f:
+			f.write("5")
+	except (IOError, OSError):
+		pass
+
+
+def _read_peak_rss():
+	"""
+	The peak RSS recorded by the kernel since the last reset, if available (Linux). Otherwise 0.
+	"""
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					return int(line.split()[1]) * 1024
+	except (IOError, OSError, ValueError):
+		pass
+	return 0
+
+
+# Hooks, called by the monitored code if monitors are active:
+
+def tempfile_created(path):
+	"""
+	Records the creation of a temp file at all active monitors.
+
+	:param str path: The path of the temp file.
+	"""
+	for monitor in list(monitors):
+		monitor._tempfile_created(path, _stack(monitor.stack_depth))
+
+
+def tempfile_closing(path):
+	"""
+	Records the final size of a temp file before it is removed, at all active monitors.
+
+	:param str path: The path of the temp file.
+	"""
+	for monitor in list(monitors):
+		monitor._tempfile_closing(path)
+
+
+def materialized(shape, nbytes):
+	"""
+	Records a full-array materialization at all active monitors.
+
+	:param tuple shape: The shape of the materialized data.
+
+	:param int nbytes: The size of the materialized data in bytes.
+	"""
+	for monitor in list(monitors):
+		if nbytes >= monitor.materialization_threshold:
+			monitor._materialized(shape, nbytes, _stack(monitor.stack_depth))
@@ -8,6 +8,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 from six import string_types
+import itertools
 import numpy as np
 from numpy.lib.stride_tricks import as_strided
 
@@ -196,6 +197,52 @@ def find_next_prime(N):
 	raise AssertionError("Failed to find a prime number between {0} and {1}...".format(N, 2 * N))
 
 
+_chunk_grid_cache = {}
+
+
+def chunk_grid(shape, chunks, dims=None):
+	"""
+	The grid of chunks of an array, as arrays of start and stop indices for each chunk. The chunks are ordered with
+	the first dimension iterating fastest. Results are cached, so the grid for a given shape and chunking is computed
+	only once.
+
+	:param tuple shape: The shape of the array.
+
+	:param tuple chunks: The chunk shape of the array.
+
+	:param dims: Divide the array chunk-wise only for the dimensions in dims. The full range is taken for all others.
+		Default: All dimensions.
+	:type dims: sequence of ints
+
+	:return: Two int arrays of shape (number of chunks, dimensions), holding the start and stop indices. They are
+		read-only, because they are shared by all callers.
+	:rtype: tuple(numpy.ndarray)
+	"""
+	if dims is None:
+		dims = range(len(shape))
+	key = (tuple(shape), tuple(chunks), tuple(sorted(dims)))
+	try:
+		return _chunk_grid_cache[key]
+	except KeyError:
+		pass
+	blocksizes = [chunks[d] if d in key[2] else max(shape[d], 1) for d in range(len(shape))]
+	startlists = [range(0, n, b) for n, b in zip(shape, blocksizes)]
+	if startlists:
+		# itertools.product iterates the last list fastest, so reverse twice to iterate the first dimension fastest:
+		starts = np.array(list(itertools.product(*startlists[::-1])), dtype=np.int64).reshape(
+			(-1, len(shape)))[:, ::-1]
+	else:
+		starts = np.zeros((1, 0), dtype=np.int64)
+	starts = np.ascontiguousarray(starts)
+	stops = np.minimum(starts + np.array(blocksizes, dtype=np.int64), np.array(shape, dtype=np.int64))
+	starts.flags.writeable = False
+	stops.flags.writeable = False
+	if len(_chunk_grid_cache) > 64:
+		_chunk_grid_cache.clear()
+	_chunk_grid_cache[key] = (starts, stops)
+	return starts, stops
+
+
 def dummy_array(shape_):
 	"""
 	Dummy array of a given shape, meaning an array that needs virtually no memory, by just referencing every element of
@@ -251,3 +298,205 @@ def broadcast_indices(*shapes):
 			yield in_ixs + (out_ix,)
 
 	return broadcast_shape_iterator()
+
+
+def textfile_blocks(path, comments='#', delimiter=None, decimal='.', usecols=None, skiprows=0, dtype=float,
+					blocklines=65536, commentlines=None):
+	"""
+	Reads a text file containing columns of numbers in a single pass, yielding the data in blocks of lines. This way,
+	files larger than memory can be processed block-wise. The numbers of each block are parsed at once with
+	:func:`numpy.fromstring`, which is much faster than :func:`numpy.loadtxt` for large files.
+
+	:param str path: The path of the text file.
+
+	:param str comments: The character(s) used to indicate the start of a comment. Comment lines are collected in
+		*commentlines*, trailing comments in data lines are ignored.
+
+	:param str delimiter: The string used to separate values. By default, this is any whitespace.
+
+	:param str decimal: The character used as decimal mark, e.g. :code:`','` for files written in german locale.
+
+	:param usecols: Which columns to read, with 0 being the first. Default: All columns.
+	:type usecols: int *or* sequence of ints
+
+	:param int skiprows: Skip the first *skiprows* lines, including comments.
+
+	:param dtype: The data type of the returned arrays.
+
+	:param int blocklines: The (maximum) number of data lines per block.
+
+	:param list commentlines: If a list is given, the comment lines are appended to it, stripped from the comment
+		character(s) and surrounding whitespace. Comment lines are collected wherever they are in the file, each when
+		the block containing it is read. So the comments before the first data line (the header) are available when
+		the first block is yielded.
+
+	:return: A generator yielding 2D arrays of shape (lines, columns) for each block.
+	:rtype: generator(numpy.ndarray)
+
+	:raises ValueError: If a line has a different number of columns than the first data line or contains invalid
+		values, like :func:`numpy.loadtxt`.
+	"""
+	assert delimiter != decimal, "Delimiter and decimal mark must be different."
+	if usecols is not None:
+		usecols = list(iterfy(usecols))
+	ncols = None
+	with open(path, 'r') as textfile:
+		for i in range(skiprows):
+			textfile.readline()
+		while True:
+			lines = list(itertools.islice(textfile, blocklines))
+			if not lines:
+				break
+			text = "".join(lines)
+			if comments and comments in text:  # Sort out comment lines and trailing comments.
+				datalines = []
+				for line in lines:
+					if line.lstrip().startswith(comments):
+						if commentlines is not None:
+							commentlines.append(line.strip().strip(comments).strip())
+					else:
+						datalines.append(line.split(comments, 1)[0].rstrip() + "\n")
+				lines = datalines
+				text = "".join(lines)
+			if ncols is None:
+				ncols = _textblock_columns(lines, delimiter)
+				if ncols is None:  # No data yet.
+					continue
+			fieldcounts = _textblock_fieldcounts(text, delimiter)
+			ragged = np.flatnonzero((fieldcounts != ncols) & (fieldcounts != 0))
+			if ragged.size:
+				raise ValueError("Wrong number of columns in text file {0}: Expected {1:d}, found {2:d} in line "
+								 "{3!r}.".format(path, ncols, fieldcounts[ragged[0]], lines[ragged[0]]))
+			values = _parse_textblock(text, delimiter, decimal)
+			if values.size != len(lines) * ncols:  # Maybe there are empty lines, else the data is invalid.
+				if values.size != len([line for line in lines if line.strip()]) * ncols:
+					raise ValueError("Wrong number of columns or invalid values in text file {0}.".format(path))
+			values = values.reshape((-1, ncols))
+			if usecols is not None:
+				values = values[:, usecols]
+			yield values.astype(dtype, copy=False)
+	if ncols is None:
+		raise ValueError("No data found in text file {0}.".format(path))
+
+
+def _textblock_columns(lines, delimiter):
+	"""
+	Returns the number of columns in the first non-empty line of a list of data lines.
+	"""
+	for line in lines:
+		if line.strip():
+			return len(line.split(delimiter))
+	return None
+
+
+def _textblock_fieldcounts(text, delimiter):
+	"""
+	Returns the number of fields in each line of a text block, 0 for empty lines. For whitespace or single character
+	delimiters, this works on the bytes of the whole block at once.
+	"""
+	if not text.endswith("\n"):
+		text += "\n"
+	if delimiter is not None and len(delimiter.encode('utf-8')) != 1:
+		return np.array([len(line.split(delimiter)) if line.strip() else 0 for line in text.split("\n")[:-1]])
+	chars = np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+	lineends = np.flatnonzero(chars == ord("\n"))
+	space = chars <= ord(" ")  # Whitespace and other control characters.
+	if delimiter is None:  # Count the starts of fields.
+		marks = ~space
+		marks[1:] &= space[:-1]
+	else:
+		marks = chars == ord(delimiter)
+	counts = np.diff(np.searchsorted(np.flatnonzero(marks), lineends), prepend=0)
+	if delimiter is not None:  # n delimiters separate n+1 fields in non-empty lines.
+		nonempty = np.diff(np.searchsorted(np.flatnonzero(~space), lineends), prepend=0) > 0
+		counts = np.where(nonempty, counts + 1, 0)
+	return counts
+
+
+def _parse_textblock(text, delimiter, decimal):
+	"""
+	Parses the numbers in a text block into a 1D array. See :func:`textfile_blocks`.
+	"""
+	if decimal != '.':
+		text = text.replace(decimal, '.')
+	if delimiter is not None:
+		text = text.replace(delimiter, ' ')
+	return np.fromstring(text, dtype=np.float64, sep=' ')
+
+
+def read_textfile(path, **kwargs):
+	"""
+	Reads a text file containing columns of numbers in a single pass, like :func:`numpy.loadtxt`, and collects the
+	comment lines at the same time.
+
+	:param str path: The path of the text file.
+
+	:param kwargs: Keyword arguments for :func:`textfile_blocks`.
+
+	:return: A 2D array of shape (lines, columns) and the list of comment lines.
+	:rtype: tuple(numpy.ndarray, list(str))
+	"""
+	commentlines = []
+	blocks = list(textfile_blocks(path, commentlines=commentlines, **kwargs))
+	return np.concatenate(blocks), commentlines
+
+
+def block_histogram(data, edges, uniform=True, axis=None):
+	"""
+	Calculates the histogram of a block of data with given bin edges, using :func:`numpy.bincount`. All bins but the
+	last are half-open, the last one includes the right edge, as in :func:`numpy.histogram`. Values outside the bins
+	and NaN are ignored. The histograms of several blocks of the same data can just be added up.
+
+	:param numpy.ndarray data: The data.
+
+	:param numpy.ndarray edges: The bin edges, monotonically increasing.
+
+	:param bool uniform: Set this if the bins are of equal width, to calculate the bin indices arithmetically instead
+		of searching them in the edges, which is faster.
+
+	:param int axis: If given, a histogram is calculated for each index along this axis.
+
+	:return: The counts, of shape :code:`(number of bins,)`, or :code:`(data.shape[axis], number of bins)` if an axis
+		is given.
+	:rtype: numpy.ndarray
+	"""
+	nbins = len(edges) - 1
+	data = np.asarray(data)
+	if uniform:
+		indices = np.floor((data - edges[0]) * (nbins / float(edges[-1] - edges[0])))
+	else:
+		indices = np.searchsorted(edges, data, side='right') - 1
+	indices[data == edges[-1]] = nbins - 1  # Right edge belongs to the last bin.
+	with np.errstate(invalid='ignore'):  # NaN is never valid.
+		valid = (indices >= 0) & (indices < nbins)
+	if axis is None:
+		return np.bincount(indices[valid].astype(np.intp), minlength=nbins)
+	positions = np.arange(data.shape[axis]).reshape([-1 if d == axis else 1 for d in range(data.ndim)])
+	indices = indices + positions * nbins
+	counts = np.bincount(indices[valid].astype(np.intp), minlength=data.shape[axis] * nbins)
+	return counts.reshape((data.shape[axis], nbins))
+
+
+def histogram_quantile(counts, edges, q):
+	"""
+	Estimates quantiles of data from its histogram, by linear interpolation of the cumulative histogram within the
+	bins. The precision is therefore limited by the bin width.
+
+	:param numpy.ndarray counts: The counts of the histogram.
+
+	:param numpy.ndarray edges: The bin edges of the histogram.
+
+	:param q: The quantile(s) to compute, between 0 and 1. E.g. :code:`(0.01, 0.99)` for the 1st and 99th
+		percentile.
+	:type q: float *or* sequence of floats
+
+	:return: The estimated value(s) of the quantile(s).
+	:rtype: float *or* numpy.ndarray
+	"""
+	counts = np.asarray(counts, dtype=np.float64)
+	edges = np.asarray(edges, dtype=np.float64)
+	q = np.asarray(q, dtype=np.float64)
+	assert np.all((q >= 0) & (q <= 1)), "Quantiles must be between 0 and 1."
+	cumulative = np.concatenate(([0.], np.cumsum(counts)))
+	assert cumulative[-1] > 0, "Empty histogram."
+	return np.interp(q * cumulative[-1], cumulative, edges)
@@ -63,16 +63,8 @@ def project_1d(data, axis_id=0, data_id=None, outlabel=None, normalization=None)
 			if normalization == "None":
 				normdat = sumdat
 				pl = "projected " + df.get_plotlabel()
-			elif normalization in ["maximum", "max"]:
-				normdat = sumdat / sumdat.max()
-			elif normalization in ["minimum", "min"]:
-				normdat = sumdat / sumdat.min()
-			elif normalization in ["mean"]:
-				normdat = sumdat / sumdat.mean()
-			elif normalization in ["absolute maximum", "absmax"]:
-				normdat = sumdat / abs(sumdat).max()
-			elif normalization in ["absolute minimum", "absmin"]:
-				normdat = sumdat / abs(sumdat).min()
+			elif normalization in datasets.normalization_methods:
+				normdat = sumdat / datasets.normalization_factor(sumdat, normalization)
 			elif normalization in ["size"]:
 				number_of_pixels = 1
 				for ax_id in sumtup:
@@ -155,16 +147,8 @@ def project_2d(data, axis1_id=0, axis2_id=0, data_id=None, outlabel=None, normal
 			if normalization == "None":
 				normdat = sumdat
 				pl = "projected " + df.get_plotlabel()
-			elif normalization in ["maximum", "max"]:
-				normdat = sumdat / sumdat.max()
-			elif normalization in ["minimum", "min"]:
-				normdat = sumdat / sumdat.min()
-			elif normalization in ["mean"]:
-				normdat = sumdat / sumdat.mean()
-			elif normalization in ["absolute maximum", "absmax"]:
-				normdat = sumdat / abs(sumdat).max()
-			elif normalization in ["absolute minimum", "absmin"]:
-				normdat = sumdat / abs(sumdat).min()
+			elif normalization in datasets.normalization_methods:
+				normdat = sumdat / datasets.normalization_factor(sumdat, normalization)
 			elif normalization in ["size"]:
 				number_of_pixels = 1
 				for ax_id in sumtup:
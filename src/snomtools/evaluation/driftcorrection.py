@@ -9,8 +9,12 @@ from __future__ import print_function
 import sys
 import cv2 as cv
 import numpy as np
+import scipy.ndimage
 import snomtools.data.datasets
 import snomtools.data.h5tools
+import snomtools.data.pipeline
+import snomtools.data.profiling
+import snomtools.data.readahead
 from snomtools.data.tools import iterfy, full_slice, sliced_shape
 
 __author__ = 'Benjamin Frisch'
@@ -184,8 +188,20 @@ class Drift(object):
 		else:  # We shifted several slices, so we have to stack them together again.
 			return shifted_slice_list[0].__class__.stack(shifted_slice_list)
 
-	def corrected_data(self, h5target=None):
-		"""Return the full driftcorrected dataset."""
+	@snomtools.data.profiling.profiled()
+	def corrected_data(self, h5target=None, readahead=None):
+		"""
+		Return the full driftcorrected dataset.
+
+		:param h5target: The HDF5 target to write the data to. If True, a temp file is used. If not given, the data is
+			kept in numpy mode.
+
+		:param int readahead: The number of blocks of the source data to read ahead in the background while
+			correcting, see :func:`snomtools.data.readahead.iterblocks`. Default: The module default.
+
+		:return: The driftcorrected DataSet.
+		:rtype: snomtools.data.datasets.DataSet
+		"""
 
 		oldda = self.data.get_datafield(0)
 		if h5target:
@@ -198,39 +214,42 @@ class Drift(object):
 			# Initialize data handler to write to:
 			dh = snomtools.data.datasets.Data_Handler_H5(unit=str(self.data.datafields[0].units), shape=self.data.shape,
 														 chunk_cache_mem_size=use_cache_size)
+			# The slices written are smaller than the chunks, so combine them to write each chunk once:
+			dh.buffer_writes(use_cache_size)
 
 			# Calculate driftcorrected data and write it to dh:
 			if verbose:
-				import time
-				start_time = time.time()
-				print(str(start_time))
 				print("Calculating {0} driftcorrected slices...".format(self.data.shape[self.dstackAxisID]))
 			# Get full slice for all the data:
 			full_selection = full_slice(np.s_[:], len(self.data.shape))
 			slicebase_wo_stackaxis = np.delete(full_selection, self.dstackAxisID)
-			# Iterate over all elements along dstackAxis:
-			for i in range(self.data.shape[self.dstackAxisID]):
-				# Generate full slice of data to shift, by inserting i into slicebase:
-				subset_slice = tuple(np.insert(slicebase_wo_stackaxis, self.dstackAxisID, i))
-				# Get shiftvector for the stack element i:
-				shift = self.generate_shiftvector(i)
-				if verbose:
-					step_starttime = time.time()
-				# Get the shifted data from the Data_Handler method:
-				shifted_data = self.data.get_datafield(0).data.shift_slice(subset_slice, shift,
-																		   order=self.interpolation_order)
-				if verbose:
-					print('interpolation done in {0:.2f} s'.format(time.time() - step_starttime))
-					step_starttime = time.time()
-				# Write shifted data to corresponding place in dh:
-				dh[subset_slice] = shifted_data
-				if verbose:
-					print('data written in {0:.2f} s'.format(time.time() - step_starttime))
-					tpf = ((time.time() - start_time) / float(i + 1))
-					etr = tpf * (self.data.shape[self.dstackAxisID] - i + 1)
-					print("Slice {0:d} / {1:d}, Time/slice {3:.2f}s ETR: {2:.1f}s".format(i, self.data.shape[
-						self.dstackAxisID], etr, tpf))
-
+			# Generate full slices of data to shift, by inserting the indices along dstackAxis into slicebase:
+			subset_slices = [tuple(np.insert(slicebase_wo_stackaxis, self.dstackAxisID, i))
+							 for i in range(self.data.shape[self.dstackAxisID])]
+			if isinstance(oldda.data, snomtools.data.datasets.Data_Handler_H5):
+				source = oldda.data.ds_data
+			else:
+				source = oldda.data.magnitude
+			with snomtools.data.profiling.span("Drift correct slices", report=verbose) as correctspan:
+				# Iterate over all elements along dstackAxis:
+				for i, (subset_slice, subset_data) in enumerate(
+						zip(subset_slices, snomtools.data.readahead.iterblocks(source, subset_slices, readahead))):
+					# Get shiftvector for the stack element i:
+					shift = self.generate_shiftvector(i)
+					# Get the shifted data. The shift along the stack axis is always 0, so the slice alone suffices:
+					with snomtools.data.profiling.span("Drift shift slice", report=verbose):
+						shifted_data = snomtools.data.datasets.Data_Handler_np(subset_data, oldda.get_unit()).shift(
+							np.delete(shift, self.dstackAxisID), order=self.interpolation_order)
+					# Write shifted data to corresponding place in dh:
+					with snomtools.data.profiling.span("Drift write slice", report=verbose):
+						dh[subset_slice] = shifted_data
+					if verbose:
+						tpf = correctspan.elapsed / float(i + 1)
+						etr = tpf * (self.data.shape[self.dstackAxisID] - i + 1)
+						print("Slice {0:d} / {1:d}, Time/slice {3:.2f}s ETR: {2:.1f}s".format(i, self.data.shape[
+							self.dstackAxisID], etr, tpf))
+
+			dh.buffer_writes(None)
 			# Initialize DataArray with data from dh:
 			newda = snomtools.data.datasets.DataArray(dh, label=oldda.label, plotlabel=oldda.plotlabel,
 													  h5target=dh.h5target)
@@ -263,22 +282,20 @@ class Drift(object):
 		driftlist = []
 
 		if verbose:
-			import time
-			start_time = time.time()
-			print(str(start_time))
 			print("Calculating {0} driftvectors...".format(data.shape[stackAxisID]))
 
-		for i in range(data.shape[stackAxisID]):
-			slicebase = [np.s_[:], np.s_[:]]
-			slicebase.insert(stackAxisID, i)
-			slice_ = tuple(slicebase)
-			driftlist.append(cls.template_matching((data.data[slice_]), template, method, subpixel))
+		with snomtools.data.profiling.span("Drift template matching", report=verbose) as matchspan:
+			for i in range(data.shape[stackAxisID]):
+				slicebase = [np.s_[:], np.s_[:]]
+				slicebase.insert(stackAxisID, i)
+				slice_ = tuple(slicebase)
+				driftlist.append(cls.template_matching((data.data[slice_]), template, method, subpixel))
 
-			if verbose:
-				tpf = ((time.time() - start_time) / float(i + 1))
-				etr = tpf * (data.shape[stackAxisID] - i + 1)
-				print("vector {0:d} / {1:d}, Time/slice {3:.2f}s ETR: {2:.1f}s".format(i, data.shape[stackAxisID], etr,
-																					   tpf))
+				if verbose:
+					tpf = matchspan.elapsed / float(i + 1)
+					etr = tpf * (data.shape[stackAxisID] - i + 1)
+					print("vector {0:d} / {1:d}, Time/slice {3:.2f}s ETR: {2:.1f}s".format(i, data.shape[stackAxisID],
+																						   etr, tpf))
 
 		indexList = cls.findindex(threshold[0], threshold[1], [result[1] for result in driftlist])
 		driftlist_corrected = cls.cleanList(indexList, [xydata[0] for xydata in driftlist])
@@ -446,6 +463,76 @@ class Drift(object):
 		return inputlist
 
 
+class DriftStep(snomtools.data.pipeline.Step):
+	"""
+	A :class:`snomtools.data.pipeline.Pipeline` step correcting the drift of the images along a stack axis, as in
+	:func:`Drift.corrected_data`. The step needs a halo of the largest shift along the image axes (plus the
+	interpolation order), so neighbouring blocks can be shifted into a block.
+
+	.. note::
+		For interpolation orders > 1, the spline prefilter of :func:`scipy.ndimage.shift` takes into account the whole
+		data it gets, so an additional margin of :code:`prefilter_margin` elements is used and the results are
+		approximately, not exactly, those of the shift of the whole images.
+	"""
+
+	def __init__(self, drift, stackAxisID='delay', yAxisID='y', xAxisID='x', interpolation_order=None,
+				 name="driftcorrected", prefilter_margin=8):
+		"""
+		:param Drift drift: The Drift instance containing the drift vectors.
+
+		:param stackAxisID: The identifier of the axis along which the drift vectors are given.
+
+		:param yAxisID: The identifier of the first axis of the image, i.e. y
+
+		:param xAxisID: The identifier of the second axis of the image, i.e. x
+
+		:param int interpolation_order: The order of the interpolation. Default: The one of the Drift instance.
+
+		:param str name: The name of the step.
+
+		:param int prefilter_margin: The additional halo used for interpolation orders > 1.
+		"""
+		snomtools.data.pipeline.Step.__init__(self, name)
+		assert drift.drift is not None, "Drift instance without drift vectors given."
+		self.drift = drift
+		self.axes_ids = (stackAxisID, yAxisID, xAxisID)
+		if interpolation_order is None:
+			self.interpolation_order = drift.interpolation_order
+		else:
+			self.interpolation_order = interpolation_order
+		self.prefilter_margin = prefilter_margin
+		self.shifts = None
+
+	def setup(self, axes, unit, label, plotlabel):
+		self.stackAxisID, self.yAxisID, self.xAxisID = [snomtools.data.pipeline.axis_index(axes, axis_id)
+														 for axis_id in self.axes_ids]
+		assert len(self.drift.drift) == len(axes[self.stackAxisID]), \
+			"Number of driftvectors unequal to stack dimension of data"
+		# The shift vectors for all stack elements, with the negated relative drift on the image axes:
+		self.shifts = np.zeros((len(self.drift.drift), len(axes)))
+		self.shifts[:, [self.yAxisID, self.xAxisID]] = -np.array(list(self.drift.drift_relative), dtype=float)
+		return axes, unit, label, plotlabel
+
+	def halo(self, shape):
+		halo = np.ceil(abs(self.shifts).max(axis=0)).astype(int) + self.interpolation_order
+		if self.interpolation_order > 1:
+			halo += self.prefilter_margin
+		halo[self.stackAxisID] = 0
+		return tuple(halo)
+
+	def apply(self, data, selection):
+		result = np.empty(data.shape, dtype=np.result_type(data.dtype, np.float32))
+		for i in range(data.shape[self.stackAxisID]):
+			index = [np.s_[:]] * data.ndim
+			index[self.stackAxisID] = i
+			index = tuple(index)
+			stack_index = selection[self.stackAxisID].start + i
+			scipy.ndimage.shift(data[index], np.delete(self.shifts[stack_index], self.stackAxisID), result[index],
+								order=self.interpolation_order, mode='constant', cval=np.nan,
+								prefilter=self.interpolation_order > 0)
+		return result
+
+
 class Terra_maxmap(object):
 	def __init__(self, data=None, precalculated_map=None, energyAxisID=None, yAxisID=None, xAxisID=None,
 				 subpixel=True, method=None, interpolation_order=None, use_meandrift=True, binning=None):
@@ -522,8 +609,20 @@ class Terra_maxmap(object):
 		np.put(arr, [self.deAxisID], -drift / self.binning)
 		return arr
 
-	def corrected_data(self, h5target=None):
-		"""Return the full driftcorrected dataset."""
+	@snomtools.data.profiling.profiled()
+	def corrected_data(self, h5target=None, readahead=None):
+		"""
+		Return the full driftcorrected dataset.
+
+		:param h5target: The HDF5 target to write the data to. If True, a temp file is used. If not given, the data is
+			kept in numpy mode.
+
+		:param int readahead: The number of blocks of the source data to read ahead in the background while
+			correcting, see :func:`snomtools.data.readahead.iterblocks`. Default: The module default.
+
+		:return: The driftcorrected DataSet.
+		:rtype: snomtools.data.datasets.DataSet
+		"""
 
 		oldda = self.data.get_datafield(0)
 		assert isinstance(oldda, snomtools.data.datasets.DataArray)
@@ -537,12 +636,11 @@ class Terra_maxmap(object):
 			# Initialize data handler to write to:
 			dh = snomtools.data.datasets.Data_Handler_H5(unit=str(self.data.datafields[0].units), shape=self.data.shape,
 														 chunk_cache_mem_size=use_cache_size)
+			# The slices written are smaller than the chunks, so combine them to write each chunk once:
+			dh.buffer_writes(use_cache_size)
 
 			# Calculate driftcorrected data and write it to dh:
 			if verbose:
-				import time
-				start_time = time.time()
-				print(time.ctime())
 				xychunks = self.data.shape[self.dxAxisID] * self.data.shape[self.dyAxisID] // oldda.data.chunks[
 					self.dyAxisID] // oldda.data.chunks[self.dxAxisID]
 				chunks_done = 0
@@ -560,83 +658,87 @@ class Terra_maxmap(object):
 				datasize.pop(dimension)
 			cache_array = np.empty(shape=tuple(datasize), dtype=np.float32)
 
-			for chunkslice in oldda.data.iterchunkslices(dims=(self.dyAxisID, self.dxAxisID)):
-				if verbose:
-					step_starttime = time.time()
-
-				bigger_cache_array = np.empty(shape=sliced_shape(chunkslice, oldda.shape), dtype=np.float32)
-				oldda_chunk = snomtools.data.datasets.Data_Handler_np(oldda.data.ds_data[chunkslice],oldda.get_unit())
-
-				yslice = chunkslice[self.dyAxisID]
-				assert isinstance(yslice, slice)
-				if yslice.stop is None:
-					upper_lim = oldda.shape[self.dyAxisID]
-				else:
-					upper_lim = yslice.stop
-
-				for i in range(yslice.start, upper_lim):
-					# Iterate over all elements along dyAxis, therefore inserting i as iterator to slicebase:
-					intermediate_slice = np.insert(slicebase_wo_yaxis, self.dyAxisID, i)
-					intermediate_slice_relative = np.insert(slicebase_wo_yaxis, self.dyAxisID, i - yslice.start)
-					# Delete x Axis
-					slicebase_wo_xyaxis = np.delete(intermediate_slice, self.dxAxisID)
-					slicebase_wo_xyaxis_relative = np.delete(intermediate_slice_relative, self.dxAxisID)
-
-					xslice = chunkslice[self.dxAxisID]
-					assert isinstance(xslice, slice)
-					if xslice.stop is None:
-						upper_lim = oldda.shape[self.dxAxisID]
-					else:
-						upper_lim = xslice.stop
-					# Iterate over all elements along dxAxis, therefore inserting j as iterator to slicebase:
-					for j in range(xslice.start, upper_lim):
-						# Iterate over all elements along dxAxis:
-						subset_slice = tuple(np.insert(slicebase_wo_xyaxis, self.dxAxisID, j))
-						subset_slice_relative = tuple(
-							np.insert(slicebase_wo_xyaxis_relative, self.dxAxisID, j - xslice.start))
-						# Get shiftvector for the stack element at y,x coordinates i,j:
-						shift = self.generate_shiftvector((i, j))
-
-						if self.subpixel:
-							# Get the shifted data from the Data_Handler method:
-							oldda_chunk.shift_slice(subset_slice_relative, shift, output=cache_array,
-												   order=self.interpolation_order)
-
-							# Write shifted data to corresponding place in dh:
-							bigger_cache_array[subset_slice_relative] = cache_array
+			chunkslices = list(oldda.data.iterchunkslices(dims=(self.dyAxisID, self.dxAxisID)))
+			with snomtools.data.profiling.span("Drift correct chunks", report=verbose) as correctspan:
+				for chunkslice, chunkdata in zip(chunkslices, snomtools.data.readahead.iterblocks(oldda.data.ds_data,
+																								  chunkslices,
+																								  readahead)):
+					with snomtools.data.profiling.span("Drift shift chunk", report=verbose):
+						bigger_cache_array = np.empty(shape=sliced_shape(chunkslice, oldda.shape), dtype=np.float32)
+						oldda_chunk = snomtools.data.datasets.Data_Handler_np(chunkdata.copy(), oldda.get_unit())
+
+						yslice = chunkslice[self.dyAxisID]
+						assert isinstance(yslice, slice)
+						if yslice.stop is None:
+							upper_lim = oldda.shape[self.dyAxisID]
 						else:
-							shift = np.rint(shift[self.deAxisID]).astype(int)
-							if shift == 0:
-								bigger_cache_array[subset_slice_relative] = oldda_chunk.magnitude[subset_slice_relative]
+							upper_lim = yslice.stop
+
+						for i in range(yslice.start, upper_lim):
+							# Iterate over all elements along dyAxis, therefore inserting i as iterator to slicebase:
+							intermediate_slice = np.insert(slicebase_wo_yaxis, self.dyAxisID, i)
+							intermediate_slice_relative = np.insert(slicebase_wo_yaxis, self.dyAxisID, i - yslice.start)
+							# Delete x Axis
+							slicebase_wo_xyaxis = np.delete(intermediate_slice, self.dxAxisID)
+							slicebase_wo_xyaxis_relative = np.delete(intermediate_slice_relative, self.dxAxisID)
+
+							xslice = chunkslice[self.dxAxisID]
+							assert isinstance(xslice, slice)
+							if xslice.stop is None:
+								upper_lim = oldda.shape[self.dxAxisID]
 							else:
-								oldslice = list(subset_slice_relative)
-								newslice = list(subset_slice_relative)
-								restslice = list(subset_slice_relative)
-								if shift < 0:
-									s = abs(shift)
-									oldslice[self.deAxisID] = np.s_[s:]
-									newslice[self.deAxisID] = np.s_[:-s]
-									restslice[self.deAxisID] = np.s_[-s:]
+								upper_lim = xslice.stop
+							# Iterate over all elements along dxAxis, therefore inserting j as iterator to slicebase:
+							for j in range(xslice.start, upper_lim):
+								# Iterate over all elements along dxAxis:
+								subset_slice = tuple(np.insert(slicebase_wo_xyaxis, self.dxAxisID, j))
+								subset_slice_relative = tuple(
+									np.insert(slicebase_wo_xyaxis_relative, self.dxAxisID, j - xslice.start))
+								# Get shiftvector for the stack element at y,x coordinates i,j:
+								shift = self.generate_shiftvector((i, j))
+
+								if self.subpixel:
+									# Get the shifted data from the Data_Handler method:
+									oldda_chunk.shift_slice(subset_slice_relative, shift, output=cache_array,
+														   order=self.interpolation_order)
+
+									# Write shifted data to corresponding place in dh:
+									bigger_cache_array[subset_slice_relative] = cache_array
 								else:
-									s = abs(shift)
-									oldslice[self.deAxisID] = np.s_[:-s]
-									newslice[self.deAxisID] = np.s_[s:]
-									restslice[self.deAxisID] = np.s_[:s]
-								for dimension in xy_indexes:
-									newslice.pop(dimension)
-									restslice.pop(dimension)
-								cache_array[tuple(restslice)] = np.nan
-								cache_array[tuple(newslice)] = oldda_chunk.magnitude[tuple(oldslice)]
-								bigger_cache_array[subset_slice_relative] = cache_array
-				dh[chunkslice] = bigger_cache_array
-				if verbose:
-					chunks_done += 1
-					print('data interpolated and written in {0:.2f} s'.format(time.time() - step_starttime))
-					tpf = ((time.time() - start_time) / float(chunks_done))
-					etr = tpf * (xychunks - chunks_done)
-					print("Slice {0:d} / {1:d}, Time/slice {3:.2f}s ETR: {2:.1f}s".format(chunks_done, xychunks, etr,
-																						  tpf))
-
+									shift = np.rint(shift[self.deAxisID]).astype(int)
+									if shift == 0:
+										bigger_cache_array[subset_slice_relative] = \
+											oldda_chunk.magnitude[subset_slice_relative]
+									else:
+										oldslice = list(subset_slice_relative)
+										newslice = list(subset_slice_relative)
+										restslice = list(subset_slice_relative)
+										if shift < 0:
+											s = abs(shift)
+											oldslice[self.deAxisID] = np.s_[s:]
+											newslice[self.deAxisID] = np.s_[:-s]
+											restslice[self.deAxisID] = np.s_[-s:]
+										else:
+											s = abs(shift)
+											oldslice[self.deAxisID] = np.s_[:-s]
+											newslice[self.deAxisID] = np.s_[s:]
+											restslice[self.deAxisID] = np.s_[:s]
+										for dimension in xy_indexes:
+											newslice.pop(dimension)
+											restslice.pop(dimension)
+										cache_array[tuple(restslice)] = np.nan
+										cache_array[tuple(newslice)] = oldda_chunk.magnitude[tuple(oldslice)]
+										bigger_cache_array[subset_slice_relative] = cache_array
+					with snomtools.data.profiling.span("Drift write chunk", report=verbose):
+						dh[chunkslice] = bigger_cache_array
+					if verbose:
+						chunks_done += 1
+						tpf = correctspan.elapsed / float(chunks_done)
+						etr = tpf * (xychunks - chunks_done)
+						print("Slice {0:d} / {1:d}, Time/slice {3:.2f}s ETR: {2:.1f}s".format(chunks_done, xychunks, etr,
+																							  tpf))
+
+			dh.buffer_writes(None)
 			# Initialize DataArray with data from dh:
 			newda = snomtools.data.datasets.DataArray(dh, label=oldda.label, plotlabel=oldda.plotlabel,
 													  h5target=dh.h5target)
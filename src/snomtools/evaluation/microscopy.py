@@ -11,8 +11,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import snomtools.data.datasets
+import snomtools.data.pipeline
 import snomtools.calcs.units as u
 import numpy
+import os.path
 
 __author__ = 'hartelt'
 
@@ -108,3 +110,61 @@ def normalize_by_flatfield_sum(data, flatfield_data, data_id=0, flat_id=0, newla
 	data_normalized[~ numpy.isfinite(data_normalized)] = 0  # set inf, and NaN to 0
 	data.add_datafield(data_normalized, label=newlabel, plotlabel=new_plotlabel)
 	return data
+
+
+class FlatfieldStep(snomtools.data.pipeline.Step):
+	"""
+	A :class:`snomtools.data.pipeline.Pipeline` step normalizing the data by a flatfield, as in
+	:func:`normalize_by_flatfield_sum`: The data is divided by the flatfield image summed over all other axes, and inf
+	and NaN values are set to 0.
+	"""
+
+	def __init__(self, flatfield_data, flat_id=0, axes=("y", "x"), name="flatfield", newlabel='norm_int',
+				 new_plotlabel="Normalized Intensity"):
+		"""
+		:param flatfield_data: The DataSet instance of the flatfield correction to apply or a string with the filepath
+			of the hdf5 file containing the data.
+
+		:param flat_id: A valid identifier of the DataArray in the flatfield DataSet instance to take as reference.
+
+		:param axes: The identifiers of the image axes, which must be present in the flatfield and the data.
+
+		:param str name: The name of the step.
+
+		:param newlabel: The label to set for the normalized data.
+
+		:param new_plotlabel: The plotlabel to set for the normalized data.
+		"""
+		snomtools.data.pipeline.Step.__init__(self, name)
+		if type(flatfield_data) == str:
+			flatfield_data = snomtools.data.datasets.DataSet.from_h5file(os.path.abspath(flatfield_data))
+		assert isinstance(flatfield_data, snomtools.data.datasets.DataSet), "ERROR: No DataSet given or imported."
+		self.axes_ids = axes
+		image_indices = [flatfield_data.get_axis_index(axis_id) for axis_id in axes]
+		sumtup = tuple(i for i in range(flatfield_data.dimensions) if i not in image_indices)
+		flatfield_sumimage = u.to_ureg(flatfield_data.get_datafield(flat_id).sum(sumtup))
+		# Sort the image axes as they are in the flatfield, so they can be matched to the data:
+		self.image_labels = [flatfield_data.get_axis(i).get_label() for i in sorted(image_indices)]
+		self.flatunit = str(flatfield_sumimage.units)
+		self.flatimage = numpy.asarray(flatfield_sumimage.magnitude)
+		self.newlabel = newlabel
+		self.new_plotlabel = new_plotlabel
+		self.image_indices = None
+		self.flatimage_sorted = None
+
+	def setup(self, axes, unit, label, plotlabel):
+		self.image_indices = [snomtools.data.pipeline.axis_index(axes, axis_label) for axis_label in self.image_labels]
+		# Transpose the flatfield image to the order of the axes in the data:
+		self.flatimage_sorted = self.flatimage.transpose(numpy.argsort(self.image_indices))
+		newunit = str((u.to_ureg(1, unit) / u.to_ureg(1, self.flatunit)).units)
+		return axes, newunit, self.newlabel, self.new_plotlabel
+
+	def apply(self, data, selection):
+		image_indices = sorted(self.image_indices)
+		flatblock = self.flatimage_sorted[tuple(selection[i] for i in image_indices)]
+		# Insert length 1 dimensions for all other axes to broadcast the image over them:
+		flatblock = flatblock.reshape([data.shape[i] if i in image_indices else 1 for i in range(data.ndim)])
+		with numpy.errstate(divide='ignore', invalid='ignore'):
+			data_normalized = data / flatblock
+		data_normalized[~ numpy.isfinite(data_normalized)] = 0  # set inf, and NaN to 0
+		return data_normalized
@@ -13,6 +13,7 @@ from __future__ import print_function
 import snomtools.calcs.units as u
 import snomtools.data.datasets
 import snomtools.data.imports.tiff
+import snomtools.data.pipeline
 import snomtools.evaluation.microscopy
 import os.path
 
@@ -203,3 +204,38 @@ def normalize_by_flatfield_sum(data, flatfield_data, data_id=0, flat_id=0, newla
 
 	return snomtools.evaluation.microscopy.normalize_by_flatfield_sum(data, flatfield_data, data_id, flat_id, newlabel,
 																	  new_plotlabel)
+
+
+class EnergyCalibrationStep(snomtools.data.pipeline.Step):
+	"""
+	A :class:`snomtools.data.pipeline.Pipeline` step applying an energy calibration from a kalfit.txt file, as in
+	:func:`energy_apply_calibration`. The channel axis is replaced with an energy axis, while the data is unchanged.
+	"""
+
+	def __init__(self, kalfitfilename, mode='quadratic', axis_id='channel', name="energy"):
+		"""
+		:param kalfitfilename: The filename of the text file from Terra that contains Energy Calibration fit
+			parameters. Usually this file's name ends with "kalfit.txt".
+
+		:param mode: The mode for the energy calculation. Options: 'quadradic' (default) and 'linear'
+
+		:param axis_id: The identifier of the channel axis.
+
+		:param str name: The name of the step.
+		"""
+		snomtools.data.pipeline.Step.__init__(self, name)
+		if mode == 'quadratic':
+			self.params = energy_get_fitparams_quadratic(kalfitfilename)
+			self.scale = energy_scale_quadratic
+		elif mode == 'linear':
+			self.params = energy_get_fitparams_linear(kalfitfilename)
+			self.scale = energy_scale_linear
+		else:
+			raise RuntimeError("Invalid energy calibration mode.")
+		self.axis_id = axis_id
+
+	def setup(self, axes, unit, label, plotlabel):
+		axes = list(axes)
+		index = snomtools.data.pipeline.axis_index(axes, self.axis_id)
+		axes[index] = self.scale(axes[index], *self.params)
+		return axes, unit, label, plotlabel
@@ -0,0 +1,339 @@
+"""
+This file provides the accumulation of repeated runs of a measurement into their sum, mean and variance. Instead of
+loading all runs, stacking them and summing over the stack, the runs are streamed block by block: For each block of
+the data, the corresponding blocks of all runs are read one after another and accumulated with Welford's algorithm.
+Independent blocks are processed in parallel threads, so the memory used is bounded by a few blocks per thread,
+independent of the number of runs.
+
+Optionally, the runs are registered before accumulating: A (y, x) shift of each run relative to a reference run is
+estimated by template matching on the sum images of the runs (see
+:func:`snomtools.evaluation.driftcorrection.Drift.template_matching`) and applied to every block of the run, with a
+halo of the largest shift read from the neighbouring blocks, as in
+:class:`snomtools.evaluation.driftcorrection.DriftStep`. Elements shifted in from outside the image are NaN and are
+not counted, so the number of accumulated runs is given per element.
+
+Example::
+
+	runs = ["Durchlauf{0:02d}.hdf5".format(i) for i in range(1, 11)]
+	avg = RunAccumulator(runs, register=True)
+	result = avg.run(h5target="Summe.hdf5")
+	mean = result.get_datafield('mean')
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import scipy.ndimage
+from six import string_types
+import snomtools.calcs.units as u
+import snomtools.data.datasets
+import snomtools.data.h5tools
+import snomtools.data.profiling
+from snomtools.data.tools import chunk_grid
+from snomtools.evaluation.driftcorrection import Drift
+
+__author__ = 'Michael Hartelt'
+
+if '-v' in sys.argv:
+	verbose = True
+else:
+	verbose = False
+
+
+class RunAccumulator(object):
+	"""
+	Accumulates a list of runs with identical shape into their sum, mean and variance, streaming them block by block.
+	"""
+
+	def __init__(self, runs, data_id=0, register=False, shifts=None, yAxisID='y', xAxisID='x', reference=0,
+				 template=None, method='cv.TM_CCOEFF_NORMED', subpixel=True, interpolation_order=1):
+		"""
+		:param runs: The runs to accumulate, as DataSets or paths of HDF5 files containing them, which are opened
+			read-only.
+		:type runs: sequence of (snomtools.data.datasets.DataSet *or* str)
+
+		:param data_id: An identifier of the DataArray in the runs to accumulate. Default: The first one.
+
+		:param bool register: Estimate a (y, x) shift for each run from its sum image and apply it before
+			accumulating.
+
+		:param shifts: Precalculated (y, x) shifts of the runs relative to the reference, in pixels. If given,
+			these are applied instead of estimating them.
+		:type shifts: sequence of tuple(float)
+
+		:param yAxisID: The identifier of the first axis of the image, i.e. y
+
+		:param xAxisID: The identifier of the second axis of the image, i.e. x
+
+		:param int reference: The index of the run the others are registered to.
+
+		:param template: The 2D template for the template matching, as data of the reference sum image. Default: The
+			central 2/5 to 3/5 field of the reference sum image, as in
+			:func:`snomtools.evaluation.driftcorrection.Drift.guess_templatedata`.
+
+		:param str method: The correlation method for the template matching. See
+			:func:`snomtools.evaluation.driftcorrection.Drift.template_matching`.
+
+		:param bool subpixel: Estimate subpixel accurate shifts.
+
+		:param int interpolation_order: The order of the spline interpolation used to apply the shifts.
+			See: :func:`scipy.ndimage.shift` for details.
+		"""
+		self.runs = []
+		for run in runs:
+			if isinstance(run, string_types):
+				run = snomtools.data.datasets.DataSet.from_h5file(run, readonly=True)
+			assert isinstance(run, snomtools.data.datasets.DataSet), "No DataSet given as run to accumulate."
+			self.runs.append(run)
+		assert self.runs, "No runs given to accumulate."
+		self.data_id = data_id
+		self.shape = tuple(self.runs[0].shape)
+		for run in self.runs:
+			assert tuple(run.shape) == self.shape, "Runs with differing shapes given: {0} and {1}".format(
+				self.shape, tuple(run.shape))
+		self.reference = reference
+		self.yAxisID = self.runs[reference].get_axis_index(yAxisID)
+		self.xAxisID = self.runs[reference].get_axis_index(xAxisID)
+		self.template = template
+		self.method = method
+		self.subpixel = subpixel
+		self.interpolation_order = interpolation_order
+		if shifts is not None:
+			shifts = np.array(shifts, dtype=float)
+			assert shifts.shape == (len(self.runs), 2), "Shifts must be given as one (y, x) pair per run."
+			self.shifts = shifts
+		elif register:
+			self.shifts = self.estimate_shifts()
+		else:
+			self.shifts = None
+
+	def sum_image(self, run_index):
+		"""
+		The sum image of a run, projected on the image axes.
+
+		:param int run_index: The index of the run.
+
+		:return: The 2D data of the sum image, with the y axis first.
+		:rtype: numpy.ndarray
+		"""
+		da = self.runs[run_index].get_datafield(self.data_id)
+		image = da.project_nd(*sorted((self.yAxisID, self.xAxisID)))
+		image = np.asarray(image.magnitude, dtype=np.float32)
+		if self.yAxisID > self.xAxisID:
+			image = image.T
+		return image
+
+	@snomtools.data.profiling.profiled("RunAccumulator.estimate_shifts")
+	def estimate_shifts(self):
+		"""
+		Estimates the (y, x) shift of each run relative to the reference run by template matching on their sum
+		images.
+
+		:return: The shifts, one (y, x) pair per run. Applying them with :func:`scipy.ndimage.shift` registers the
+			runs to the reference.
+		:rtype: numpy.ndarray
+		"""
+		reference_image = self.sum_image(self.reference)
+		if self.template is None:
+			ny, nx = reference_image.shape
+			template = reference_image[ny * 2 // 5:ny * 3 // 5, nx * 2 // 5:nx * 3 // 5]
+		else:
+			template = np.asarray(self.template, dtype=np.float32)
+		origin, _ = Drift.template_matching(reference_image, template, self.method, self.subpixel)
+		shifts = np.zeros((len(self.runs), 2))
+		for i in range(len(self.runs)):
+			if i == self.reference:
+				continue
+			position, _ = Drift.template_matching(self.sum_image(i), template, self.method, self.subpixel)
+			shifts[i] = np.array(origin, dtype=float) - np.array(position, dtype=float)
+			if verbose:
+				print("Run {0:d} shift (y, x): {1}".format(i, shifts[i]))
+		return shifts
+
+	def halo(self):
+		"""
+		The halo along each axis that is read around each block to apply the shifts.
+
+		:rtype: numpy.ndarray
+		"""
+		halo = np.zeros(len(self.shape), dtype=np.int64)
+		if self.shifts is not None:
+			halo[[self.yAxisID, self.xAxisID]] = np.ceil(abs(self.shifts).max(axis=0)).astype(int) + \
+												 self.interpolation_order
+		return halo
+
+	def _read_block(self, source, run_index, start, stop, halo, dtype):
+		"""
+		Reads a block of a run, shifted by the shift of the run if registering.
+		"""
+		if self.shifts is None or not self.shifts[run_index].any():
+			return np.asarray(source[tuple(slice(a, b) for a, b in zip(start, stop))], dtype=dtype)
+		lo = np.maximum(start - halo, 0)
+		hi = np.minimum(stop + halo, self.shape)
+		data = np.asarray(source[tuple(slice(a, b) for a, b in zip(lo, hi))], dtype=dtype)
+		shift = np.zeros(len(self.shape))
+		shift[[self.yAxisID, self.xAxisID]] = self.shifts[run_index]
+		shifted = np.empty(data.shape, dtype=dtype)
+		scipy.ndimage.shift(data, shift, shifted, order=self.interpolation_order, mode='constant', cval=np.nan,
+							prefilter=self.interpolation_order > 1)
+		return shifted[tuple(slice(a, b) for a, b in zip(start - lo, stop - lo))]
+
+	@snomtools.data.profiling.profiled("RunAccumulator.run")
+	def run(self, h5target=True, blockshape=None, threads=None, dtype=None, ddof=0, label=None):
+		"""
+		Accumulates the runs.
+
+		:param h5target: The h5target for the resulting DataSet: A path of a HDF5 file to write to, True for a temp
+			file or None for numpy mode.
+
+		:param tuple blockshape: The shape of the blocks in which the runs are accumulated. Default: The chunks of the
+			reference run.
+
+		:param int threads: The number of threads processing blocks in parallel. Default: The number of CPUs.
+
+		:param dtype: The data type in which the data is accumulated and written. Default: The data type of the
+			reference run, but at least float32.
+
+		:param int ddof: The delta degrees of freedom of the variance, as in :func:`numpy.var`. The variance is
+			divided by :code:`count - ddof`.
+
+		:param str label: The label of the resulting DataSet. Default: The label of the reference run with " runs"
+			appended.
+
+		:return: A DataSet with the axes of the reference run and the DataArrays "sum", "mean", "variance" and
+			"count", the latter holding the number of runs accumulated in each element.
+		:rtype: snomtools.data.datasets.DataSet
+		"""
+		refds = self.runs[self.reference]
+		sources = []
+		for run in self.runs:
+			da = run.get_datafield(self.data_id)
+			if isinstance(da.data, snomtools.data.datasets.Data_Handler_H5):
+				sources.append(da.data.ds_data)
+			else:
+				sources.append(da.data.magnitude)
+		units = [da.get_unit() for da in (run.get_datafield(self.data_id) for run in self.runs)]
+		for unit in units:
+			assert u.same_dimension(u.to_ureg(1, unit), u.to_ureg(1, units[0])), \
+				"Runs with incompatible units given."
+		factors = [u.to_ureg(1, unit).to(units[self.reference]).magnitude for unit in units]
+		shape = self.shape
+		ndim = len(shape)
+		if dtype is None:
+			dtype = np.result_type(sources[self.reference].dtype, np.float32)
+		if blockshape is None:
+			reference_source = sources[self.reference]
+			if isinstance(reference_source, np.ndarray) or reference_source.chunks is None:
+				blockshape = snomtools.data.h5tools.probe_chunksize(shape)
+			else:
+				blockshape = reference_source.chunks
+		blockshape = tuple(min(blockshape[i], shape[i]) for i in range(ndim))
+		starts, stops = chunk_grid(shape, blockshape)
+		halo = self.halo()
+		if label is None:
+			label = refds.label + " runs"
+		if verbose:
+			print("Accumulating {0:d} runs in {1:d} blocks of shape {2}".format(len(self.runs), len(starts),
+																			   blockshape))
+
+		# Prepare outputs:
+		unit = units[self.reference]
+		variance_unit = str((u.to_ureg(1, unit) ** 2).units)
+		ds = snomtools.data.datasets.DataSet(label, plotconf=refds.plotconf, h5target=(h5target or True))
+		arrays = []
+		for fieldlabel, fieldunit, fielddtype in [("sum", unit, dtype), ("mean", unit, dtype),
+												  ("variance", variance_unit, dtype), ("count", '', np.int32)]:
+			h5grp = ds.datafieldgrp
+			if h5grp is not True:  # Proper h5 file mode
+				h5grp = h5grp.require_group(fieldlabel)
+			array = snomtools.data.datasets.DataArray(None, label=fieldlabel, h5target=h5grp)
+			array._data = snomtools.data.datasets.Data_Handler_H5(unit=fieldunit, shape=shape,
+																  h5target=(None if h5grp is True else h5grp),
+																  chunks=blockshape, dtype=fielddtype)
+			arrays.append(array)
+
+		# Process blocks:
+		write_lock = threading.Lock()
+
+		def process(block):
+			start, stop = block
+			selection = tuple(slice(a, b) for a, b in zip(start, stop))
+			blockshape_here = tuple(stop - start)
+			count = np.zeros(blockshape_here, dtype=np.int32)
+			mean = np.zeros(blockshape_here, dtype=dtype)
+			m2 = np.zeros(blockshape_here, dtype=dtype)
+			for i, source in enumerate(sources):
+				data = self._read_block(source, i, start, stop, halo, dtype)
+				if factors[i] != 1:
+					data = data * factors[i]
+				valid = np.isfinite(data)
+				count += valid
+				delta = np.where(valid, data - mean, 0)
+				mean += np.where(valid, delta / np.maximum(count, 1), 0)
+				m2 += np.where(valid, delta * (data - mean), 0)
+			with np.errstate(invalid='ignore', divide='ignore'):
+				variance = np.where(count > ddof, m2 / (count - ddof), np.nan)
+				mean = np.where(count > 0, mean, np.nan)
+			with write_lock:
+				arrays[0]._data.ds_data[selection] = np.where(count > 0, mean * count, 0)
+				arrays[1]._data.ds_data[selection] = mean
+				arrays[2]._data.ds_data[selection] = variance
+				arrays[3]._data.ds_data[selection] = count
+
+		pool = ThreadPool(threads)
+		try:
+			for _ in pool.imap_unordered(process, zip(starts, stops)):
+				pass
+		finally:
+			pool.close()
+			pool.join()
+
+		# Assemble resulting DataSet:
+		if ds.h5target is not True:  # Proper h5 file mode, so write metadata next to data.
+			for array in arrays:
+				array.write_to_h5()
+		ds.datafields = arrays
+		for ax in refds.axes:
+			ds.add_axis(ax)
+		if not h5target:  # Numpy mode was requested.
+			ds = snomtools.data.datasets.DataSet(ds.label, ds.datafields, ds.axes, ds.plotconf)
+		return ds
+
+
+def accumulate_runs(runs, register=False, h5target=True, **kwargs):
+	"""
+	Accumulates a list of runs into their sum, mean and variance. See :class:`RunAccumulator`.
+
+	:param runs: The runs to accumulate, as DataSets or paths of HDF5 files containing them.
+	:type runs: sequence of (snomtools.data.datasets.DataSet *or* str)
+
+	:param bool register: Estimate a (y, x) shift for each run from its sum image and apply it before accumulating.
+
+	:param h5target: The h5target for the resulting DataSet.
+
+	:param kwargs: Further keyword arguments for :class:`RunAccumulator`.
+
+	:return: A DataSet with the DataArrays "sum", "mean", "variance" and "count".
+	:rtype: snomtools.data.datasets.DataSet
+	"""
+	return RunAccumulator(runs, register=register, **kwargs).run(h5target=h5target)
+
+
+if __name__ == '__main__':
+	testruns = []
+	base = np.random.rand(4, 64, 80)
+	for i in range(5):
+		testdata = np.roll(base, (i, -i), axis=(1, 2)) + np.random.rand(4, 64, 80) * 0.01
+		testruns.append(snomtools.data.datasets.DataSet(
+			"run{0:d}".format(i), [snomtools.data.datasets.DataArray(testdata, 'count', label='counts')],
+			[snomtools.data.datasets.Axis(np.arange(4), label='delay'),
+			 snomtools.data.datasets.Axis(np.arange(64), label='y'),
+			 snomtools.data.datasets.Axis(np.arange(80), label='x')]))
+	acc = RunAccumulator(testruns, register=True, subpixel=False)
+	print(acc.shifts)
+	result = acc.run(h5target=None, blockshape=(1, 16, 16))
+	print(np.nanmax(abs(result.get_datafield('mean').get_data().magnitude[:, 8:-8, 8:-8] - base[:, 8:-8, 8:-8])))
@@ -55,16 +55,8 @@ def project_1d(data, plot_dest, axis_id=0, data_id=0, normalization=None, offset
 	if normalization:
 		if normalization == "None":
 			plotdat = sumdat
-		elif normalization in ["maximum", "max"]:
-			plotdat = sumdat / sumdat.max()
-		elif normalization in ["minimum", "min"]:
-			plotdat = sumdat / sumdat.min()
-		elif normalization in ["mean"]:
-			plotdat = sumdat / sumdat.mean()
-		elif normalization in ["absolute maximum", "absmax"]:
-			plotdat = sumdat / abs(sumdat).max()
-		elif normalization in ["absolute minimum", "absmin"]:
-			plotdat = sumdat / abs(sumdat).min()
+		elif normalization in snomtools.data.datasets.normalization_methods:
+			plotdat = sumdat / snomtools.data.datasets.normalization_factor(sumdat, normalization)
 		elif normalization in ["size"]:
 			number_of_pixels = 1
 			for ax_id in sumtup:
@@ -138,16 +130,8 @@ def project_2d(data, plot_dest, axis_vert=0, axis_hori=1, data_id=0, normalizati
 	if normalization:
 		if normalization == "None":
 			plotdat = sumdat
-		elif normalization in ["maximum", "max"]:
-			plotdat = sumdat / sumdat.max()
-		elif normalization in ["minimum", "min"]:
-			plotdat = sumdat / sumdat.min()
-		elif normalization in ["mean"]:
-			plotdat = sumdat / sumdat.mean()
-		elif normalization in ["absolute maximum", "absmax"]:
-			plotdat = sumdat / abs(sumdat).max()
-		elif normalization in ["absolute minimum", "absmin"]:
-			plotdat = sumdat / abs(sumdat).min()
+		elif normalization in snomtools.data.datasets.normalization_methods:
+			plotdat = sumdat / snomtools.data.datasets.normalization_factor(sumdat, normalization)
 		elif normalization in ["size"]:
 			number_of_pixels = 1
 			for ax_id in sumtup: